@@ -0,0 +1,114 @@
+"""Broadcast latency benchmark.
+
+Compares the old sequential per-recipient json.dumps/send loop with
+serialize-once publishing into per-connection outbound queues
+(server/broadcast.py, server/outbound.py), using in-process fake sockets so
+10k clients fit on one machine. One recipient in every room is slow to show
+that it no longer delays the others.
+
+Usage: python bench/broadcast_bench.py [--rounds N] [--slow-ms MS]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import broadcast  # noqa: E402
+from codec import Frame  # noqa: E402
+from outbound import OutboundQueue  # noqa: E402
+
+SIZES = (100, 1000, 10000)
+
+
+class FakeSocket:
+    """Stand-in for a WebSocketResponse that records delivery latency"""
+
+    def __init__(self, latencies, delay=0.0):
+        self.latencies = latencies
+        self.delay = delay
+        self.started = 0.0
+        self.queue = None
+
+    async def _deliver(self):
+        # A healthy socket's write completes without suspending; a slow
+        # peer's write waits for the transport to drain
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - self.started)
+
+    async def send_str(self, data):
+        await self._deliver()
+
+    async def send_frame(self, data, opcode):
+        await self._deliver()
+
+
+def make_message():
+    return {
+        'type': 'chat',
+        'username': 'alice',
+        'message': 'Hello everyone! ' * 4,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+async def sequential_broadcast(clients, message):
+    """The pre-engine behaviour: encode and await each recipient in turn"""
+    for client in clients:
+        await client.send_str(json.dumps(message))
+
+
+async def queued_broadcast(clients, message):
+    """Encode once, enqueue everywhere, then wait for the fast peers to drain"""
+    broadcast.publish([client.queue for client in clients], Frame(message))
+    while len(clients[0].latencies) < len(clients) - 1:
+        await asyncio.sleep(0)
+
+
+async def run(strategy, size, rounds, slow_delay):
+    latencies = []
+    clients = [FakeSocket(latencies) for _ in range(size)]
+    # Put the slow peer early so it would stall everyone behind it
+    clients[size // 10].delay = slow_delay
+    if strategy is queued_broadcast:
+        for client in clients:
+            client.queue = OutboundQueue(client, maxsize=rounds + 1).start()
+    fast = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for client in clients:
+            client.started = started
+        del latencies[:]
+        await strategy(clients, make_message())
+        fast.extend(sorted(latencies)[:size - 1])
+    for client in clients:
+        if client.queue is not None:
+            await client.queue.close()
+    fast.sort()
+    return {
+        'p50_ms': statistics.median(fast) * 1000,
+        'p99_ms': fast[int(len(fast) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--slow-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'strategy':>11} {'p50 ms':>10} {'p99 ms':>10}")
+    for size in SIZES:
+        for name, strategy in (('sequential', sequential_broadcast), ('queued', queued_broadcast)):
+            result = await run(strategy, size, args.rounds, args.slow_ms / 1000)
+            print(f"{size:>8} {name:>11} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""Wire codec throughput benchmark.
+
+Encodes and decodes typical chat frames (a room message, a private
+message, a 200-user users_list and a 100-message history batch) with
+the stdlib json module the server used before, the JSON codec of
+server/codec.py (orjson when installed) and MessagePack when the msgpack
+package is installed. Reports frames per second, MB/s and frame size.
+
+Usage: python bench/codec_bench.py [--seconds S]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import codec  # noqa: E402
+
+
+class StdlibJson:
+    """The server's previous encoding: json.dumps(...).encode() and json.loads()"""
+    name = 'stdlib json'
+    binary = False
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message).encode('utf-8')
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data)
+
+
+def chat_message(i=0):
+    return {
+        'type': 'chat',
+        'username': f'user{i % 50}',
+        'room': 'lobby',
+        'message': 'Hello everyone, how is it going? ' * 2,
+        'timestamp': datetime.now().isoformat(),
+        'id': 1700000000000000 + i,
+    }
+
+
+def payloads():
+    return {
+        'chat': chat_message(),
+        'private': {
+            'type': 'private',
+            'from': 'alice',
+            'message': 'See you at 5?',
+            'timestamp': datetime.now().isoformat(),
+        },
+        'users_list': {
+            'type': 'users_list',
+            'room': 'lobby',
+            'users': [f'user{i}' for i in range(200)],
+            'timestamp': datetime.now().isoformat(),
+        },
+        'history': {
+            'type': 'history',
+            'room': 'lobby',
+            'messages': [chat_message(i) for i in range(100)],
+        },
+    }
+
+
+def frame_data(impl, encoded):
+    """What aiohttp hands the server's decoder: str for text frames, bytes for binary ones"""
+    return encoded if impl.binary else encoded.decode('utf-8')
+
+
+def rate(fn, arg, seconds):
+    """Calls per second of fn(arg), measured for about the given time"""
+    calls = 0
+    batch = 64
+    started = time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(batch):
+            fn(arg)
+        calls += batch
+        now = time.perf_counter()
+        if now >= deadline:
+            return calls / (now - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=0.5, help='time spent on each measurement')
+    args = parser.parse_args()
+
+    codecs = [StdlibJson]
+    codecs.extend(codec.CODECS.values())
+    json_impl = 'orjson' if codec.orjson is not None else 'stdlib fallback'
+    print(f"json codec uses {json_impl}; msgpack {'available' if codec.MSGPACK else 'not installed'}")
+    print(f"{'payload':>10} {'codec':>12} {'bytes':>7} {'encode/s':>11} {'decode/s':>11} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for label, message in payloads().items():
+        for impl in codecs:
+            encoded = impl.encode(message)
+            encode_rate = rate(impl.encode, message, args.seconds)
+            decode_rate = rate(impl.decode, frame_data(impl, encoded), args.seconds)
+            size = len(encoded)
+            print(f"{label:>10} {impl.name:>12} {size:>7} {encode_rate:>11,.0f} {decode_rate:>11,.0f} "
+                  f"{encode_rate * size / 1e6:>9.1f} {decode_rate * size / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""permessage-deflate benchmark.
+
+Compares what a room broadcast costs to compress the way aiohttp does it
+by default, with one compressor per connection that deflates every frame
+for every recipient, against server/compression.py, which compresses a
+payload once and shares the bytes and sends small frames as they are.
+The payloads are a users_list for a full room, a chat message and a
+typing update, with different contents each round. Also prints the wire
+size of each at each zlib level.
+
+A compressor that keeps its window can refer back to earlier messages,
+so structured frames like chat messages come out smaller per connection
+than compressed alone. The table shows both sides of that trade.
+
+Usage: python bench/compression_bench.py [--recipients N] [--rounds N]
+"""
+import argparse
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from codec import JSON  # noqa: E402
+from compression import Deflater  # noqa: E402
+
+WORDS = 'hello there how is everyone doing today the build is green again lunch anyone'.split()
+
+
+def users_list(i):
+    return JSON.encode({'type': 'users_list', 'room': 'lobby', 'users': [f'user-{n:04d}' for n in range(500 + i)],
+                        'timestamp': f'2026-10-17T12:00:{i % 60:02d}.{i:06d}'})
+
+
+def chat(i):
+    message = ' '.join(WORDS[(i * 7 + n) % len(WORDS)] for n in range(6 + i % 5))
+    return JSON.encode({'type': 'chat', 'room': 'lobby', 'username': f'user-{i * 37 % 500:04d}', 'id': 123456 + i,
+                        'message': message, 'timestamp': f'2026-10-17T12:00:{i % 60:02d}.{i:06d}'})
+
+
+def typing(i):
+    return JSON.encode({'type': 'typing', 'room': 'lobby', 'username': f'user-{i * 37 % 500:04d}',
+                        'is_typing': i % 2 == 0})
+
+
+PAYLOADS = {'users_list (500 users)': users_list, 'chat': chat, 'typing': typing}
+
+
+def per_connection(payload, compressors):
+    """aiohttp's default: every recipient's own compressor deflates the frame"""
+    size = 0
+    for compressor in compressors:
+        size += len(compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return size
+
+
+def shared(payload, deflater, recipients):
+    """compression.py: the first recipient compresses, the rest reuse the bytes"""
+    size = 0
+    for _ in range(recipients):
+        deflated = deflater.compress(payload, 15)
+        size += len(deflated) if deflated is not None else len(payload)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'payload':>24} {'bytes':>6} {'level 1':>8} {'level 6':>8} {'level 9':>8}")
+    for name, make in PAYLOADS.items():
+        payload = make(0)
+        sizes = [len(zlib.compress(payload, level)) for level in (1, 6, 9)]
+        print(f"{name:>24} {len(payload):>6} {sizes[0]:>8} {sizes[1]:>8} {sizes[2]:>8}")
+
+    print(f"\nms per broadcast to {args.recipients} recipients, and KB written")
+    print(f"{'payload':>24} {'per-conn ms':>12} {'per-conn KB':>12} {'shared ms':>10} {'shared KB':>10}")
+    for name, make in PAYLOADS.items():
+        payloads = [make(i) for i in range(args.rounds)]
+        compressors = [zlib.compressobj(1, zlib.DEFLATED, -15) for _ in range(args.recipients)]
+        before = 0
+        started = time.perf_counter()
+        for payload in payloads:
+            before += per_connection(payload, compressors)
+        before_ms = (time.perf_counter() - started) / args.rounds * 1000
+
+        deflater = Deflater(level=6, threshold=256)
+        after = 0
+        started = time.perf_counter()
+        for payload in payloads:
+            after += shared(payload, deflater, args.recipients)
+        after_ms = (time.perf_counter() - started) / args.rounds * 1000
+        before, after = before / args.rounds, after / args.rounds
+        print(f"{name:>24} {before_ms:>12.2f} {before / 1024:>12.1f} {after_ms:>10.2f} {after / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
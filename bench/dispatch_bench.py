@@ -0,0 +1,127 @@
+"""Message dispatch overhead benchmark.
+
+Measures the cost per message of routing a decoded client message to
+its handler, with handlers that do nothing: the if/elif chain over
+msg_type the server used before against server/dispatcher.py, both bare
+and with the field validation the server registers. The first message
+mix is mostly chat and typing, like a busy room, which sit near the top
+of the old chain; the second is only list_rooms, its last branch.
+
+Usage: python bench/dispatch_bench.py [--messages N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from dispatcher import Dispatcher, Field  # noqa: E402
+
+TYPES = ('login', 'chat', 'private', 'typing', 'join_room', 'history', 'leave_room', 'list_rooms')
+MIX = {'chat': 50, 'typing': 35, 'private': 8, 'history': 2, 'join_room': 2, 'leave_room': 1, 'list_rooms': 1, 'login': 1}
+
+
+class Session:
+    username = 'alice'
+
+
+def noop(session, data):
+    pass
+
+
+def if_chain(session, data):
+    """The shape of the old handler: a chain of string comparisons"""
+    msg_type = data.get('type', '')
+    if msg_type == 'login':
+        noop(session, data)
+    elif msg_type == 'chat':
+        if session.username:
+            noop(session, data)
+    elif msg_type == 'private':
+        if session.username:
+            noop(session, data)
+    elif msg_type == 'typing':
+        noop(session, data)
+    elif msg_type == 'join_room':
+        if session.username:
+            noop(session, data)
+    elif msg_type == 'history':
+        noop(session, data)
+    elif msg_type == 'leave_room':
+        noop(session, data)
+    elif msg_type == 'list_rooms':
+        noop(session, data)
+    else:
+        noop(session, data)
+
+
+def build_dispatcher(validated):
+    dispatcher = Dispatcher(unknown=noop, unauthenticated=noop)
+    room, since = Field(str, 'lobby'), Field(int)
+    fields = {
+        'login': {'username': Field(str), 'codec': Field(str), 'since': since},
+        'chat': {'message': Field(str, ''), 'room': room},
+        'private': {'to': Field(str, ''), 'message': Field(str, '')},
+        'typing': {'room': room, 'is_typing': Field(bool, True)},
+        'join_room': {'room': room, 'since': since},
+        'history': {'room': room, 'since': since},
+        'leave_room': {'room': room},
+        'list_rooms': {},
+    }
+    for msg_type in TYPES:
+        dispatcher.register(msg_type, noop, fields[msg_type] if validated else None,
+                            login_required=msg_type in ('chat', 'private', 'join_room'))
+    return dispatcher
+
+
+def make_messages(count, rng, mix):
+    samples = {
+        'login': {'type': 'login', 'username': 'alice', 'since': 1792216395015002},
+        'chat': {'type': 'chat', 'room': 'lobby', 'message': 'Hello everyone!'},
+        'private': {'type': 'private', 'to': 'bob', 'message': 'Hi Bob!'},
+        'typing': {'type': 'typing', 'room': 'lobby', 'is_typing': True},
+        'join_room': {'type': 'join_room', 'room': 'dev'},
+        'history': {'type': 'history', 'room': 'lobby', 'since': 1792216395015002},
+        'leave_room': {'type': 'leave_room', 'room': 'dev'},
+        'list_rooms': {'type': 'list_rooms'},
+    }
+    types = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    # Fresh dicts, as each decoded frame would be
+    return [dict(samples[msg_type]) for msg_type in types]
+
+
+def measure(dispatch, messages, session):
+    started = time.perf_counter()
+    for data in messages:
+        dispatch(session, data)
+    return (time.perf_counter() - started) / len(messages) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    session = Session()
+
+    strategies = (
+        ('if/elif chain', if_chain),
+        ('dispatcher', build_dispatcher(validated=False).dispatch),
+        ('dispatcher + fields', build_dispatcher(validated=True).dispatch),
+    )
+    mixes = (('chat mix', MIX), ('list_rooms', {'list_rooms': 1}))
+    print(f"{'strategy':>20}" + ''.join(f"{label + ' ns/msg':>22}" for label, _ in mixes))
+    for name, dispatch in strategies:
+        row = f"{name:>20}"
+        for _, mix in mixes:
+            best = min(measure(dispatch, make_messages(args.messages, rng, mix), session)
+                       for _ in range(args.repeat))
+            row += f"{best:>22.0f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Heartbeat bookkeeping benchmark.
+
+Simulates N connections on a virtual clock and times one heartbeat tick
+two ways: scanning every connection for silence (what a per-tick sweep
+over the registry costs) against the timer wheel of server/heartbeat.py,
+which only looks at connections that came due. Both ping the same silent
+connections, and every ping is answered, so nothing is closed.
+
+Run for a busy server, where half the clients send something each second
+and pings are rare, and a quiet one, where 5% do and most of the work is
+sending pings.
+
+Usage: python bench/heartbeat_bench.py [--ticks N]
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from heartbeat import Heartbeat  # noqa: E402
+from registry import Session  # noqa: E402
+
+INTERVAL = 20.0
+TIMEOUT = 10.0
+
+
+class Clock:
+    now = None
+
+
+class AnsweringSocket:
+    """Answers every ping at once"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.session = None
+        self.pings = 0
+
+    async def ping(self):
+        self.pings += 1
+        self.session.last_seen = self.clock.now
+
+    async def close(self, code=1000, message=b''):
+        raise AssertionError("nothing should be closed")
+
+
+def make_sessions(n, clock):
+    sessions = []
+    for _ in range(n):
+        ws = AnsweringSocket(clock)
+        ws.session = Session(ws)
+        sessions.append(ws.session)
+    return sessions
+
+
+def scan(sessions, now):
+    """The sweep: look at every connection on every tick"""
+    for session in sessions:
+        if session.pinged_at is not None:
+            if session.last_seen >= session.pinged_at:
+                session.pinged_at = None
+            elif now - session.pinged_at >= TIMEOUT:
+                raise AssertionError("nothing should be closed")
+        if session.pinged_at is None and now - session.last_seen >= INTERVAL:
+            session.pinged_at = now
+            asyncio.ensure_future(session.ws.ping())
+
+
+async def simulate(n, ticks, active, use_wheel):
+    clock = Clock()
+    sessions = make_sessions(n, clock)
+    heartbeat = Heartbeat(INTERVAL, TIMEOUT, idle_timeout=0, tick=1.0)
+    # The virtual clock starts at the wheel's next whole tick
+    start = clock.now = float(math.ceil(time.perf_counter()))
+    for session in sessions:
+        if use_wheel:
+            heartbeat.add(session, now=start)
+        else:
+            session.last_seen = start
+    rng = random.Random(1)
+    per_tick = max(int(n * active), 1)
+    elapsed = 0.0
+    for tick in range(1, ticks + 1):
+        clock.now = start + tick
+        for session in rng.sample(sessions, per_tick):
+            session.last_seen = clock.now
+        started = time.perf_counter()
+        if use_wheel:
+            heartbeat.check(clock.now)
+        else:
+            scan(sessions, clock.now)
+        elapsed += time.perf_counter() - started
+        await asyncio.sleep(0)  # Deliver the pings
+    pings = sum(session.ws.pings for session in sessions)
+    return elapsed / ticks * 1e6, pings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ticks', type=int, default=120)
+    args = parser.parse_args()
+
+    print(f"{'active/s':>8} {'clients':>8} {'scan us/tick':>13} {'wheel us/tick':>14} {'pings':>8}")
+    for active in (0.5, 0.05):
+        for n in (1000, 10000, 100000):
+            scan_micros, scan_pings = await simulate(n, args.ticks, active, use_wheel=False)
+            wheel_micros, wheel_pings = await simulate(n, args.ticks, active, use_wheel=True)
+            assert scan_pings == wheel_pings, (scan_pings, wheel_pings)
+            print(f"{active:>8.0%} {n:>8} {scan_micros:>13.1f} {wheel_micros:>14.1f} {wheel_pings:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
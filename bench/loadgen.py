@@ -0,0 +1,445 @@
+"""WebSocket load generator for the chat server.
+
+Opens thousands of concurrent clients against /ws from one process, logs
+them in, spreads them over rooms and runs a timed mix of chat, private
+and typing messages from a share of them. It reports as JSON:
+
+- connect: connections per second and handshake latency percentiles
+- latency: end-to-end delivery latency percentiles for chat and private
+  messages (senders stamp each message, receivers in the same process
+  read the stamp, so there is a single clock)
+- throughput: messages sent and frames delivered per second
+- server: RSS per connection and CPU use, read from /proc (Linux, when
+  the server's pid is known), summed over its worker processes
+- client: the load generator's own CPU use; close to 100% means it was
+  the bottleneck and the numbers understate the server. Both run on the
+  same machine, so server and client use adding up to the cpu_count in
+  the report means the machine itself was saturated
+
+With --compare, the headline numbers are also printed next to those of an
+earlier report, to spot regressions between versions.
+
+By default a server is started on a free local port with rate limits and
+connection caps off (every client shares 127.0.0.1) and history kept in
+memory; --workers runs it as that many worker processes. Pass --url to
+load a running server instead, with --server-pid to also get its RSS and
+CPU.
+
+Usage: python bench/loadgen.py [--clients N] [--rooms N] [--senders FRACTION]
+                               [--rate PER_SECOND] [--mix chat=70,private=20,typing=10]
+                               [--duration SECONDS] [--codec json|msgpack] [--workers N]
+                               [--url ws://HOST:PORT/ws --server-pid PID] [--output FILE]
+                               [--compare EARLIER.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import aiohttp
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STAMP = 'lg '  # Prefix of a stamped message body: 'lg <perf_counter at send>'
+
+# Server settings for a spawned server: one client IP, no limits, no disk
+SPAWN_ENV = {
+    'HOST': '127.0.0.1',
+    'HISTORY_DIR': '',
+    'MAILBOX_PATH': '',
+    'RATE_LIMIT_SESSION': '0',
+    'RATE_LIMIT_IP': '0',
+    'RATE_LIMITS': '',
+    'RATE_LIMIT_CONNECT': '0',
+    'MAX_CONNECTIONS_PER_IP': '0',
+    'TRUST_FORWARDED_FOR': '0',
+}
+
+
+def percentiles(values):
+    """p50/p90/p99/p99.9 and max in milliseconds, or None without samples"""
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(int(q * len(values)), len(values) - 1)] * 1000  # noqa: E731
+    return {'count': len(values), 'p50_ms': pick(0.5), 'p90_ms': pick(0.9), 'p99_ms': pick(0.99),
+            'p999_ms': pick(0.999), 'max_ms': values[-1] * 1000}
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ('chat', 'private', 'typing'):
+            raise ValueError(f"Unknown message type in --mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# Headline numbers for --compare: path into the report, and whether higher is better
+HEADLINES = (
+    (('connect', 'per_second'), True),
+    (('latency', 'chat', 'p50_ms'), False),
+    (('latency', 'chat', 'p99_ms'), False),
+    (('latency', 'private', 'p99_ms'), False),
+    (('throughput', 'delivered_per_second'), True),
+    (('server', 'rss_per_connection_bytes'), False),
+    (('server', 'cpu_utilization'), False),
+)
+
+
+def lookup(report, path):
+    for key in path:
+        report = report.get(key) if isinstance(report, dict) else None
+    return report
+
+
+def compare(earlier, current):
+    """Lines with each headline number before and after, and the change"""
+    lines = [f"{'metric':>38} {earlier.get('version') or '-':>12} {current.get('version') or '-':>12} {'change':>8}"]
+    for path, higher_is_better in HEADLINES:
+        before, after = lookup(earlier, path), lookup(current, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        flag = ' worse' if worse and abs(change) >= 5 else ''
+        lines.append(f"{'.'.join(path):>38} {before:>12.4g} {after:>12.4g} {change:>+7.1f}%{flag}")
+    return lines
+
+
+def proc_tree(pid):
+    """pid and all of its descendants, such as a server's worker processes"""
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f'/proc/{parent}/task'):
+                with open(f'/proc/{parent}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def proc_rss(pid):
+    """Resident set size in bytes of pid and its children, or None if /proc is not readable"""
+    total = None
+    for process in proc_tree(pid):
+        try:
+            with open(f'/proc/{process}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total = (total or 0) + int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def proc_cpu(pid):
+    """User plus system CPU seconds of pid and its children, or None if /proc is not readable"""
+    total = None
+    for process in proc_tree(pid):
+        try:
+            with open(f'/proc/{process}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total = (total or 0) + (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except OSError:
+            pass
+    return total
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else needed, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def start_server(port, workers=1):
+    env = dict(os.environ, PORT=str(port), **SPAWN_ENV)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server', 'chat_server.py'),
+                               '--workers', str(workers)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # A fresh connection per request, so the kernel hands them to different workers
+    nodes = set()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+        for _ in range(100 + 20 * workers):
+            try:
+                async with session.get(f'http://127.0.0.1:{port}/health') as response:
+                    if response.status == 200:
+                        nodes.add((await response.json())['node'])
+                        if len(nodes) >= workers:
+                            return server
+            except aiohttp.ClientError:
+                pass
+            if server.poll() is not None:
+                break
+            await asyncio.sleep(0.1)
+    server.terminate()  # Not kill: the supervisor stops its workers on SIGTERM
+    raise RuntimeError("Server did not start")
+
+
+class Stats:
+    def __init__(self):
+        self.measuring = False
+        self.sent = {'chat': 0, 'private': 0, 'typing': 0}
+        self.received = {}
+        self.latency = {'chat': [], 'private': []}
+        self.errors = {}
+
+
+class Client:
+    """One simulated user"""
+
+    def __init__(self, index, room, stats, codec):
+        self.index = index
+        self.username = f'lg{index}'
+        self.room = room
+        self.stats = stats
+        self.codec = codec
+        self.ws = None
+        self.ready = asyncio.Event()
+        self.reader = None
+
+    async def connect(self, session, url):
+        self.ws = await session.ws_connect(url, autoping=True, max_msg_size=0)
+        self.reader = asyncio.ensure_future(self.read())
+
+    def send(self, message):
+        if self.codec == 'msgpack':
+            return self.ws.send_bytes(msgpack.packb(message))
+        return self.ws.send_str(json.dumps(message))
+
+    async def login(self):
+        await self.ws.send_str(json.dumps({'type': 'login', 'username': self.username, 'codec': self.codec}))
+
+    async def read(self):
+        stats = self.stats
+        async for msg in self.ws:
+            now = time.perf_counter()
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                data = json.loads(msg.data)
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                data = msgpack.unpackb(msg.data)
+            else:
+                break
+            msg_type = data.get('type')
+            if msg_type == 'room_joined' and data.get('room') == self.room:
+                self.ready.set()
+            elif msg_type == 'error':
+                stats.errors[data.get('message')] = stats.errors.get(data.get('message'), 0) + 1
+            if not stats.measuring:
+                continue
+            stats.received[msg_type] = stats.received.get(msg_type, 0) + 1
+            if msg_type == 'chat' or msg_type == 'private':
+                body = data.get('message', '')
+                if body.startswith(STAMP):
+                    stats.latency[msg_type].append(now - float(body[len(STAMP):]))
+
+    async def join(self, default_room):
+        if self.room != default_room:
+            await self.send({'type': 'leave_room', 'room': default_room})
+            await self.send({'type': 'join_room', 'room': self.room})
+        else:
+            self.ready.set()
+
+    async def run_mix(self, clients, rate, mix, rng):
+        """Send until cancelled, at Poisson distributed times"""
+        kinds, weights = list(mix), list(mix.values())
+        while not self.ws.closed:
+            await asyncio.sleep(rng.expovariate(rate))
+            kind = rng.choices(kinds, weights)[0]
+            stamp = f'{STAMP}{time.perf_counter()!r}'
+            if kind == 'chat':
+                await self.send({'type': 'chat', 'room': self.room, 'message': stamp})
+            elif kind == 'private':
+                target = clients[rng.randrange(len(clients))]
+                await self.send({'type': 'private', 'to': target.username, 'message': stamp})
+            else:
+                await self.send({'type': 'typing', 'room': self.room, 'is_typing': rng.random() < 0.8})
+            self.stats.sent[kind] += 1
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    if args.codec == 'msgpack' and msgpack is None:
+        raise SystemExit("--codec msgpack needs the msgpack package")
+    fd_limit = raise_fd_limit(args.clients * 2 + 64)
+    if fd_limit < args.clients * 2 + 64:
+        print(f"warning: open file limit {fd_limit} may be too low for {args.clients} clients", file=sys.stderr)
+
+    server, server_pid, url = None, args.server_pid, args.url
+    if url is None:
+        port = free_port()
+        server = await start_server(port, args.workers)
+        server_pid, url = server.pid, f'ws://127.0.0.1:{port}/ws'
+    stats = Stats()
+    rng = random.Random(args.seed)
+    rooms = [args.default_room] if args.rooms <= 1 else [f'load-{i}' for i in range(args.rooms)]
+    clients = [Client(i, rooms[i % len(rooms)], stats, args.codec) for i in range(args.clients)]
+    result = {
+        'version': git_version(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+    }
+
+    rss_idle = proc_rss(server_pid) if server_pid else None
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        try:
+            # Connect
+            gate = asyncio.Semaphore(args.concurrency)
+            handshakes, failures = [], {}
+
+            async def connect(client):
+                async with gate:
+                    started = time.perf_counter()
+                    try:
+                        await client.connect(session, url)
+                        handshakes.append(time.perf_counter() - started)
+                    except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                        failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(connect(client) for client in clients))
+            elapsed = time.perf_counter() - started
+            clients = [client for client in clients if client.ws is not None]
+            result['connect'] = {'clients': len(clients), 'failed': failures, 'seconds': elapsed,
+                                 'per_second': len(clients) / elapsed if elapsed else None,
+                                 'handshake': percentiles(handshakes)}
+            rss_connected = proc_rss(server_pid) if server_pid else None
+
+            # Log in and spread over the rooms
+            started = time.perf_counter()
+            for i in range(0, len(clients), args.concurrency):
+                batch = clients[i:i + args.concurrency]
+                await asyncio.gather(*(client.login() for client in batch))
+                await asyncio.gather(*(client.join(args.default_room) for client in batch))
+            try:
+                await asyncio.wait_for(asyncio.gather(*(client.ready.wait() for client in clients)), args.timeout)
+            except asyncio.TimeoutError:
+                pass
+            result['login'] = {'ready': sum(client.ready.is_set() for client in clients),
+                               'seconds': time.perf_counter() - started}
+            await asyncio.sleep(1.5)  # Let the join presence updates go out before measuring
+            rss_loaded = proc_rss(server_pid) if server_pid else None
+
+            # Message mix
+            senders = clients[:max(int(len(clients) * args.senders), 1)]
+            server_cpu = proc_cpu(server_pid) if server_pid else None
+            client_cpu = time.process_time()
+            stats.measuring = True
+            started = time.perf_counter()
+            tasks = [asyncio.ensure_future(sender.run_mix(clients, args.rate, mix, random.Random(rng.random())))
+                     for sender in senders]
+            await asyncio.sleep(args.duration)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            elapsed = time.perf_counter() - started
+            client_cpu = time.process_time() - client_cpu
+            if server_cpu is not None:
+                server_cpu = proc_cpu(server_pid) - server_cpu
+            await asyncio.sleep(1.0)  # Deliveries still in flight count, but not towards the time
+            stats.measuring = False
+
+            delivered = sum(stats.received.values())
+            result['latency'] = {kind: percentiles(values) for kind, values in stats.latency.items()}
+            result['throughput'] = {
+                'seconds': elapsed,
+                'senders': len(senders),
+                'sent': dict(stats.sent),
+                'sent_per_second': sum(stats.sent.values()) / elapsed,
+                'delivered': dict(sorted(stats.received.items())),
+                'delivered_per_second': delivered / elapsed,
+            }
+            result['errors'] = stats.errors
+            result['server'] = {
+                'pid': server_pid,
+                'rss_idle_bytes': rss_idle,
+                'rss_connected_bytes': rss_connected,
+                'rss_loaded_bytes': rss_loaded,
+                'rss_per_connection_bytes': (rss_loaded - rss_idle) / len(clients)
+                if rss_loaded is not None and rss_idle is not None and clients else None,
+                'cpu_utilization': server_cpu / elapsed if server_cpu is not None else None,
+            }
+            result['client'] = {'cpu_utilization': client_cpu / elapsed}
+        finally:
+            await asyncio.gather(*(client.ws.close() for client in clients if client.ws is not None),
+                                 return_exceptions=True)
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--rooms', type=int, default=20, help="rooms the clients are spread over")
+    parser.add_argument('--senders', type=float, default=0.1, help="fraction of clients that send")
+    parser.add_argument('--rate', type=float, default=1.0, help="messages per second per sender")
+    parser.add_argument('--mix', default='chat=70,private=20,typing=10', help="weights of the message types")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds of sending")
+    parser.add_argument('--codec', choices=('json', 'msgpack'), default='json')
+    parser.add_argument('--concurrency', type=int, default=200, help="handshakes and logins in flight")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for all logins")
+    parser.add_argument('--default-room', default='lobby', help="the server's DEFAULT_ROOM")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help="load a running server instead of starting one")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes for the spawned server")
+    parser.add_argument('--server-pid', type=int, help="pid of the --url server, for RSS and CPU")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--compare', help="an earlier JSON report to print the changes against")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    result = asyncio.run(run(args))
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    if args.compare:
+        with open(args.compare) as f:
+            earlier = json.load(f)
+        print('\n'.join(compare(earlier, result)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Logging benchmark.
+
+Measures what a log call per inbound message costs the event loop thread:
+an f-string of the whole decoded message written straight to a file by
+a StreamHandler, as the server used to log, against server/logs.py,
+which queues the record for a writer thread, with text and JSON output,
+sampled to 1%, and with the message logger's level above DEBUG so the
+isEnabledFor() guard skips the call. The caller column is the time spent
+in the log call; total also waits for the writer to finish the file.
+
+Writing to a local file is cheap, so the writer thread's formatting,
+which still needs the GIL, can cost the caller about as much as writing
+directly; the queue pays off when the sink blocks, a pipe or terminal
+that is not being read fast enough. Sampling and the level guard skip
+building the record, which is most of the cost.
+
+Usage: python bench/logging_bench.py [--records N]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import logs  # noqa: E402
+
+MESSAGE = {'type': 'chat', 'room': 'lobby', 'message': 'hello there how is everyone doing today'}
+
+
+def run(records, setup, call):
+    """(caller us, total us) per record, logging to a scratch file through setup's handlers"""
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    stderr, sys.stderr = sys.stderr, open(path, 'w')
+    try:
+        setup()
+        logger = logging.getLogger('messages')
+        started = time.perf_counter()
+        for i in range(records):
+            call(logger, i)
+        called = time.perf_counter()
+        logs.close()
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        finished = time.perf_counter()
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+        os.unlink(path)
+    return (called - started) / records * 1e6, (finished - started) / records * 1e6
+
+
+def direct():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(logs.TEXT_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+
+def queued(fmt, level=logging.DEBUG, sample=''):
+    def setup():
+        logs.configure(level='DEBUG', fmt=fmt, queue_size=10 ** 7, sample=sample)
+        logging.getLogger('messages').setLevel(level)
+    return setup
+
+
+def f_string(logger, i):
+    data = dict(MESSAGE, id=i)
+    logger.info(f"Received JSON from client {i}: {data}")
+
+
+def lazy(logger, i):
+    if logger.isEnabledFor(logging.DEBUG) and logs.sampler.keep('chat'):
+        logger.debug("Received %s from client %s", 'chat', i, extra={'msg_type': 'chat', 'client': i})
+
+
+CASES = (
+    ('f-string, direct', direct, f_string),
+    ('queued text', queued('text'), lazy),
+    ('queued json', queued('json'), lazy),
+    ('queued json, 1% sampled', queued('json', sample='chat=0.01'), lazy),
+    ('level above DEBUG', queued('json', level=logging.INFO), lazy),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'case':>24} {'caller us':>10} {'total us':>9}")
+    for name, setup, call in CASES:
+        caller, total = run(args.records, setup, call)
+        print(f"{name:>24} {caller:>10.2f} {total:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Offline mailbox benchmark.
+
+Stores private messages for offline users two ways: committing each one
+from the event loop as it arrives, fsync included, against
+server/mailbox.py, which hands them to a writer thread that commits
+whatever queued up meanwhile as one transaction. Messages arrive in
+bursts, as from many senders in one loop iteration. Prints messages per
+second, the time the event loop spends per message and how many commits
+it took, then the cost of fetching a 100 message mailbox at login.
+
+The database goes in a temporary directory; pass --dir to put it on the
+disk the server would use, as fsync cost depends on it.
+
+Usage: python bench/mailbox_bench.py [--messages N] [--burst N] [--dir DIR]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import metrics  # noqa: E402
+from codec import JSON  # noqa: E402
+from mailbox import SCHEMA, Mailbox  # noqa: E402
+
+PAYLOAD = JSON.encode({'type': 'private', 'from': 'user-0042', 'message': 'are you around later today?',
+                       'timestamp': '2026-10-17T12:00:00.000000'})
+
+
+async def per_message(path, messages, burst):
+    """Commit each message on the event loop"""
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=FULL')
+    db.executescript(SCHEMA)
+    loop_time = 0.0
+    started = time.perf_counter()
+    for i in range(0, messages, burst):
+        burst_started = time.perf_counter()
+        for n in range(i, min(i + burst, messages)):
+            db.execute('INSERT INTO mail (recipient, created, payload) VALUES (?, ?, ?)',
+                       (f'user-{n % 1000}', time.time(), PAYLOAD))
+        loop_time += time.perf_counter() - burst_started
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    db.close()
+    return messages / elapsed, loop_time / messages * 1e6, messages
+
+
+async def group_commit(path, messages, burst):
+    """Queue messages for the mailbox writer thread"""
+    mailbox = Mailbox(path)
+    mailbox.open()
+    # Only users who have logged in get mail
+    await asyncio.gather(*(mailbox.seen(f'user-{n}') for n in range(1000)), mailbox.seen('reader'))
+    commits = metrics.mailbox_batch_size.child()
+    commits_before = sum(commits.counts)
+    loop_time = 0.0
+    pending = []
+    started = time.perf_counter()
+    for i in range(0, messages, burst):
+        burst_started = time.perf_counter()
+        for n in range(i, min(i + burst, messages)):
+            pending.append(mailbox.put(f'user-{n % 1000}', PAYLOAD))
+        loop_time += time.perf_counter() - burst_started
+        await asyncio.sleep(0)
+    await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - started
+    commit_count = sum(commits.counts) - commits_before
+
+    for n in range(100):
+        mailbox.put('reader', PAYLOAD)
+    await mailbox.fetch('reader')
+    fetch_started = time.perf_counter()
+    for _ in range(100):
+        await mailbox.fetch('reader')
+    fetch_us = (time.perf_counter() - fetch_started) / 100 * 1e6
+    mailbox.close()
+    return (messages / elapsed, loop_time / messages * 1e6, commit_count), fetch_us
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        before = await per_message(os.path.join(directory, 'before.db'), args.messages, args.burst)
+        after, fetch_us = await group_commit(os.path.join(directory, 'after.db'), args.messages, args.burst)
+    print(f"{'':>16} {'messages/s':>11} {'loop us/msg':>12} {'commits':>8}")
+    for name, (rate, loop_us, commits) in (('per message', before), ('group commit', after)):
+        print(f"{name:>16} {rate:>11.0f} {loop_us:>12.1f} {commits:>8}")
+    print(f"\nfetch of a 100 message mailbox: {fetch_us:.0f} us, off the event loop")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--burst', type=int, default=20, help="messages arriving in one loop iteration")
+    parser.add_argument('--dir', help="directory for the test databases")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
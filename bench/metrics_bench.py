@@ -0,0 +1,80 @@
+"""Metrics overhead benchmark.
+
+Measures what server/metrics.py adds to the hot path: a counter
+increment, a labeled counter increment, a histogram observation, and the
+full set of updates the server makes for each inbound message (byte and
+type counters, parse and dispatch timings). Also times one /metrics
+render with every series populated.
+
+Usage: python bench/metrics_bench.py [--ops N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+import metrics  # noqa: E402
+
+
+def per_op(fn, ops):
+    started = time.perf_counter()
+    fn(ops)
+    return (time.perf_counter() - started) / ops * 1e9
+
+
+def counter_inc(ops):
+    counter = metrics.bytes_in
+    for _ in range(ops):
+        counter.inc(120)
+
+
+def labeled_inc(ops):
+    counter = metrics.messages_in
+    for _ in range(ops):
+        counter.inc('chat')
+
+
+def histogram_observe(ops):
+    series = metrics.parse_seconds
+    for _ in range(ops):
+        series.observe(0.00003)
+
+
+def per_message(ops):
+    """The updates serve() makes around each inbound message"""
+    perf_counter = time.perf_counter
+    for _ in range(ops):
+        started = perf_counter()
+        metrics.bytes_in.inc(120)
+        parsed = perf_counter()
+        metrics.parse_seconds.observe(parsed - started)
+        metrics.messages_in.inc('chat')
+        metrics.dispatch_seconds.observe(perf_counter() - parsed)
+
+
+def empty_loop(ops):
+    for _ in range(ops):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=1000000)
+    args = parser.parse_args()
+
+    baseline = min(per_op(empty_loop, args.ops) for _ in range(3))
+    print(f"{'operation':>20} {'ns/op':>8}")
+    for name, fn in (('counter inc', counter_inc), ('labeled inc', labeled_inc),
+                     ('histogram observe', histogram_observe), ('per message', per_message)):
+        cost = min(per_op(fn, args.ops) for _ in range(3)) - baseline
+        print(f"{name:>20} {cost:>8.0f}")
+
+    started = time.perf_counter()
+    text = metrics.render()
+    print(f"render: {len(text.splitlines())} lines in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
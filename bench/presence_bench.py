@@ -0,0 +1,120 @@
+"""Typing and presence frame-count benchmark.
+
+Replays a simulated minute of a room where every member is an active
+typist, using the web client's typing behaviour (is_typing true when a
+burst starts and every 3 s during it, false after 1 s idle), plus a
+reconnect storm where every member drops and rejoins within two seconds.
+Counts the frames delivered to clients when each event is fanned out as
+it arrives, as before, against the tick-batched deltas of
+server/presence.py.
+
+Usage: python bench/presence_bench.py [--typists N] [--seconds S]
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from presence import PresenceBatcher  # noqa: E402
+
+ROOM = 'lobby'
+
+
+def typing_events(typists, seconds, rng):
+    """(time, username, is_typing) events a room of busy typists sends"""
+    events = []
+    for i in range(typists):
+        username = f'user{i}'
+        t = rng.uniform(0, 5)
+        while t < seconds:
+            burst = rng.uniform(1, 8)
+            sent = t
+            events.append((t, username, True))
+            while sent + 3 < t + burst:
+                sent += 3
+                events.append((sent, username, True))
+            events.append((t + burst + 1, username, False))
+            t += burst + 1 + rng.uniform(1, 10)
+    events.sort()
+    return events
+
+
+def presence_events(members, rng):
+    """(time, username, joined) events of a reconnect storm"""
+    events = []
+    for i in range(members):
+        dropped = rng.uniform(0, 2)
+        events.append((dropped, f'user{i}', False))
+        events.append((dropped + rng.uniform(0.05, 0.5), f'user{i}', True))
+    events.sort()
+    return events
+
+
+class FrameCounter:
+    def __init__(self, room_size):
+        self.room_size = room_size
+        self.frames = 0
+
+    def send(self, room, message, coalesce_key=None):
+        self.frames += self.room_size
+
+
+def batched_typing_frames(events, room_size, seconds, interval):
+    counter = FrameCounter(room_size)
+    batcher = PresenceBatcher(counter.send, typing_interval=interval)
+    tick = interval
+    for t, username, is_typing in events:
+        while tick <= t:
+            batcher.flush_typing(now=tick)
+            tick += interval
+        batcher.typing(ROOM, username, is_typing)
+    while tick <= seconds + 10:
+        batcher.flush_typing(now=tick)
+        tick += interval
+    return counter.frames
+
+
+def batched_presence_frames(events, room_size, interval):
+    counter = FrameCounter(room_size)
+    batcher = PresenceBatcher(counter.send, presence_interval=interval)
+    tick = interval
+    for t, username, joined in events:
+        while tick <= t:
+            batcher.flush_presence()
+            tick += interval
+        if joined:
+            batcher.joined(ROOM, username)
+        else:
+            batcher.left(ROOM, username)
+    batcher.flush_presence()
+    return counter.frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--typists', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--typing-interval', type=float, default=0.5)
+    parser.add_argument('--presence-interval', type=float, default=1.0)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    typing = typing_events(args.typists, args.seconds, rng)
+    immediate = len(typing) * (args.typists - 1)
+    batched = batched_typing_frames(typing, args.typists, args.seconds, args.typing_interval)
+    print(f"typing:   {len(typing)} client events from {args.typists} typists over {args.seconds:.0f}s")
+    print(f"  immediate fan-out {immediate:>12,} frames")
+    print(f"  batched deltas    {batched:>12,} frames  ({immediate / max(batched, 1):.0f}x fewer)")
+
+    storm = presence_events(args.typists, rng)
+    immediate = len(storm) * (args.typists - 1)
+    batched = batched_presence_frames(storm, args.typists, args.presence_interval)
+    print(f"presence: reconnect storm of {args.typists} users")
+    print(f"  immediate fan-out {immediate:>12,} frames")
+    print(f"  batched deltas    {batched:>12,} frames  ({immediate / max(batched, 1):.0f}x fewer)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Rate limiter benchmark.
+
+Measures what server/ratelimit.py adds per inbound message (the frame
+budgets checked before parsing plus the per-type budget), what dropping a
+flooded frame costs next to decoding it, and how much memory buckets for
+100k connections take and whether they expire without a sweep.
+
+Usage: python bench/ratelimit_bench.py [--ops N]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from codec import JSON  # noqa: E402
+from ratelimit import MessageLimits, RateLimiter  # noqa: E402
+from registry import Session  # noqa: E402
+
+FRAME = '{"type": "chat", "room": "lobby", "message": "hello there, how is everyone doing today?"}'
+
+
+def per_op(fn, ops):
+    started = time.perf_counter()
+    fn(ops)
+    return (time.perf_counter() - started) / ops * 1e9
+
+
+def make_sessions(n):
+    sessions = [Session(object()) for _ in range(n)]
+    for i, session in enumerate(sessions):
+        session.remote = f'10.0.{i // 256 % 256}.{i % 256}'
+    return sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=500000)
+    args = parser.parse_args()
+    sessions = make_sessions(1000)
+
+    def allowed(ops):
+        # Plenty of budget: the cost every well-behaved message pays
+        limits = MessageLimits((1e9, 1e9), (1e9, 1e9), {'chat': (1e9, 1e9)})
+        now = time.perf_counter()
+        for i in range(ops):
+            session = sessions[i % 1000]
+            limits.frame(session, now)
+            limits.message(session, 'chat', now)
+
+    def flooded(ops):
+        # One client far over its budget: every frame is dropped before parsing
+        limits = MessageLimits((1.0, 1.0), (1e9, 1e9), {})
+        now = time.perf_counter()
+        session = sessions[0]
+        for _ in range(ops):
+            limits.frame(session, now)
+
+    def decoded(ops):
+        for _ in range(ops):
+            JSON.decode(FRAME)
+
+    def empty_loop(ops):
+        for i in range(ops):
+            sessions[i % 1000]
+
+    baseline = min(per_op(empty_loop, args.ops) for _ in range(3))
+    print(f"{'operation':>26} {'ns/op':>8}")
+    for name, fn in (('limits, allowed message', allowed), ('limits, flooded frame', flooded),
+                     ('json decode (for scale)', decoded)):
+        print(f"{name:>26} {min(per_op(fn, args.ops) for _ in range(3)) - baseline:>8.0f}")
+
+    keys = 100000
+    limiter = RateLimiter(30.0, 60.0)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    now = 1000.0
+    for key in range(keys):
+        limiter.allow(key, now)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"buckets: {used / keys:.0f} bytes per key for {keys} keys")
+    # Two refill times later, one allow() on another key has let every idle bucket go
+    limiter.allow('other', now + limiter.ttl)
+    limiter.allow('other', now + 2 * limiter.ttl)
+    print(f"buckets left after {2 * limiter.ttl:.0f}s idle: {len(limiter)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Session registry benchmark.
+
+Measures the cost of a login and a private message target lookup against
+server/registry.py with 10 to 50k users already online, next to the old
+linear scan over a {websocket: username} dict.
+
+Usage: python bench/registry_bench.py [--ops N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from registry import SessionRegistry  # noqa: E402
+
+SIZES = (10, 1000, 10000, 50000)
+
+
+def bench_registry(size, ops):
+    registry = SessionRegistry()
+    for i in range(size):
+        registry.login(registry.add(object()), f'user{i}')
+    target = f'user{size - 1}'
+
+    started = time.perf_counter()
+    for i in range(ops):
+        ws = object()
+        registry.login(registry.add(ws), f'new{i}')
+        registry.remove(ws)
+    login_us = (time.perf_counter() - started) / ops * 1e6
+
+    started = time.perf_counter()
+    for _ in range(ops):
+        registry.find(target)
+    lookup_us = (time.perf_counter() - started) / ops * 1e6
+    return login_us, lookup_us
+
+
+def bench_linear_scan(size, ops):
+    clients = {object(): f'user{i}' for i in range(size)}
+    target = f'user{size - 1}'
+    ops = max(1, ops // max(1, size // 100))
+
+    started = time.perf_counter()
+    for _ in range(ops):
+        for ws, name in clients.items():
+            if name == target:
+                break
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'login us':>10} {'lookup us':>10} {'scan us':>10}")
+    for size in SIZES:
+        login_us, lookup_us = bench_registry(size, args.ops)
+        scan_us = bench_linear_scan(size, args.ops)
+        print(f"{size:>8} {login_us:>10.3f} {lookup_us:>10.3f} {scan_us:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
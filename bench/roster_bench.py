@@ -0,0 +1,81 @@
+"""Roster catch-up benchmark.
+
+Measures what bringing a reconnecting client's member list up to date
+costs in a room of 1k to 50k users: building and encoding the full
+users_list snapshot sent on every login before, against the joins and
+leaves since the client's version from server/roster.py, after 10, 100
+and 1000 users came and went while it was away.
+
+Usage: python bench/roster_bench.py [--ops N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from codec import JSON  # noqa: E402
+from registry import SessionRegistry  # noqa: E402
+from roster import Roster  # noqa: E402
+
+SIZES = (1000, 10000, 50000)
+CHURN = (10, 100, 1000)
+ROOM = 'lobby'
+
+
+def build_room(size):
+    registry = SessionRegistry()
+    roster = Roster()
+    names = [f'user{i}' for i in range(size)]
+    for name in names:
+        session = registry.add(object())
+        registry.login(session, name)
+        registry.join(session, ROOM)
+    # Everyone arrived in presence batches of 100
+    for i in range(0, size, 100):
+        roster.apply(ROOM, names[i:i + 100], [])
+    return registry, roster
+
+
+def per_op(fn, ops):
+    started = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'users':>8} {'snapshot us':>12} {'bytes':>8}" + ''.join(f" {f'churn {c} us':>14} {'bytes':>7}"
+                                                              for c in CHURN))
+    for size in SIZES:
+        registry, roster = build_room(size)
+
+        def snapshot():
+            return JSON.encode({'type': 'users_list', 'room': ROOM,
+                                'users': [member.username for member in registry.members(ROOM)],
+                                'version': roster.version(ROOM)})
+
+        row = f"{size:>8} {per_op(snapshot, args.ops):>12.1f} {len(snapshot()):>8}"
+        for churn in CHURN:
+            version = roster.version(ROOM)
+            # Half of the churn are users leaving, half new users arriving, in batches of 10
+            for i in range(0, churn // 2, 5):
+                roster.apply(ROOM, [f'new{churn}-{n}' for n in range(i, i + 5)],
+                             [f'user{n}' for n in range(i, i + 5)])
+
+            def delta():
+                joined, left = roster.changes_since(ROOM, version, size)
+                return JSON.encode({'type': 'users_list', 'room': ROOM, 'since': version, 'joined': joined,
+                                    'left': left, 'version': roster.version(ROOM)})
+
+            row += f" {per_op(delta, args.ops):>14.1f} {len(delta()):>7}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
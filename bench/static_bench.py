@@ -0,0 +1,72 @@
+"""Chat page serving benchmark.
+
+Times building the response for GET / the way root_handler used to (open
+and read the page, rewrite the WebSocket URL, send it uncompressed; the
+page is rebuilt with its CSS and JS inline, as the file used to be)
+against the cached StaticSite of server/static.py, for a first visit and
+for a reload answered with 304. Also prints the bytes each sends.
+
+Usage: python bench/static_bench.py [--requests N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import make_mocked_request  # noqa: E402
+
+from static import WEB_DIR, StaticSite  # noqa: E402
+
+
+async def uncached_page(request):
+    """The previous root_handler"""
+    with open(os.path.join(WEB_DIR, 'index.html'), 'r') as f:
+        html_content = f.read()
+    for name, tag, inline in (('style.css', '<link href="static/style.css" rel="stylesheet">', '<style>{}</style>'),
+                              ('app.js', '<script src="static/app.js"></script>', '<script>{}</script>')):
+        with open(os.path.join(WEB_DIR, 'static', name), 'r') as f:
+            html_content = html_content.replace(tag, inline.format(f.read()))
+    host = request.headers.get('Host', 'localhost:8080')
+    html_content = html_content.replace('ws://localhost:8080/ws', f"ws://{host}/ws")
+    return web.Response(text=html_content, content_type='text/html')
+
+
+def body_size(response):
+    return len(response.body or b'') if response.status == 200 else 0
+
+
+async def measure(handler, headers, requests):
+    request = make_mocked_request('GET', '/', headers=headers)
+    response = await handler(request)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await handler(request)
+    return (time.perf_counter() - started) / requests * 1e6, response.status, body_size(response)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+    site = StaticSite()
+    site.load()
+    base = {'Host': 'chat.example.com', 'Accept-Encoding': 'gzip, deflate, br'}
+    etag = (await site.page_handler(make_mocked_request('GET', '/', headers=base))).headers['ETag']
+
+    print(f"{'handler':>24} {'us/request':>11} {'status':>7} {'bytes':>8}")
+    cases = (
+        ('uncached (before)', uncached_page, base),
+        ('cached, first visit', site.page_handler, base),
+        ('cached, reload', site.page_handler, dict(base, **{'If-None-Match': etag})),
+    )
+    for name, handler, headers in cases:
+        micros, status, size = await measure(handler, headers, args.requests)
+        print(f"{name:>24} {micros:>11.1f} {status:>7} {size:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Worker scaling benchmark.
+
+Runs the load generator (bench/loadgen.py) against a server started with
+1, 2, 4... worker processes and the same client load each time, and
+prints how delivered throughput, delivery latency and server CPU change
+with the worker count. Room members are spread over the workers, so most
+deliveries cross the backplane; the table shows what that relay costs
+against the extra cores.
+
+The load generator runs on the same machine as the server and needs a
+core of its own: with W workers, scaling stops at about cpu_count - 1.
+Pass --output to also keep every run's full report as JSON.
+
+Usage: python bench/workers_bench.py [--workers 1,2,4] [--output FILE] [loadgen options]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import loadgen  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help="worker counts to run, comma separated")
+    parser.add_argument('--output', help="write the JSON reports here")
+    args, rest = parser.parse_known_args()
+    counts = [int(count) for count in args.workers.split(',')]
+
+    reports = {}
+    for workers in counts:
+        run_args = loadgen.build_parser().parse_args(rest + ['--workers', str(workers)])
+        print(f"running with {workers} workers...", file=sys.stderr)
+        reports[workers] = asyncio.run(loadgen.run(run_args))
+
+    print(f"cpu_count: {os.cpu_count()}")
+    print(f"{'workers':>8} {'delivered/s':>12} {'speedup':>8} {'chat p50 ms':>12} {'chat p99 ms':>12} "
+          f"{'server cpu':>11} {'client cpu':>11}")
+    base = reports[counts[0]]['throughput']['delivered_per_second']
+    for workers, report in reports.items():
+        delivered = report['throughput']['delivered_per_second']
+        chat = report['latency']['chat'] or {}
+        cpu = report['server']['cpu_utilization']
+        print(f"{workers:>8} {delivered:>12.0f} {delivered / base if base else 0:>7.2f}x "
+              f"{chat.get('p50_ms', 0):>12.1f} {chat.get('p99_ms', 0):>12.1f} "
+              f"{cpu if cpu is not None else float('nan'):>11.2f} {report['client']['cpu_utilization']:>11.2f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == "__main__":
+    main()
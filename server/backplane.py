@@ -0,0 +1,303 @@
+"""Event backplane shared by several chat server nodes.
+
+A node publishes events to every other node, or sends them to one node by
+id. Each event is a small JSON header plus an optional payload of already
+encoded frame bytes, so a broadcast is serialized once on the node where
+it happens and forwarded to local clients on every other node as-is.
+
+Two implementations ship here:
+
+- InProcessBackplane: nodes in the same process share an InProcessHub.
+  With a single node it is a no-op, which is the default deployment.
+- LocalSocketBackplane: nodes on the same machine connect to a
+  LocalSocketBroker on a Unix domain socket, which relays frames between
+  them. The first node to start hosts the broker if none is running.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import socket
+import struct
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+BACKPLANE = os.environ.get("BACKPLANE", "memory")
+BACKPLANE_SOCKET = os.environ.get("BACKPLANE_SOCKET", "/tmp/chat-backplane.sock")
+
+# Frame layout: header length, payload length, JSON header, payload bytes
+_FRAME_HEAD = struct.Struct('!II')
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Backplane:
+    """Interface every backplane implements.
+
+    handler(header, payload) is called on the event loop for each event
+    another node publishes or sends here, with header['node'] set to the
+    sender. It also receives a 'reset' event whenever this node (re)joins
+    the backplane, and 'node_down' when a peer leaves. publish() and send()
+    never block the caller; delivery happens in the background and in order.
+    """
+
+    def __init__(self, node_id=None):
+        self.node_id = node_id or default_node_id()
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+
+    def publish(self, header, payload=b''):
+        """Deliver an event to every other node"""
+        raise NotImplementedError
+
+    def send(self, node_id, header, payload=b''):
+        """Deliver an event to a single node"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def _dispatch(self, header, payload):
+        try:
+            self._handler(header, payload)
+        except Exception as e:
+            logger.error(f"Error handling backplane event {header.get('kind')}: {e!r}")
+
+
+class InProcessHub:
+    """Routes events between InProcessBackplane nodes of one process"""
+
+    def __init__(self):
+        self.nodes = {}
+
+
+class InProcessBackplane(Backplane):
+    """Backplane for nodes living in the same process"""
+
+    def __init__(self, node_id=None, hub=None):
+        super().__init__(node_id)
+        self.hub = hub or InProcessHub()
+
+    async def start(self, handler):
+        await super().start(handler)
+        self.hub.nodes[self.node_id] = self
+        self._dispatch({'kind': 'reset', 'node': self.node_id}, b'')
+
+    def publish(self, header, payload=b''):
+        header = dict(header, node=self.node_id)
+        loop = asyncio.get_running_loop()
+        for node_id, node in self.hub.nodes.items():
+            if node is not self:
+                loop.call_soon(node._dispatch, header, payload)
+
+    def send(self, node_id, header, payload=b''):
+        node = self.hub.nodes.get(node_id)
+        if node is not None:
+            asyncio.get_running_loop().call_soon(node._dispatch, dict(header, node=self.node_id), payload)
+
+    async def close(self):
+        self.hub.nodes.pop(self.node_id, None)
+        loop = asyncio.get_running_loop()
+        for node in self.hub.nodes.values():
+            loop.call_soon(node._dispatch, {'kind': 'node_down', 'node': self.node_id}, b'')
+
+
+def _pack(header, payload):
+    head = json.dumps(header).encode('utf-8')
+    return _FRAME_HEAD.pack(len(head), len(payload)) + head + payload
+
+
+async def _read_frame(reader):
+    head_len, payload_len = _FRAME_HEAD.unpack(await reader.readexactly(_FRAME_HEAD.size))
+    header = json.loads(await reader.readexactly(head_len))
+    payload = await reader.readexactly(payload_len) if payload_len else b''
+    return header, payload
+
+
+class LocalSocketBroker:
+    """Relays frames between nodes connected over a Unix domain socket.
+
+    A frame whose header carries 'to' goes to that node only, anything
+    else goes to every node but the sender. When a node disconnects the
+    others receive a node_down event so they can forget its users.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or BACKPLANE_SOCKET
+        self._nodes = {}
+        self._server = None
+        self._lock = None
+        self._handlers = set()  # _serve tasks, one per connected node
+
+    async def start(self):
+        """Bind the socket; raises OSError if another broker owns the path"""
+        # The lock file makes exactly one process the broker, even when
+        # several nodes start at once or a crashed broker left its socket behind
+        lock = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            raise
+        self._lock = lock
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        logger.info(f"Backplane broker listening on {self.path}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._nodes.values()):
+            writer.close()
+        # Let each node's handler see its connection end rather than be cancelled with the loop
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout=1)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    async def _serve(self, reader, writer):
+        node_id = None
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            hello, _ = await _read_frame(reader)
+            node_id = hello['node']
+            self._nodes[node_id] = writer
+            while True:
+                header, payload = await _read_frame(reader)
+                frame = _pack(dict(header, node=node_id), payload)
+                target = header.get('to')
+                if target is not None:
+                    peer = self._nodes.get(target)
+                    if peer is not None:
+                        peer.write(frame)
+                else:
+                    for peer_id, peer in self._nodes.items():
+                        if peer_id != node_id:
+                            peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if node_id is not None and self._nodes.get(node_id) is writer:
+                del self._nodes[node_id]
+                frame = _pack({'kind': 'node_down', 'node': node_id}, b'')
+                for peer in self._nodes.values():
+                    peer.write(frame)
+            writer.close()
+            self._handlers.discard(task)
+
+
+class LocalSocketBackplane(Backplane):
+    """Backplane for nodes on one machine, relayed by a LocalSocketBroker.
+
+    Outgoing frames are buffered and flushed by a writer task so publishing
+    never waits on the socket.
+    """
+
+    def __init__(self, node_id=None, path=None):
+        super().__init__(node_id)
+        self.path = path or BACKPLANE_SOCKET
+        self.broker = None
+        self._reader = None
+        self._writer = None
+        self._outgoing = deque()
+        self._wakeup = None
+        self._task = None
+
+    async def start(self, handler):
+        await super().start(handler)
+        self._wakeup = asyncio.Event()
+        await self._connect()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _connect(self):
+        for _ in range(50):
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+            if self.broker is None:
+                # Nobody is serving the socket yet; host the broker here
+                try:
+                    broker = LocalSocketBroker(self.path)
+                    await broker.start()
+                    self.broker = broker
+                    continue
+                except OSError:
+                    pass
+            # Another node is bringing its broker up; give it a moment
+            await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"Could not reach backplane broker at {self.path}")
+
+        self._writer.write(_pack({'node': self.node_id}, b''))
+        # Whatever was queued while disconnected is stale; peers resync on reset
+        self._outgoing.clear()
+        logger.info(f"Node {self.node_id} joined backplane at {self.path}")
+        self._dispatch({'kind': 'reset', 'node': self.node_id}, b'')
+
+    def publish(self, header, payload=b''):
+        self._outgoing.append(_pack(header, payload))
+        self._wakeup.set()
+
+    def send(self, node_id, header, payload=b''):
+        self._outgoing.append(_pack(dict(header, to=node_id), payload))
+        self._wakeup.set()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+        if self.broker is not None:
+            await self.broker.close()
+
+    async def _run(self):
+        """Read events, and reconnect (hosting the broker if needed) when the link drops"""
+        while True:
+            writer = asyncio.ensure_future(self._write_loop())
+            try:
+                while True:
+                    header, payload = await _read_frame(self._reader)
+                    self._dispatch(header, payload)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.error(f"Node {self.node_id} lost its backplane connection, reconnecting")
+            finally:
+                writer.cancel()
+                await asyncio.gather(writer, return_exceptions=True)
+                self._writer.close()
+            await self._connect()
+
+    async def _write_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._outgoing:
+                self._writer.write(b''.join(self._outgoing))
+                self._outgoing.clear()
+                await self._writer.drain()
+
+
+def create_backplane(kind=None, node_id=None):
+    """Build the backplane selected by the BACKPLANE environment variable"""
+    kind = kind or BACKPLANE
+    if kind == 'memory':
+        return InProcessBackplane(node_id)
+    if kind == 'unix':
+        return LocalSocketBackplane(node_id)
+    raise ValueError(f"Unknown backplane: {kind}")
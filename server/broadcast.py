@@ -0,0 +1,44 @@
+from aiohttp import WSMsgType
+
+import metrics
+from compression import deflater, send_deflated
+
+
+async def send_payload(ws, payload, binary=False, wbits=0):
+    """Send an already encoded text (or binary) payload to a single socket.
+
+    wbits is the deflate window ws negotiated if its compression was taken
+    over (see compression.py), else 0. Returns the payload bytes written.
+    """
+    if wbits:
+        deflated = deflater.compress(payload, wbits)
+        if deflated is not None:
+            await send_deflated(ws, deflated, WSMsgType.BINARY if binary else WSMsgType.TEXT)
+            return len(deflated)
+    send_frame = getattr(ws, 'send_frame', None)
+    if send_frame is not None:
+        # aiohttp >= 3.11 (pinned 3.13) writes the shared bytes as-is; the
+        # websockets adapter and older aiohttp fall back to send_str/send_bytes
+        await send_frame(payload, WSMsgType.BINARY if binary else WSMsgType.TEXT)
+    elif binary:
+        await ws.send_bytes(payload)
+    else:
+        await ws.send_str(payload.decode('utf-8'))
+    return len(payload)
+
+
+def publish(queues, frame, key=None):
+    """Hand one frame to each recipient's outbound queue.
+
+    The frame is encoded once per codec in use, however many recipients
+    share it. Enqueueing never waits on a socket; every connection's
+    writer task delivers at its own pace, so a slow peer cannot stall the
+    others. Returns the number of queues that accepted the frame.
+    """
+    accepted = 0
+    for queue in queues:
+        if queue.send(frame, key):
+            accepted += 1
+    if accepted:
+        metrics.messages_out.inc(frame.type, accepted)
+    return accepted
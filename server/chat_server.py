@@ -1,445 +1,769 @@
+import argparse
 import asyncio
+import functools
+import hmac
 import json
 import logging
 import os
+import signal
+import time
 from datetime import datetime
-from aiohttp import web, WSMsgType
+from aiohttp import web
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+import logs
+import metrics
+from broadcast import publish
+from codec import CODECS, JSON, SUBPROTOCOLS, DecodeError, Frame, decode_binary
+from compression import WS_COMPRESSION
+from dispatcher import Dispatcher, Field, ValidationError
+from heartbeat import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, Heartbeat
+from outbound import OUTBOUND_OVERFLOW_POLICY, OUTBOUND_QUEUE_SIZE, OutboundQueue
+from presence import PresenceBatcher
+from ratelimit import Admission, MessageLimits, client_ip
+from backplane import create_backplane
+from history import HISTORY_DIR, HistoryStore, history_frame
+from mailbox import MAILBOX_PATH, Mailbox, mailbox_frame
+from registry import DuplicateUsername, RemoteDirectory, SessionRegistry
+from roster import Roster
+from static import StaticSite
+from transport import WebsocketsConnection, aiohttp_frames
+from workers import EVENT_LOOP, SHUTDOWN_GRACE, WORKERS, Supervisor, use_event_loop, worker_count
+
+# Set up logging: records are written out by a background thread
+logs.configure()
 logger = logging.getLogger(__name__)
+# Per-message debug records, sampled by message type (LOG_SAMPLE)
+message_log = logging.getLogger('messages')
 
-# Store connected clients with their usernames
-connected_clients = {}  # {websocket: username}
+# What to do when a login asks for a username that is already online, here
+# or on another node: 'replace' the old connection, so a client reconnecting
+# before its dead connection is reaped gets its name back, or 'reject' the new login
+DUPLICATE_LOGIN = os.environ.get("DUPLICATE_LOGIN", "replace")
 
-async def handle_client(websocket):
-    """Handle individual client connections"""
-    client_id = id(websocket)
-    username = None
-    
-    logger.info(f"Client {client_id} connected. Total clients: {len(connected_clients)}")
-    
-    try:
-        async for message in websocket:
-            try:
-                # Try to parse as JSON first
-                try:
-                    data = json.loads(message)
-                    logger.info(f"Received JSON from client {client_id}: {data}")
-                    
-                    # Handle different message types
-                    if isinstance(data, dict):
-                        msg_type = data.get('type', '')
-                        
-                        if msg_type == 'login':
-                            # Handle user login
-                            username = data.get('username', f'User_{client_id}')
-                            connected_clients[websocket] = username
-                            
-                            # Send login confirmation
-                            response = {
-                                'type': 'login_success',
-                                'username': username,
-                                'message': f'Welcome {username}!',
-                                'timestamp': datetime.now().isoformat()
-                            }
-                            await websocket.send(json.dumps(response))
-                            
-                            # Notify other clients about new user
-                            await broadcast_to_others(websocket, {
-                                'type': 'user_joined',
-                                'username': username,
-                                'message': f'{username} joined the chat',
-                                'timestamp': datetime.now().isoformat()
-                            })
-                            
-                            # Send current users list
-                            users_list = list(connected_clients.values())
-                            await websocket.send(json.dumps({
-                                'type': 'users_list',
-                                'users': users_list,
-                                'timestamp': datetime.now().isoformat()
-                            }))
-                            
-                        elif msg_type == 'chat':
-                            # Handle chat message
-                            if username:
-                                chat_message = data.get('message', '')
-                                await broadcast_to_all({
-                                    'type': 'chat',
-                                    'username': username,
-                                    'message': chat_message,
-                                    'timestamp': datetime.now().isoformat()
-                                })
-                            else:
-                                await websocket.send(json.dumps({
-                                    'type': 'error',
-                                    'message': 'Please login first',
-                                    'timestamp': datetime.now().isoformat()
-                                }))
-                                
-                        elif msg_type == 'private':
-                            # Handle private message
-                            if username:
-                                target_username = data.get('to', '')
-                                private_message = data.get('message', '')
-                                
-                                # Find target user
-                                target_websocket = None
-                                for ws, uname in connected_clients.items():
-                                    if uname == target_username:
-                                        target_websocket = ws
-                                        break
-                                
-                                if target_websocket:
-                                    # Send to target user
-                                    await target_websocket.send(json.dumps({
-                                        'type': 'private',
-                                        'from': username,
-                                        'message': private_message,
-                                        'timestamp': datetime.now().isoformat()
-                                    }))
-                                    
-                                    # Send confirmation to sender
-                                    await websocket.send(json.dumps({
-                                        'type': 'private_sent',
-                                        'to': target_username,
-                                        'message': private_message,
-                                        'timestamp': datetime.now().isoformat()
-                                    }))
-                                else:
-                                    await websocket.send(json.dumps({
-                                        'type': 'error',
-                                        'message': f'User {target_username} not found',
-                                        'timestamp': datetime.now().isoformat()
-                                    }))
-                            else:
-                                await websocket.send(json.dumps({
-                                    'type': 'error',
-                                    'message': 'Please login first',
-                                    'timestamp': datetime.now().isoformat()
-                                }))
-                                
-                        elif msg_type == 'typing':
-                            # Handle typing indicator
-                            if username:
-                                await broadcast_to_others(websocket, {
-                                    'type': 'typing',
-                                    'username': username,
-                                    'is_typing': data.get('is_typing', True),
-                                    'timestamp': datetime.now().isoformat()
-                                })
-                                
-                        else:
-                            # Unknown message type
-                            response = {'type': 'error', 'message': f'Unknown message type: {msg_type}', 'timestamp': datetime.now().isoformat()}
-                            await websocket.send(json.dumps(response))
-                    
-                except json.JSONDecodeError:
-                    # Handle plain text messages as chat messages
-                    if username:
-                        await broadcast_to_all({
-                            'type': 'chat',
-                            'username': username,
-                            'message': message,
-                            'timestamp': datetime.now().isoformat()
-                        })
-                    else:
-                        await websocket.send(json.dumps({
-                            'type': 'error',
-                            'message': 'Please login first. Send: {"type": "login", "username": "your_name"}',
-                            'timestamp': datetime.now().isoformat()
-                        }))
-                    
-            except Exception as e:
-                logger.error(f"Error processing message from client {client_id}: {e}")
-                error_response = {
-                    'type': 'error',
-                    'message': str(e),
-                    'timestamp': datetime.now().isoformat()
-                }
-                await websocket.send(json.dumps(error_response))
-                
-    except Exception as e:
-        logger.error(f"Error with client {client_id}: {e}")
-    finally:
-        # Cleanup when client disconnects
-        if websocket in connected_clients:
-            username = connected_clients[websocket]
-            del connected_clients[websocket]
-            
-            # Notify other clients about user leaving
-            await broadcast_to_all({
-                'type': 'user_left',
-                'username': username,
-                'message': f'{username} left the chat',
-                'timestamp': datetime.now().isoformat()
-            })
-            
-        logger.info(f"Client {client_id} disconnected. Total clients: {len(connected_clients)}")
+# Room every user joins on login; messages without a 'room' field go here
+DEFAULT_ROOM = os.environ.get("DEFAULT_ROOM", "lobby")
+MAX_ROOM_NAME_LENGTH = 64
 
-async def broadcast_to_others(sender_websocket, message):
-    """Broadcast message to all clients except the sender"""
-    if connected_clients:
-        disconnected_clients = []
-        
-        for client in connected_clients:
-            if client != sender_websocket:
-                try:
-                    await client.send(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error broadcasting to client: {e}")
-                    disconnected_clients.append(client)
-        
-        # Clean up disconnected clients
-        for client in disconnected_clients:
-            if client in connected_clients:
-                del connected_clients[client]
-
-async def broadcast_to_all(message):
-    """Broadcast message to all clients"""
-    if connected_clients:
-        disconnected_clients = []
-        
-        for client in connected_clients:
-            try:
-                await client.send(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Error broadcasting to client: {e}")
-                disconnected_clients.append(client)
-        
-        # Clean up disconnected clients
-        for client in disconnected_clients:
-            if client in connected_clients:
-                del connected_clients[client]
+# Also accept plain WebSocket clients on this port through the websockets
+# library (0 = off); they share everything with the aiohttp /ws endpoint
+WEBSOCKETS_PORT = int(os.environ.get("WEBSOCKETS_PORT", 0))
+
+# Bearer token for the /admin endpoints (empty = disabled)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Bind with SO_REUSEPORT so several processes can share the port (set for --workers)
+REUSE_PORT = os.environ.get("REUSE_PORT", "0") == "1"
+
+# Connected clients, whichever transport they came in on
+sessions = SessionRegistry()
+
+# Other server nodes and the users logged in on them
+backplane = create_backplane()
+remote_users = RemoteDirectory()
+
+# Versioned member lists per room, for catching clients up with deltas
+roster = Roster()
+
+# Recent chat messages per room, for replay on login and reconnect
+history = HistoryStore(HISTORY_DIR or None)
+
+# Private messages waiting for users who are offline
+mailbox = Mailbox(MAILBOX_PATH or None)
+
+# The web interface, held in memory with precompressed variants
+static_site = StaticSite()
+
+# Pings silent connections and closes dead and idle ones
+heartbeat = Heartbeat()
+
+# Token buckets for inbound messages, and caps on new connections
+limits = MessageLimits()
+admission = Admission()
+
+# Set once shutdown starts: new connections are refused while open ones drain
+draining = False
 
 # HTTP route handlers
 async def health_check(request):
     """Health check endpoint for Railway"""
     return web.json_response({
-        'status': 'healthy',
+        'status': 'draining' if draining else 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'connected_clients': len(sessions),
+        'node': backplane.node_id,
+        'remote_users': len(remote_users),
+        'outbound_dropped': sum(s.queue.dropped for s in sessions)
+    }, status=503 if draining else 200)
+
+def admin_authorized(request):
+    """Whether request carries the ADMIN_TOKEN bearer token; never without one set"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}')
+
+async def queue_stats_handler(request):
+    """Per-connection outbound queue depth and drop counters; lists usernames, so admin only"""
+    if not admin_authorized(request):
+        return web.json_response({'error': 'forbidden'}, status=403)
+    connections = []
+    for session in sessions:
+        stats = session.queue.stats()
+        stats['client_id'] = session.client_id
+        stats['username'] = session.username
+        connections.append(stats)
+    return web.json_response({
         'timestamp': datetime.now().isoformat(),
-        'connected_clients': len(connected_clients)
+        'queue_size': OUTBOUND_QUEUE_SIZE,
+        'overflow_policy': OUTBOUND_OVERFLOW_POLICY,
+        'connections': connections
     })
 
-async def root_handler(request):
-    """Root endpoint that serves the chat interface"""
-    try:
-        # Read and serve the HTML file
-        html_path = os.path.join(os.path.dirname(__file__), '..', 'web', 'index.html')
-        with open(html_path, 'r') as f:
-            html_content = f.read()
-        
-        # Update the default WebSocket URL to use the current host
-        host = request.headers.get('Host', 'localhost:8080')
-        ws_url = f"ws://{host}/ws"
-        html_content = html_content.replace('ws://localhost:8080/ws', ws_url)
-        
-        return web.Response(text=html_content, content_type='text/html')
-    except Exception as e:
-        logger.error(f"Error serving HTML: {e}")
-        return web.Response(text="Error loading chat interface", status=500)
+async def metrics_handler(request):
+    """Counters and latency histograms in the Prometheus text format"""
+    return web.Response(body=metrics.render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+# Scraped alongside the counters; read from the session registry on demand
+metrics.Gauge('chat_connected_clients', 'Client connections open on this node', lambda: len(sessions))
+metrics.Gauge('chat_outbound_queue_depth', 'Frames waiting in all outbound queues',
+              lambda: sum(session.queue.depth for session in sessions))
+metrics.Gauge('chat_outbound_queue_depth_max', 'Frames waiting in the deepest outbound queue',
+              lambda: max((session.queue.depth for session in sessions), default=0))
+
+async def log_settings_handler(request):
+    """Show (GET) or change (POST) log levels and sample rates on every node"""
+    if not admin_authorized(request):
+        return web.json_response({'error': 'forbidden'}, status=403)
+    if request.method == 'POST':
+        try:
+            changes = await request.json()
+            logs.apply(changes)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        logger.warning("Log settings changed: %s", changes, extra={'changes': changes})
+        backplane.publish({'kind': 'logging', 'changes': changes})
+    return web.json_response(logs.settings())
+
+def refuse_connection(ip):
+    """(status, reason) if a new connection from ip is over a limit, else None"""
+    refused = (503, 'shutting_down') if draining else admission.check(ip, time.perf_counter())
+    if refused is not None:
+        metrics.connections_rejected.inc(refused[1])
+        logger.warning("Refused connection from %s: %s", ip, refused[1], extra={'ip': ip, 'reason': refused[1]})
+    return refused
 
 async def websocket_handler(request):
     """WebSocket handler for aiohttp"""
-    ws = web.WebSocketResponse()
+    ip = client_ip(request.headers, request.remote)
+    refused = refuse_connection(ip)
+    if refused is not None:
+        return web.Response(status=refused[0], text=refused[1])
+    # Pings and pongs are handled in aiohttp_frames so they count as traffic
+    ws = web.WebSocketResponse(protocols=tuple(SUBPROTOCOLS), autoping=False, compress=WS_COMPRESSION)
     await ws.prepare(request)
-    
+    await serve(ws, aiohttp_frames(ws), ws.ws_protocol, remote=ip)
+    return ws
+
+def select_subprotocol(websocket, offered):
+    """Pick a codec subprotocol for the websockets library; clients offering none get JSON"""
+    return next((protocol for protocol in offered if protocol in SUBPROTOCOLS), None)
+
+def admit_websockets(websocket, request):
+    """Refuse a websockets library handshake that is over a connection limit"""
+    refused = refuse_connection(client_ip(request.headers, websocket.remote_address[0]))
+    if refused is not None:
+        return websocket.respond(refused[0], refused[1] + '\n')
+
+async def handle_client(websocket):
+    """WebSocket handler for the websockets library"""
+    connection = WebsocketsConnection(websocket)
+    ip = client_ip(websocket.request.headers, websocket.remote_address[0])
+    # The websockets library sends its own pings, so only idleness is checked here
+    await serve(connection, connection.frames(), connection.protocol, pings=False, remote=ip)
+
+async def serve(ws, frames, protocol=None, pings=True, remote=None):
+    """Run one client connection, whatever transport it arrived on.
+
+    ws is what outbound frames are sent through and frames yields inbound
+    text frames as str and binary frames as bytes, and None for pongs (see
+    transport.py). pings says whether the heartbeat should ping ws, and
+    remote is the client's IP address.
+    """
     client_id = id(ws)
-    username = None
-    
-    logger.info(f"WebSocket connection established via HTTP. Client {client_id}")
-    connected_clients[ws] = None  # Will be set when user logs in
-    
+    # The codec comes from the negotiated subprotocol and may change at login
+    codec = SUBPROTOCOLS.get(protocol, JSON)
+    session = sessions.add(ws, OutboundQueue(ws, codec=codec).start())  # Username is set when the user logs in
+    session.remote = remote
+    admission.opened(remote)
+    heartbeat.add(session, pings)
+
+    logger.info("WebSocket connection established. Client %s", client_id, extra={'client': client_id, 'ip': remote})
+
     try:
-        async for msg in ws:
-            if msg.type == WSMsgType.TEXT:
+        async for frame in frames:
+            # The heartbeat shares this clock; any frame proves the client is alive
+            started = session.last_seen = time.perf_counter()
+            if frame is None:
+                continue
+            metrics.bytes_in.inc(len(frame))
+            # Floods are dropped here, before any parsing
+            over = limits.frame(session, started)
+            if over is not None:
+                reject_message(session, over, started)
+                continue
+            try:
+                # Text frames are JSON, binary frames MessagePack
+                if frame.__class__ is str:
+                    data = JSON.decode(frame)
+                else:
+                    data = decode_binary(frame)
+            except DecodeError as e:
+                metrics.messages_in.inc('invalid')
+                send_error(session, str(e))
+                continue
+            except json.JSONDecodeError:
+                metrics.messages_in.inc('plain_text')
+                session.last_active = started
+                if limits.message(session, 'chat', started):
+                    handle_plain_text(session, frame)
+                else:
+                    reject_message(session, 'chat', started)
+                continue
+            parsed = time.perf_counter()
+            metrics.parse_seconds.observe(parsed - started)
+
+            if isinstance(data, dict):
+                msg_type = dispatcher.known_type(data)
+                metrics.messages_in.inc(msg_type)
+                # Keepalive pings do not keep a connection from counting as idle
+                if msg_type != 'ping':
+                    session.last_active = started
+                if not limits.message(session, msg_type, started):
+                    reject_message(session, msg_type, started)
+                    continue
+                if message_log.isEnabledFor(logging.DEBUG) and logs.sampler.keep(msg_type):
+                    message_log.debug("Received %s from client %s", msg_type, client_id,
+                                      extra={'msg_type': msg_type, 'client': client_id, 'username': session.username})
                 try:
-                    data = json.loads(msg.data)
-                    logger.info(f"Received JSON from client {client_id}: {data}")
-                    
-                    # Handle different message types
-                    if isinstance(data, dict):
-                        msg_type = data.get('type', '')
-                        
-                        if msg_type == 'login':
-                            # Handle user login
-                            username = data.get('username', f'User_{client_id}')
-                            connected_clients[ws] = username
-                            
-                            # Send login confirmation
-                            response = {
-                                'type': 'login_success',
-                                'username': username,
-                                'message': f'Welcome {username}!',
-                                'timestamp': datetime.now().isoformat()
-                            }
-                            await ws.send_str(json.dumps(response))
-                            
-                            # Notify other clients about new user
-                            await broadcast_to_others_aiohttp(ws, {
-                                'type': 'user_joined',
-                                'username': username,
-                                'message': f'{username} joined the chat',
-                                'timestamp': datetime.now().isoformat()
-                            })
-                            
-                            # Send current users list
-                            users_list = [u for u in connected_clients.values() if u is not None]
-                            await ws.send_str(json.dumps({
-                                'type': 'users_list',
-                                'users': users_list,
-                                'timestamp': datetime.now().isoformat()
-                            }))
-                            
-                        elif msg_type == 'chat':
-                            # Handle chat message
-                            if username:
-                                chat_message = data.get('message', '')
-                                await broadcast_to_all_aiohttp({
-                                    'type': 'chat',
-                                    'username': username,
-                                    'message': chat_message,
-                                    'timestamp': datetime.now().isoformat()
-                                })
-                            else:
-                                await ws.send_str(json.dumps({
-                                    'type': 'error',
-                                    'message': 'Please login first',
-                                    'timestamp': datetime.now().isoformat()
-                                }))
-                                
-                        elif msg_type == 'private':
-                            # Handle private message
-                            if username:
-                                target_username = data.get('to', '')
-                                private_message = data.get('message', '')
-                                
-                                # Find target user
-                                target_websocket = None
-                                for ws_client, uname in connected_clients.items():
-                                    if uname == target_username:
-                                        target_websocket = ws_client
-                                        break
-                                
-                                if target_websocket:
-                                    # Send to target user
-                                    await target_websocket.send_str(json.dumps({
-                                        'type': 'private',
-                                        'from': username,
-                                        'message': private_message,
-                                        'timestamp': datetime.now().isoformat()
-                                    }))
-                                    
-                                    # Send confirmation to sender
-                                    await ws.send_str(json.dumps({
-                                        'type': 'private_sent',
-                                        'to': target_username,
-                                        'message': private_message,
-                                        'timestamp': datetime.now().isoformat()
-                                    }))
-                                else:
-                                    await ws.send_str(json.dumps({
-                                        'type': 'error',
-                                        'message': f'User {target_username} not found',
-                                        'timestamp': datetime.now().isoformat()
-                                    }))
-                            else:
-                                await ws.send_str(json.dumps({
-                                    'type': 'error',
-                                    'message': 'Please login first',
-                                    'timestamp': datetime.now().isoformat()
-                                }))
-                                
-                        elif msg_type == 'typing':
-                            # Handle typing indicator
-                            if username:
-                                await broadcast_to_others_aiohttp(ws, {
-                                    'type': 'typing',
-                                    'username': username,
-                                    'is_typing': data.get('is_typing', True),
-                                    'timestamp': datetime.now().isoformat()
-                                })
-                                
-                        else:
-                            # Unknown message type
-                            response = {'type': 'error', 'message': f'Unknown message type: {msg_type}', 'timestamp': datetime.now().isoformat()}
-                            await ws.send_str(json.dumps(response))
-                    
-                except json.JSONDecodeError:
-                    # Handle plain text messages as chat messages
-                    if username:
-                        await broadcast_to_all_aiohttp({
-                            'type': 'chat',
-                            'username': username,
-                            'message': msg.data,
-                            'timestamp': datetime.now().isoformat()
-                        })
-                    else:
-                        await ws.send_str(json.dumps({
-                            'type': 'error',
-                            'message': 'Please login first. Send: {"type": "login", "username": "your_name"}',
-                            'timestamp': datetime.now().isoformat()
-                        }))
-                        
-            elif msg.type == WSMsgType.ERROR:
-                logger.error(f"WebSocket error: {ws.exception()}")
-                break
-                
+                    dispatcher.dispatch(session, data)
+                except ValidationError as e:
+                    send_error(session, str(e))
+                except Exception:
+                    # A failing handler costs the client this message, not the connection
+                    metrics.handler_errors.inc(msg_type)
+                    logger.exception("Error handling %s from client %s", msg_type, client_id,
+                                     extra={'msg_type': msg_type, 'client': client_id, 'username': session.username})
+                    send_error(session, f"Could not handle {msg_type} message")
+                metrics.dispatch_seconds.observe(time.perf_counter() - parsed)
+
     except Exception as e:
-        logger.error(f"Error with client {client_id}: {e}")
+        logger.error("Error with client %s: %s", client_id, e, extra={'client': client_id})
     finally:
         # Cleanup when client disconnects
-        if ws in connected_clients:
-            if username:
-                # Notify other clients about user leaving
-                await broadcast_to_all_aiohttp({
-                    'type': 'user_left',
-                    'username': username,
-                    'message': f'{username} left the chat',
-                    'timestamp': datetime.now().isoformat()
-                })
-            del connected_clients[ws]
-            
-        logger.info(f"Client {client_id} disconnected. Total clients: {len(connected_clients)}")
+        sessions.remove(ws)
+        heartbeat.remove(session)
+        admission.closed(remote)
+        if session.username:
+            backplane.publish({'kind': 'logout', 'user': session.username})
+            # Notify the user's rooms about them leaving
+            for room in session.rooms:
+                presence.left(room, session.username)
+        await session.queue.close()
+
+        logger.info("Client %s disconnected. Total clients: %s", client_id, len(sessions),
+                    extra={'client': client_id, 'username': session.username})
+
+def retire_session(session, username):
+    """Close a connection whose username a newer login took over; clients do not reconnect on 4000"""
+    send_error(session, f'{username} logged in from another connection')
+    asyncio.ensure_future(session.ws.close(code=4000, message=b'Logged in elsewhere'))
+
+def reject_message(session, budget, now):
+    """Drop a message over a rate limit, telling the client at most once a second"""
+    metrics.messages_rejected.inc(budget)
+    if limits.notify(session, now):
+        send_error(session, 'Rate limit exceeded, slow down')
+
+def handle_unknown(session, data):
+    """Reply to a message type no handler is registered for"""
+    send_error(session, f"Unknown message type: {data.get('type', '')}")
+
+def handle_anonymous(session, data):
+    """Reply to a message that needs a logged in user"""
+    send_error(session, 'Please login first')
+
+def handle_plain_text(session, text):
+    """Treat a text frame that is not JSON as a chat message to the default room"""
+    if not session.username:
+        send_error(session, 'Please login first. Send: {"type": "login", "username": "your_name"}')
+    elif DEFAULT_ROOM not in session.rooms:
+        send_not_in_room(session, DEFAULT_ROOM)
+    else:
+        broadcast_to_room(DEFAULT_ROOM, {
+            'type': 'chat',
+            'username': session.username,
+            'room': DEFAULT_ROOM,
+            'message': text,
+            'timestamp': datetime.now().isoformat()
+        }, record=True)
+
+# Client message handlers, one per message type
+dispatcher = Dispatcher(unknown=handle_unknown, unauthenticated=handle_anonymous)
+
+ROOM = Field(str, DEFAULT_ROOM)
+SINCE = Field(int)
+VERSION = Field(str)
+
+@dispatcher.handler('login', {'username': Field(str), 'codec': Field(str), 'since': SINCE, 'roster': VERSION})
+def handle_login(session, data):
+    """Log the session in, or rename it, and bring it up to date"""
+    username = data['username'] or f'User_{session.client_id}'
+    previous_name = session.username
+    holder_node = remote_users.node_of(username)
+    try:
+        if holder_node is not None and DUPLICATE_LOGIN != 'replace':
+            raise DuplicateUsername(username)
+        replaced = sessions.login(session, username, replace=DUPLICATE_LOGIN == 'replace')
+    except DuplicateUsername:
+        send_error(session, f'Username {username} is already taken')
+        return
+
+    if replaced is not None:
+        # The name moved to this connection; retire the old one quietly
+        retire_session(replaced, username)
+    elif holder_node is not None:
+        # The name moves here from another node, which closes its connection;
+        # its rooms see the user leave, netted against the joins below
+        backplane.send(holder_node, {'kind': 'kick', 'user': username})
+        remote_users_left({username: remote_users.remove(username)})
+
+    # Send login confirmation, then switch to the codec the client asked for
+    codec = CODECS.get(data['codec'], session.queue.codec)
+    send_to(session, {
+        'type': 'login_success',
+        'username': username,
+        'message': f'Welcome {username}!',
+        'codec': codec.name,
+        'timestamp': datetime.now().isoformat()
+    })
+    session.queue.codec = codec
+    if previous_name != username:
+        session.mail_seen = 0
+        if mailbox.enabled:
+            mailbox.seen(username)
+
+    # Notify the user's rooms about the new user; on a rename, the rooms
+    # the old name was in also see it leave
+    previous_rooms = set(session.rooms) if previous_name is not None else ()
+    sessions.join(session, DEFAULT_ROOM)
+    if replaced is None and previous_name != username:
+        if previous_name is not None:
+            backplane.publish({'kind': 'logout', 'user': previous_name})
+        backplane.publish({'kind': 'login', 'user': username, 'rooms': list(session.rooms)})
+        for room in session.rooms:
+            if room in previous_rooms:
+                presence.left(room, previous_name)
+            presence.joined(room, username)
+
+    # Send the users list, or what changed in it since the client's copy
+    send_to(session, {
+        'type': 'users_list',
+        'room': DEFAULT_ROOM,
+        **roster_update(DEFAULT_ROOM, data['roster']),
+        'timestamp': datetime.now().isoformat()
+    })
+
+    # Replay what was said before (or since the client last saw), then what was sent to them while away
+    send_history(session, DEFAULT_ROOM, data['since'])
+    deliver_mail(session)
+
+@dispatcher.handler('chat', {'message': Field(str, ''), 'room': ROOM}, login_required=True)
+def handle_chat(session, data):
+    """Broadcast a chat message to a room the sender is in"""
+    room = data['room']
+    if room not in session.rooms:
+        send_not_in_room(session, room)
+        return
+    broadcast_to_room(room, {
+        'type': 'chat',
+        'username': session.username,
+        'room': room,
+        'message': data['message'],
+        'timestamp': datetime.now().isoformat()
+    }, record=True)
+
+@dispatcher.handler('private', {'to': Field(str, required=True), 'message': Field(str, '')}, login_required=True)
+def handle_private(session, data):
+    """Deliver a private message to a user on this node or another one, or to their mailbox"""
+    target_username = data['to']
+    private_message = data['message']
+    if not target_username:
+        send_error(session, 'Private messages need a recipient')
+        return
+
+    # Find target user, here or on another node
+    target = sessions.find(target_username)
+    target_node = None if target else remote_users.node_of(target_username)
+    if not target and not target_node and not mailbox.enabled:
+        send_error(session, f'User {target_username} not found')
+        return
+
+    # Send to target user
+    frame = Frame({
+        'type': 'private',
+        'from': session.username,
+        'message': private_message,
+        'timestamp': datetime.now().isoformat()
+    })
+    if target:
+        publish((target.queue,), frame)
+    elif target_node:
+        backplane.send(target_node, {'kind': 'direct', 'user': target_username}, frame.encode(JSON))
+    else:
+        # Nobody by that name is online; the sender hears back once it is on disk
+        stored = mailbox.put(target_username, frame.encode(JSON))
+        stored.add_done_callback(functools.partial(mail_stored, session, target_username, private_message))
+        return
+
+    confirm_private(session, target_username, private_message)
+
+@dispatcher.handler('typing', {'room': ROOM, 'is_typing': Field(bool, True)})
+def handle_typing(session, data):
+    """Record a typing indicator; the presence batchers of this and the other nodes send it on"""
+    room = data['room']
+    if session.username and room in session.rooms:
+        presence.typing(room, session.username, data['is_typing'])
+        if remote_users.members(room):
+            backplane.publish({'kind': 'typing', 'room': room, 'user': session.username,
+                               'is_typing': data['is_typing']})
+
+@dispatcher.handler('join_room', {'room': ROOM, 'since': SINCE, 'roster': VERSION}, login_required=True)
+def handle_join_room(session, data):
+    """Join a room and catch up on its history"""
+    room = data['room']
+    if not room or len(room) > MAX_ROOM_NAME_LENGTH:
+        send_error(session, f'Room name must be 1-{MAX_ROOM_NAME_LENGTH} characters')
+        return
+    if sessions.join(session, room):
+        backplane.publish({'kind': 'join', 'user': session.username, 'room': room})
+        presence.joined(room, session.username)
+    send_to(session, {
+        'type': 'room_joined',
+        'room': room,
+        **roster_update(room, data['roster']),
+        'timestamp': datetime.now().isoformat()
+    })
+    send_history(session, room, data['since'])
+
+@dispatcher.handler('roster', {'room': ROOM, 'version': VERSION}, login_required=True)
+def handle_roster(session, data):
+    """Resync a client's member list of a room from the version it has"""
+    room = data['room']
+    if room not in session.rooms:
+        send_not_in_room(session, room)
+        return
+    send_to(session, {
+        'type': 'roster',
+        'room': room,
+        **roster_update(room, data['version']),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@dispatcher.handler('history', {'room': ROOM, 'since': SINCE})
+def handle_history(session, data):
+    """Send the messages of a room missed since an id"""
+    room = data['room']
+    if room not in session.rooms:
+        send_not_in_room(session, room)
+        return
+    send_history(session, room, data['since'], always=True)
+
+@dispatcher.handler('mailbox_ack', {'last_id': Field(int, required=True)}, login_required=True)
+def handle_mailbox_ack(session, data):
+    """Delete the mailbox messages the client has received"""
+    last_id = min(data['last_id'], session.mail_seen)
+    if mailbox.enabled and last_id > 0:
+        mailbox.ack(session.username, last_id).add_done_callback(mail_acked)
+
+@dispatcher.handler('leave_room', {'room': ROOM})
+def handle_leave_room(session, data):
+    """Leave a room"""
+    room = data['room']
+    if not sessions.leave(session, room):
+        send_not_in_room(session, room)
+        return
+    backplane.publish({'kind': 'leave', 'user': session.username, 'room': room})
+    send_to(session, {
+        'type': 'room_left',
+        'room': room,
+        'timestamp': datetime.now().isoformat()
+    })
+    presence.left(room, session.username)
+
+@dispatcher.handler('list_rooms')
+def handle_list_rooms(session, data):
+    """List the rooms in use on any node with their member counts"""
+    room_sizes = {name: len(members) for name, members in sessions.rooms().items()}
+    for name, members in remote_users.rooms().items():
+        room_sizes[name] = room_sizes.get(name, 0) + len(members)
+    send_to(session, {
+        'type': 'rooms_list',
+        'rooms': [{'name': name, 'members': size} for name, size in room_sizes.items()],
+        'timestamp': datetime.now().isoformat()
+    })
+
+@dispatcher.handler('ping')
+def handle_ping(session, data):
+    """Answer an application-level keepalive; protocol pings never get here"""
+    send_to(session, {'type': 'pong', 'timestamp': datetime.now().isoformat()})
+
+@dispatcher.handler('disconnect')
+def handle_disconnect(session, data):
+    """Close the connection the client is about to abandon"""
+    asyncio.ensure_future(session.ws.close())
+
+def send_to(session, message):
+    """Queue a message for a single client"""
+    publish((session.queue,), Frame(message))
+
+def send_error(session, message):
+    """Queue an error frame for a single client"""
+    send_to(session, {
+        'type': 'error',
+        'message': message,
+        'timestamp': datetime.now().isoformat()
+    })
+
+def send_not_in_room(session, room):
+    """Tell a client it is not a member of the room it addressed"""
+    send_error(session, f'You are not in room {room}')
+
+def room_usernames(room):
+    """Usernames of a room's members across all nodes"""
+    usernames = [member.username for member in sessions.members(room)]
+    usernames.extend(remote_users.members(room))
+    return usernames
+
+def roster_update(room, version=None):
+    """Fields bringing a client's member list of a room up to date.
+
+    The joins and leaves since version when the roster can still tell,
+    else the full 'users' list; either way with the version they lead to.
+    """
+    current = roster.version(room)
+    if version is not None:
+        size = len(sessions.members(room)) + len(remote_users.members(room))
+        changes = roster.changes_since(room, version, size)
+        if changes is not None:
+            return {'since': version, 'joined': changes[0], 'left': changes[1], 'version': current}
+    return {'users': room_usernames(room), 'version': current}
+
+def broadcast_to_room(room, message, exclude=None, coalesce_key=None, record=False):
+    """Broadcast message to the members of a room, optionally skipping one session.
     
-    return ws
+    Recorded messages get a message id and are kept in the room's history.
+    """
+    msg_id = None
+    if record:
+        msg_id, frame = history.append(room, message)
+    else:
+        frame = Frame(message)
+    publish_to_room(room, frame, exclude, coalesce_key)
+    # Recorded messages go to every node so each keeps a complete history
+    if msg_id is not None or remote_users.members(room):
+        backplane.publish({'kind': 'room', 'room': room, 'type': frame.type, 'key': coalesce_key, 'id': msg_id},
+                          frame.encode(JSON))
+
+def announce_presence(room, message, coalesce_key=None):
+    """Send a typing or presence update to this node's members.
+
+    Every node announces the typing, joins and leaves it hears of, so each
+    node's updates cover the whole room.
+    """
+    publish_to_room(room, Frame(message), coalesce_key=coalesce_key)
+
+# Typing and join/leave changes, flushed to rooms as periodic deltas
+presence = PresenceBatcher(announce_presence, roster=roster)
+
+def send_history(session, room, since=None, always=False):
+    """Send a room's stored messages newer than since as one batched frame"""
+    frames = history.since(room, since)
+    if frames or always:
+        codec = session.queue.codec
+        if session.queue.put(history_frame(room, frames, codec), binary=codec.binary):
+            metrics.messages_out.inc('history')
+
+def confirm_private(session, to, message, offline=False):
+    """Tell the sender a private message was delivered, or stored for an offline user"""
+    confirmation = {
+        'type': 'private_sent',
+        'to': to,
+        'message': message,
+        'timestamp': datetime.now().isoformat()
+    }
+    if offline:
+        confirmation['offline'] = True
+    send_to(session, confirmation)
+
+def mail_stored(sender, recipient, message, stored):
+    """Confirm a message stored for an offline user, and deliver it if they logged in meanwhile"""
+    if stored.exception() is not None:
+        send_error(sender, f'Could not keep the message for {recipient}, please try again')
+        return
+    if stored.result() is None:
+        # Nobody has logged in with that name lately
+        send_error(sender, f'User {recipient} not found')
+        return
+    metrics.mailbox_messages.inc('stored')
+    confirm_private(sender, recipient, message, offline=True)
+    target = sessions.find(recipient)
+    target_node = None if target else remote_users.node_of(recipient)
+    if target:
+        deliver_mail(target)
+    elif target_node:
+        backplane.send(target_node, {'kind': 'mail', 'user': recipient})
+
+def deliver_mail(session):
+    """Send the session's user what is in their mailbox, in one frame"""
+    if mailbox.enabled:
+        mailbox.fetch(session.username).add_done_callback(functools.partial(mail_fetched, session, session.username))
 
-async def broadcast_to_others_aiohttp(sender_websocket, message):
-    """Broadcast message to all clients except the sender (aiohttp version)"""
-    if connected_clients:
-        disconnected_clients = []
+def mail_fetched(session, username, fetched):
+    if fetched.exception() is not None or session.username != username:
+        return
+    # Skip what an overlapping fetch already sent to this connection
+    mail = [(mail_id, payload) for mail_id, payload in fetched.result() if mail_id > session.mail_seen]
+    if not mail:
+        return
+    session.mail_seen = mail[-1][0]
+    codec = session.queue.codec
+    frame = mailbox_frame(session.mail_seen, [Frame(codec=JSON, payload=payload) for _, payload in mail], codec)
+    if session.queue.put(frame, binary=codec.binary):
+        metrics.messages_out.inc('mailbox')
+        metrics.mailbox_messages.inc('delivered', len(mail))
+
+def mail_acked(acked):
+    if acked.exception() is None:
+        metrics.mailbox_messages.inc('acked', acked.result())
+
+def publish_to_room(room, frame, exclude=None, coalesce_key=None):
+    """Queue a frame for this node's members of a room"""
+    recipients = [member.queue for member in sessions.members(room) if member is not exclude]
+    if recipients:
+        metrics.broadcast_fanout.observe(len(recipients))
+        publish(recipients, frame, coalesce_key)
+
+def local_presence():
+    """This node's logged in users and their rooms, for backplane snapshots"""
+    return {s.username: list(s.rooms) for s in sessions.logged_in()}
+
+def handle_backplane_event(header, payload):
+    """Apply an event published by another node"""
+    kind = header.get('kind')
+    node = header.get('node')
+    
+    if kind == 'room':
+        key = header.get('key')
+        frame = Frame(codec=JSON, payload=payload, msg_type=header.get('type'))
+        if header.get('id') is not None:
+            history.store(header['room'], header['id'], frame)
+        publish_to_room(header['room'], frame, coalesce_key=tuple(key) if key else None)
         
-        for client in connected_clients:
-            if client != sender_websocket and connected_clients[client] is not None:
-                try:
-                    await client.send_str(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error broadcasting to client: {e}")
-                    disconnected_clients.append(client)
+    elif kind == 'direct':
+        target = sessions.find(header['user'])
+        if target:
+            publish((target.queue,), Frame(codec=JSON, payload=payload, msg_type='private'))
+            
+    # Membership changes on other nodes reach our clients through our own presence batcher
+    elif kind == 'login':
+        if remote_users.node_of(header['user']) not in (None, node):
+            # The user moved here from another node
+            remote_users_left({header['user']: remote_users.remove(header['user'])})
+        remote_users.add(header['user'], node)
+        for room in header.get('rooms', ()):
+            if remote_users.join(header['user'], room):
+                presence.joined(room, header['user'])
         
-        # Clean up disconnected clients
-        for client in disconnected_clients:
-            if client in connected_clients:
-                del connected_clients[client]
-
-async def broadcast_to_all_aiohttp(message):
-    """Broadcast message to all clients (aiohttp version)"""
-    if connected_clients:
-        disconnected_clients = []
+    elif kind == 'logout':
+        # Unless the user has already logged in again on another node
+        if remote_users.node_of(header['user']) == node:
+            remote_users_left({header['user']: remote_users.remove(header['user'])})
+
+    elif kind == 'kick':
+        # The user logged in on another node; retire the connection here
+        target = sessions.find(header['user'])
+        if target:
+            retire_session(target, header['user'])
         
-        for client in connected_clients:
-            if connected_clients[client] is not None:
-                try:
-                    await client.send_str(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error broadcasting to client: {e}")
-                    disconnected_clients.append(client)
+    elif kind == 'join':
+        if remote_users.join(header['user'], header['room']):
+            presence.joined(header['room'], header['user'])
+        
+    elif kind == 'leave':
+        if remote_users.leave(header['user'], header['room']):
+            presence.left(header['room'], header['user'])
+
+    elif kind == 'typing':
+        if header['user'] in remote_users.members(header['room']):
+            presence.typing(header['room'], header['user'], header['is_typing'])
+        
+    elif kind == 'reset':
+        # We (re)joined the backplane: forget what we knew and introduce ourselves;
+        # users still online come back with the other nodes' snapshots
+        remote_users_left(remote_users.clear())
+        backplane.publish({'kind': 'hello', 'users': local_presence()})
         
-        # Clean up disconnected clients
-        for client in disconnected_clients:
-            if client in connected_clients:
-                del connected_clients[client]
+    elif kind in ('hello', 'snapshot'):
+        # Leaves and joins of users who stayed cancel out in the batcher
+        remote_users_left(remote_users.drop_node(node))
+        for username, rooms in header['users'].items():
+            remote_users.add(username, node)
+            for room in rooms:
+                if remote_users.join(username, room):
+                    presence.joined(room, username)
+        if kind == 'hello':
+            backplane.send(node, {'kind': 'snapshot', 'users': local_presence()})
+            
+    elif kind == 'mail':
+        # Another node stored mail for a user who is online here
+        target = sessions.find(header['user'])
+        if target:
+            deliver_mail(target)
+        
+    elif kind == 'logging':
+        # Log settings changed through another node's /admin/logging
+        logs.apply(header['changes'])
+        
+    elif kind == 'node_down':
+        # A node went away without logging its users out
+        logger.warning(f"Backplane node {node} is gone")
+        remote_users_left(remote_users.drop_node(node))
+
+def remote_users_left(dropped):
+    """Report remote users dropped from the directory, {username: rooms}, as leaving their rooms"""
+    for username, rooms in dropped.items():
+        for room in rooms:
+            presence.left(room, username)
+
+async def flush_history_periodically():
+    """Push buffered history log writes to disk once a second"""
+    while True:
+        await asyncio.sleep(1)
+        history.flush()
+
+async def drain_connections(timeout):
+    """Send every connection what is queued for it, then close it; give up after timeout seconds"""
+    async def drain(session):
+        await session.queue.drain()
+        await session.ws.close(code=1001, message=b'Server shutting down')
+
+    tasks = [asyncio.ensure_future(drain(session)) for session in list(sessions)]
+    if not tasks:
+        return
+    logger.info(f"Draining {len(tasks)} connections")
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"Gave up draining {len(pending)} connections after {timeout}s")
 
 async def main():
     """Main server function"""
@@ -453,31 +777,89 @@ async def main():
     app = web.Application()
     
     # Add routes
-    app.router.add_get('/', root_handler)
+    app.router.add_get('/', static_site.page_handler)
+    app.router.add_get('/static/{name}', static_site.asset_handler)
     app.router.add_get('/health', health_check)
+    app.router.add_get('/stats/queues', queue_stats_handler)
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_route('*', '/admin/logging', log_settings_handler)
     app.router.add_get('/ws', websocket_handler)
     
+    # Load the web interface and history, and join the other server nodes, before accepting clients
+    try:
+        static_site.load()
+    except OSError as e:
+        logger.error(f"Error loading web interface: {e}")
+    history.open()
+    mailbox.open()
+    history_flusher = asyncio.ensure_future(flush_history_periodically())
+    loop_watcher = asyncio.ensure_future(metrics.watch_event_loop())
+    await backplane.start(handle_backplane_event)
+    presence.start()
+    heartbeat.start()
+    logger.info(f"Node {backplane.node_id} using the {type(backplane).__name__}")
+    
     # Start the HTTP server
     runner = web.AppRunner(app)
     await runner.setup()
     
-    site = web.TCPSite(runner, host, port)
+    site = web.TCPSite(runner, host, port, reuse_port=REUSE_PORT or None)
     await site.start()
     
+    ws_server = None
+    if WEBSOCKETS_PORT:
+        from websockets.asyncio.server import serve as websockets_serve
+        ws_server = await websockets_serve(handle_client, host, WEBSOCKETS_PORT, select_subprotocol=select_subprotocol,
+                                           process_request=admit_websockets, reuse_port=REUSE_PORT,
+                                           compression='deflate' if WS_COMPRESSION else None,
+                                           ping_interval=HEARTBEAT_INTERVAL, ping_timeout=HEARTBEAT_TIMEOUT)
+        logger.info(f"websockets endpoint available at ws://{host}:{WEBSOCKETS_PORT}")
+    
     logger.info(f"HTTP server is running on http://{host}:{port}")
     logger.info(f"WebSocket endpoint available at ws://{host}:{port}/ws")
     logger.info(f"Health check available at http://{host}:{port}/health")
     logger.info("Press Ctrl+C to stop the server")
-    
+
+    global draining
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
     try:
-        # Keep the server running
-        while True:
-            await asyncio.sleep(1)
-    except KeyboardInterrupt:
+        await stop.wait()
         logger.info("Server shutdown requested")
     finally:
+        # Refuse new clients, let open connections receive what is queued for
+        # them, then close. The aiohttp site stays up until the drain is done:
+        # stopping it shuts down the handlers of open connections on some
+        # aiohttp versions, and while draining it answers 503 to new clients
+        draining = True
+        if ws_server is not None:
+            ws_server.close(close_connections=False)
+        await drain_connections(SHUTDOWN_GRACE)
+        if ws_server is not None:
+            ws_server.close()
+            await ws_server.wait_closed()
         await runner.cleanup()
+        await presence.close()
+        await heartbeat.close()
+        await backplane.close()
+        history_flusher.cancel()
+        loop_watcher.cancel()
+        history.close()
+        mailbox.close()
         logger.info("Shutting down server...")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat WebSocket server")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="worker processes sharing the port; 0 for one per CPU (default: WORKERS or 1)")
+    parser.add_argument('--uvloop', action='store_const', const='uvloop', default=EVENT_LOOP, dest='event_loop',
+                        help="run on uvloop if it is installed (default: EVENT_LOOP or asyncio)")
+    args = parser.parse_args()
+    workers = worker_count(args.workers)
+    if workers > 1:
+        asyncio.run(Supervisor(workers, args.event_loop).run())
+    else:
+        use_event_loop(args.event_loop)
+        asyncio.run(main())
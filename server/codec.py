@@ -0,0 +1,144 @@
+"""Wire codecs.
+
+Every connection speaks one codec. JSON goes out as text frames and uses
+orjson when it is installed, falling back to the stdlib. MessagePack
+goes out as binary frames and is offered only when the msgpack package
+is installed. A client picks a codec with the WebSocket subprotocol
+(chat.json / chat.msgpack) or with a 'codec' field in its login message.
+Inbound frames are decoded by opcode: text is JSON, binary is MessagePack.
+"""
+import json
+import struct
+import time
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+
+class DecodeError(ValueError):
+    """Raised when an inbound frame cannot be decoded"""
+
+
+class JsonCodec:
+    name = 'json'
+    binary = False
+
+    if orjson is not None:
+        @staticmethod
+        def encode(message):
+            return orjson.dumps(message)
+
+        @staticmethod
+        def decode(data):
+            return orjson.loads(data)
+    else:
+        @staticmethod
+        def encode(message):
+            return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+        @staticmethod
+        def decode(data):
+            return json.loads(data)
+
+    @staticmethod
+    def envelope(fields, list_key, items):
+        """Encode fields plus a list of already encoded items, without re-encoding them"""
+        head = JsonCodec.encode(fields)
+        return b''.join((head[:-1], b',"', list_key.encode('utf-8'), b'":[', b','.join(items), b']}'))
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    binary = True
+
+    @staticmethod
+    def encode(message):
+        return msgpack.packb(message)
+
+    @staticmethod
+    def decode(data):
+        try:
+            return msgpack.unpackb(data)
+        except Exception as e:
+            raise DecodeError("Invalid MessagePack frame") from e
+
+    @staticmethod
+    def envelope(fields, list_key, items):
+        """Encode fields plus a list of already encoded items, without re-encoding them"""
+        # A map's entries and an array's elements are just concatenated, so
+        # only the two headers need writing by hand
+        entries = b''.join(msgpack.packb(key) + msgpack.packb(value) for key, value in fields.items())
+        return b''.join((_map_header(len(fields) + 1), entries, msgpack.packb(list_key),
+                         _array_header(len(items)), b''.join(items)))
+
+
+def _map_header(size):
+    if size < 16:
+        return bytes((0x80 | size,))
+    if size < 0x10000:
+        return b'\xde' + struct.pack('>H', size)
+    return b'\xdf' + struct.pack('>I', size)
+
+
+def _array_header(size):
+    if size < 16:
+        return bytes((0x90 | size,))
+    if size < 0x10000:
+        return b'\xdc' + struct.pack('>H', size)
+    return b'\xdd' + struct.pack('>I', size)
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec() if msgpack is not None else None
+
+# Codecs this server can speak, by name and by WebSocket subprotocol
+CODECS = {codec.name: codec for codec in (JSON, MSGPACK) if codec is not None}
+SUBPROTOCOLS = {f'chat.{name}': codec for name, codec in CODECS.items()}
+
+
+class Frame:
+    """One outbound message, encoded at most once per codec.
+
+    A frame starts either from a message dict or from a payload already
+    encoded by some codec (history from disk, events from the backplane);
+    the dict is only decoded again if a recipient needs another codec.
+    type is the message type, given by the caller for pre-encoded payloads.
+    """
+
+    __slots__ = ('_message', '_encoded', 'type')
+
+    def __init__(self, message=None, codec=None, payload=None, msg_type=None):
+        self._message = message
+        self._encoded = {codec.name: payload} if payload is not None else {}
+        self.type = message.get('type') if message is not None else msg_type
+
+    @property
+    def message(self):
+        if self._message is None:
+            name, payload = next(iter(self._encoded.items()))
+            self._message = CODECS[name].decode(payload)
+        return self._message
+
+    def encode(self, codec):
+        payload = self._encoded.get(codec.name)
+        if payload is None:
+            started = time.perf_counter()
+            payload = self._encoded[codec.name] = codec.encode(self.message)
+            metrics.encode_seconds.observe(time.perf_counter() - started)
+        return payload
+
+
+def decode_binary(data):
+    """Decode a binary frame, which this server only accepts as MessagePack"""
+    if MSGPACK is None:
+        raise DecodeError("Binary frames need the msgpack codec, which this server does not have")
+    return MSGPACK.decode(data)
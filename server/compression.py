@@ -0,0 +1,136 @@
+"""permessage-deflate (RFC 7692) for outbound frames, compressed once per payload.
+
+Left to itself, aiohttp compresses every frame a connection sends with a
+compressor of that connection, whose window carries over between
+messages. A room broadcast is then deflated once per recipient, and a
+40 byte typing update costs a deflate call to save a few bytes. Here
+each payload is instead compressed on its own, with a fresh window,
+which every client that negotiated the extension can inflate whatever it
+received before. So a broadcast is compressed once, and the same bytes
+go to every recipient that negotiated the same window size. Payloads
+under WS_COMPRESSION_THRESHOLD bytes, and ones deflate does not shrink,
+go out uncompressed, which the extension allows for any message.
+
+Compressed payloads are cached by the payload bytes object. A frame is
+encoded once per codec (see codec.Frame), so every recipient's queue
+holds the same object and its hash is worked out only once. The cache is
+two dicts that rotate when the current one fills up, so payloads nobody
+is still sending fall out without a sweep.
+
+Sending pre-compressed bytes needs private parts of aiohttp's
+WebSocketWriter: the frame writer and the flow control state send_frame
+uses, as in aiohttp 3.13 (requirements.txt). take_over() checks for all
+of them; on an aiohttp without them, with a warning, and on the
+websockets library endpoint, the library compresses frames itself as
+before.
+"""
+import logging
+import os
+import zlib
+
+import metrics
+
+# Negotiate permessage-deflate with clients that offer it
+WS_COMPRESSION = os.environ.get("WS_COMPRESSION", "1") == "1"
+# Payloads smaller than this many bytes are sent uncompressed
+WS_COMPRESSION_THRESHOLD = int(os.environ.get("WS_COMPRESSION_THRESHOLD", 256))
+# zlib level, 1 (fastest) to 9 (smallest)
+WS_COMPRESSION_LEVEL = int(os.environ.get("WS_COMPRESSION_LEVEL", 6))
+# Compressed payloads kept for other recipients of the same frame
+WS_COMPRESSION_CACHE = int(os.environ.get("WS_COMPRESSION_CACHE", 256))
+
+RSV1 = 0x40  # Marks a compressed message
+_DEFLATE_TAIL = b'\x00\x00\xff\xff'  # Ends every sync flush; left off on the wire
+_MISSING = object()
+# What send_deflated() uses of aiohttp's WebSocketWriter and its protocol
+_WRITER_INTERNALS = ('_write_websocket_frame', '_closing', '_output_size', '_limit')
+_PROTOCOL_INTERNALS = ('_paused', '_drain_helper')
+
+logger = logging.getLogger(__name__)
+
+
+class Deflater:
+    """Compresses payloads for permessage-deflate, each once per window size"""
+
+    def __init__(self, level=None, threshold=None, cache_size=None):
+        self.level = level or WS_COMPRESSION_LEVEL
+        self.threshold = WS_COMPRESSION_THRESHOLD if threshold is None else threshold
+        self.cache_size = cache_size or WS_COMPRESSION_CACHE
+        self._current = {}  # {(payload, wbits): compressed payload, or None if it did not shrink}
+        self._previous = {}
+
+    def compress(self, payload, wbits):
+        """payload compressed for a wbits window, or None to send it uncompressed"""
+        if len(payload) < self.threshold:
+            metrics.compression_frames.inc('small')
+            return None
+        key = (payload, wbits)
+        deflated = self._current.get(key, _MISSING)
+        result = 'shared'
+        if deflated is _MISSING:
+            deflated = self._previous.pop(key, _MISSING)
+            if deflated is _MISSING:
+                deflated = self._deflate(payload, wbits)
+                result = 'compressed'
+            if len(self._current) >= self.cache_size:
+                self._previous, self._current = self._current, {}
+            self._current[key] = deflated
+        if deflated is None:
+            metrics.compression_frames.inc('incompressible')
+            return None
+        metrics.compression_frames.inc(result)
+        metrics.compression_bytes.inc('in', len(payload))
+        metrics.compression_bytes.inc('out', len(deflated))
+        return deflated
+
+    def _deflate(self, payload, wbits):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -wbits)
+        deflated = (compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-len(_DEFLATE_TAIL)]
+        return deflated if len(deflated) < len(payload) else None
+
+
+deflater = Deflater()
+_warned = False
+
+
+def _supports_deflated(writer):
+    """Whether writer has everything send_deflated() needs"""
+    return (all(hasattr(writer, name) for name in _WRITER_INTERNALS)
+            and all(hasattr(getattr(writer, 'protocol', None), name) for name in _PROTOCOL_INTERNALS))
+
+
+def take_over(ws):
+    """Compress ws's frames here instead of in aiohttp; returns the negotiated window bits, or 0.
+
+    Call once the handshake is done. Frames aiohttp compresses with its
+    own carried-over window must not be mixed with frames compressed
+    here, so aiohttp's compressor is switched off for the connection.
+    """
+    global _warned
+    wbits = getattr(ws, 'compress', 0)
+    if not wbits:
+        # Not negotiated, or not aiohttp
+        return 0
+    writer = getattr(ws, '_writer', None)
+    if not _supports_deflated(writer):
+        # An aiohttp whose writer works differently; it compresses each frame itself
+        if not _warned:
+            _warned = True
+            logger.warning("This aiohttp cannot send pre-compressed frames; "
+                           "each connection will compress its own frames")
+        return 0
+    writer.compress = 0
+    return wbits
+
+
+async def send_deflated(ws, deflated, opcode):
+    """Write an already compressed message to an aiohttp socket handed to take_over()"""
+    writer = ws._writer
+    if writer._closing:
+        raise ConnectionResetError("Cannot write to closing transport")
+    writer._write_websocket_frame(deflated, opcode, RSV1)
+    # What aiohttp's send_frame does after a write: wait while the transport's buffer is full
+    if writer._output_size > writer._limit:
+        writer._output_size = 0
+        if writer.protocol._paused:
+            await writer.protocol._drain_helper()
@@ -0,0 +1,99 @@
+"""Table-driven dispatch of client messages.
+
+Each message type has one handler, registered with the fields it reads.
+Field specs are compiled into plain tuples when the handler is
+registered, so dispatching a message costs one dict lookup on its 'type'
+plus a set lookup of each declared field's class. Missing optional
+fields are filled in with their defaults before the handler runs, and a
+field of the wrong type raises ValidationError instead of reaching the
+handler.
+"""
+
+_TYPE_NAMES = {
+    str: 'a string',
+    int: 'an integer',
+    float: 'a number',
+    bool: 'true or false',
+    list: 'a list',
+    dict: 'an object',
+}
+
+
+class ValidationError(ValueError):
+    """A client message lacks a required field or has one of the wrong type"""
+
+
+class Field:
+    """A message field: its allowed type(s), the default when absent, and whether it is required.
+
+    A JSON null counts as absent. Types are matched exactly, as decoders
+    only ever produce the builtin types; in particular a boolean is not
+    accepted where an integer is expected.
+    """
+
+    __slots__ = ('types', 'default', 'required')
+
+    def __init__(self, types, default=None, required=False):
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.default = default
+        self.required = required
+
+    def compile(self, name):
+        """Flatten to the tuple the dispatch loop unpacks"""
+        expected = ' or '.join(_TYPE_NAMES.get(t, t.__name__) for t in self.types)
+        return (name, frozenset(self.types), self.default, self.required,
+                f"Field '{name}' must be {expected}")
+
+
+class Dispatcher:
+    """Registry of message handlers keyed by message type.
+
+    handler(session, data) is called with the decoded message once its
+    fields have been validated. Messages of a type nobody registered go to
+    unknown(session, data); messages that need a logged in user but come
+    from an anonymous session go to unauthenticated(session, data).
+    """
+
+    def __init__(self, unknown, unauthenticated):
+        self.unknown = unknown
+        self.unauthenticated = unauthenticated
+        self._routes = {}  # {msg_type: (handler, compiled fields, login_required)}
+
+    def register(self, msg_type, handler, fields=None, login_required=False):
+        if msg_type in self._routes:
+            raise ValueError(f"Message type {msg_type} already has a handler")
+        compiled = tuple(field.compile(name) for name, field in (fields or {}).items())
+        self._routes[msg_type] = (handler, compiled, login_required)
+
+    def known_type(self, data):
+        """The message's type if a handler is registered for it, else 'unknown'
+
+        Used as a metrics label, so clients cannot create new label values.
+        """
+        msg_type = data.get('type')
+        return msg_type if msg_type.__class__ is str and msg_type in self._routes else 'unknown'
+
+    def handler(self, msg_type, fields=None, login_required=False):
+        """Decorator form of register()"""
+        def decorate(handler):
+            self.register(msg_type, handler, fields, login_required)
+            return handler
+        return decorate
+
+    def dispatch(self, session, data):
+        """Validate a decoded message and run its handler; raises ValidationError"""
+        try:
+            handler, fields, login_required = self._routes[data.get('type')]
+        except (KeyError, TypeError):  # TypeError: an unhashable 'type'
+            return self.unknown(session, data)
+        if login_required and not session.username:
+            return self.unauthenticated(session, data)
+        for name, types, default, required, error in fields:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    raise ValidationError(f"Missing field '{name}'")
+                data[name] = default
+            elif value.__class__ not in types:
+                raise ValidationError(error)
+        return handler(session, data)
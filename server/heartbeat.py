@@ -0,0 +1,179 @@
+"""Connection heartbeats and idle reaping.
+
+A connection that has sent nothing for HEARTBEAT_INTERVAL seconds gets a
+protocol-level ping; one that still has not answered HEARTBEAT_TIMEOUT
+seconds later is dead (a half-open TCP connection, a suspended laptop)
+and is closed. With IDLE_TIMEOUT set, connections that have sent no
+application message for that long are closed as idle too.
+
+Inbound traffic only stamps the session with the time it arrived. Each
+session has one entry in a timer wheel, due when it could next need a
+ping or a close; the entry is looked at only when it comes due, and is
+moved to the session's new deadline if traffic arrived in the meantime.
+So a tick costs O(entries due), not a scan over every connection, and
+the per-message cost is one attribute store.
+
+Times come from time.perf_counter, the clock the server already reads
+for its stage timings.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds of silence before a connection is pinged
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", 20.0))
+# Seconds to wait for any traffic, such as the pong, after a ping
+HEARTBEAT_TIMEOUT = float(os.environ.get("HEARTBEAT_TIMEOUT", 10.0))
+# Close connections that sent no application message for this long (0 = never)
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 0))
+# Resolution of the timer wheel in seconds
+HEARTBEAT_TICK = float(os.environ.get("HEARTBEAT_TICK", 1.0))
+
+GOING_AWAY = 1001
+
+
+class TimerWheel:
+    """Hashed timer wheel: schedule() is O(1) and expire() O(entries due).
+
+    Deadlines are rounded up to the next tick. The wheel is sized to span
+    the longest delay it is given, so an entry never waits for more than
+    one turn and everything in a slot that comes due has expired. A later
+    deadline is clamped to the last slot; the entry fires early and its
+    owner reschedules it. There is no cancel: the owner skips entries for
+    things that went away when they fire, which keeps scheduling to one
+    list append.
+    """
+
+    def __init__(self, tick, horizon, now):
+        self.tick = tick
+        self._size = int(math.ceil(horizon / tick)) + 1
+        self._slots = [[] for _ in range(self._size)]
+        self._current = int(now // tick)  # The last tick expired
+
+    def schedule(self, key, deadline):
+        """Fire key at deadline"""
+        tick = -int(-deadline // self.tick)  # Rounded up
+        if tick <= self._current:
+            tick = self._current + 1
+        elif tick - self._current > self._size:
+            tick = self._current + self._size
+        self._slots[tick % self._size].append(key)
+
+    def expire(self, now):
+        """Remove and return the keys due at or before now"""
+        due = []
+        slots = self._slots
+        target = int(now // self.tick)
+        # After a stall of more than one turn, one pass over the slots is enough
+        self._current = max(self._current, target - len(slots))
+        while self._current < target:
+            self._current += 1
+            index = self._current % len(slots)
+            if slots[index]:
+                due.extend(slots[index])
+                slots[index] = []
+        return due
+
+
+class Heartbeat:
+    """Pings silent connections and closes dead and idle ones.
+
+    The connection loop calls add() and remove(), and stores the arrival
+    time of every inbound frame in session.last_seen and of every
+    application message in session.last_active. Sessions added with
+    pings=False are on a transport that keeps itself alive, and are only
+    checked for idleness.
+    """
+
+    def __init__(self, interval=None, timeout=None, idle_timeout=None, tick=None):
+        self.interval = interval or HEARTBEAT_INTERVAL
+        self.timeout = timeout or HEARTBEAT_TIMEOUT
+        self.idle_timeout = IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        tick = tick or HEARTBEAT_TICK
+        horizon = max(self.interval, self.timeout, self.idle_timeout) + tick
+        self._wheel = TimerWheel(tick, horizon, time.perf_counter())
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def add(self, session, pings=True, now=None):
+        now = time.perf_counter() if now is None else now
+        session.last_seen = session.last_active = now
+        session.pinged_at = None
+        session.pings = pings
+        if pings or self.idle_timeout:
+            deadline = now + self.interval if pings else math.inf
+            if self.idle_timeout:
+                deadline = min(deadline, now + self.idle_timeout)
+            self._wheel.schedule(session, deadline)
+
+    def remove(self, session):
+        # The wheel entry stays until it fires and is skipped then
+        session.pings = None
+
+    def check(self, now=None):
+        """Ping, close or reschedule every session that has come due"""
+        now = time.perf_counter() if now is None else now
+        interval, timeout, idle_timeout = self.interval, self.timeout, self.idle_timeout
+        schedule = self._wheel.schedule
+        for session in self._wheel.expire(now):
+            pings = session.pings
+            if pings is None:
+                continue
+            if idle_timeout and now - session.last_active >= idle_timeout:
+                self._reap(session, 'idle')
+                continue
+            pinged_at = session.pinged_at
+            if pinged_at is not None:
+                if session.last_seen >= pinged_at:
+                    pinged_at = session.pinged_at = None
+                elif now - pinged_at >= timeout:
+                    self._reap(session, 'dead')
+                    continue
+            # The next time this session may need a ping or a close
+            if pinged_at is not None:
+                deadline = pinged_at + timeout
+            elif pings:
+                deadline = session.last_seen + interval
+                if deadline <= now:
+                    session.pinged_at = now
+                    asyncio.ensure_future(self._ping(session))
+                    deadline = now + timeout
+            else:
+                deadline = math.inf
+            if idle_timeout:
+                deadline = min(deadline, session.last_active + idle_timeout)
+            schedule(session, deadline)
+
+    async def _ping(self, session):
+        try:
+            await session.ws.ping()
+        except Exception as e:
+            # The pong will not come either; the timeout closes the connection
+            logger.debug("Ping to client %s failed: %r", session.client_id, e, extra={'client': session.client_id})
+
+    def _reap(self, session, reason):
+        metrics.connections_reaped.inc(reason)
+        logger.info("Closing %s connection %s (%s)", reason, session.client_id, session.username,
+                    extra={'client': session.client_id, 'username': session.username, 'reason': reason})
+        asyncio.ensure_future(session.ws.close(code=GOING_AWAY, message=f'{reason} connection'.encode()))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._wheel.tick)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error checking heartbeats: {e!r}")
@@ -0,0 +1,189 @@
+"""Per-room message history.
+
+Recent messages of every room live in a fixed-size in-memory ring of
+already encoded frames, and every message is also appended to a segmented
+log on disk (as JSON) so history survives restarts. Replaying "everything
+since message X" joins the stored frames into one batch without
+serializing anything again; a frame is encoded for another codec at most
+once, the first time a client speaking it asks.
+"""
+import fcntl
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from codec import JSON, Frame
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = os.environ.get(
+    "HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'history'))
+# Messages kept in memory per room for replay
+HISTORY_SIZE = int(os.environ.get("HISTORY_SIZE", 100))
+# Roll over to a new log segment once the current one reaches this size
+HISTORY_SEGMENT_BYTES = int(os.environ.get("HISTORY_SEGMENT_BYTES", 8 * 1024 * 1024))
+# Oldest segments beyond this count are deleted
+HISTORY_SEGMENTS = int(os.environ.get("HISTORY_SEGMENTS", 8))
+# This node's number, 0 to 999, different on every node sharing a backplane (workers get their index)
+HISTORY_NODE = int(os.environ.get("HISTORY_NODE", 0))
+
+# Message ids end in the node number, so nodes never assign the same one
+NODES = 1000
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+def history_frame(room, frames, codec=JSON):
+    """Build one 'history' frame around stored frames without re-encoding them"""
+    return codec.envelope({'type': 'history', 'room': room}, 'messages',
+                          [frame.encode(codec) for frame in frames])
+
+
+class HistoryStore:
+    """Ring buffers of recent frames per room, backed by an append-only log.
+
+    Message ids increase monotonically: milliseconds since the epoch times
+    1000, plus the node number, which makes ids from different backplane
+    nodes unique. A node never assigns an id below the last one it saw from
+    any node, so ids sort roughly in send order, but a frame relayed from
+    another node can arrive after a newer local one; rings are kept in id
+    order regardless. Beyond one message per millisecond a node's ids run
+    ahead of the clock.
+
+    Each log line is "<id>\\t<json room>\\t<payload>". A directory of None
+    keeps history in memory only.
+    """
+
+    def __init__(self, directory=None, size=None, segment_bytes=None, segments=None, node=None):
+        self.node = HISTORY_NODE if node is None else node
+        if not 0 <= self.node < NODES:
+            raise ValueError(f"History node number must be between 0 and {NODES - 1}, not {self.node}")
+        self.directory = directory
+        self.size = size or HISTORY_SIZE
+        self.segment_bytes = segment_bytes or HISTORY_SEGMENT_BYTES
+        self.segments = segments or HISTORY_SEGMENTS
+        self.last_id = 0
+        self._rooms = {}  # {room: deque of (id, Frame)}
+        self._log = None
+        self._log_size = 0
+        self._lock = None
+
+    def open(self):
+        """Take the directory lock, replay existing segments and open the log"""
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, '.lock'), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            logger.warning(f"History directory {self.directory} is in use by another node; keeping history in memory only")
+            self.directory = None
+            return
+        self._lock = lock
+
+        for name in self._segment_names():
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            # A write torn by a crash; everything before it is intact
+                            raise ValueError('truncated record')
+                        msg_id, room, payload = line[:-1].split(b'\t', 2)
+                        self._remember(json.loads(room), int(msg_id), Frame(codec=JSON, payload=payload))
+                    except ValueError:
+                        logger.warning(f"Skipping corrupt history record in {name}")
+        self._roll()
+        logger.info(f"Loaded history for {len(self._rooms)} rooms up to message {self.last_id}")
+
+    def next_id(self):
+        tick = max(self.last_id // NODES + 1, int(time.time() * 1000))
+        msg_id = tick * NODES + self.node
+        self.last_id = msg_id
+        return msg_id
+
+    def append(self, room, message):
+        """Assign the message an id and record it; returns (id, Frame)"""
+        msg_id = self.next_id()
+        message['id'] = msg_id
+        frame = Frame(message)
+        self.store(room, msg_id, frame)
+        return msg_id, frame
+
+    def store(self, room, msg_id, frame):
+        """Record a message frame, such as one relayed from another node"""
+        self._remember(room, msg_id, frame)
+        if self._log is not None:
+            line = b'%d\t%s\t%s\n' % (msg_id, json.dumps(room).encode('utf-8'), frame.encode(JSON))
+            self._log.write(line)
+            self._log_size += len(line)
+            if self._log_size >= self.segment_bytes:
+                self._roll()
+
+    def since(self, room, after_id=None):
+        """Stored frames of a room newer than after_id, oldest first"""
+        ring = self._rooms.get(room)
+        if not ring:
+            return []
+        if after_id is None:
+            return [frame for _, frame in ring]
+        newer = []
+        for msg_id, frame in reversed(ring):
+            if msg_id <= after_id:
+                break
+            newer.append(frame)
+        newer.reverse()
+        return newer
+
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def _remember(self, room, msg_id, frame):
+        ring = self._rooms.get(room)
+        if ring is None:
+            ring = self._rooms[room] = deque(maxlen=self.size)
+        if not ring or msg_id > ring[-1][0]:
+            ring.append((msg_id, frame))
+        else:
+            # Relayed after a newer message; it is nearly always close to the end
+            index = len(ring)
+            while index and ring[index - 1][0] > msg_id:
+                index -= 1
+            if index and ring[index - 1][0] == msg_id:
+                return
+            if len(ring) == ring.maxlen:
+                if index == 0:
+                    return  # Older than everything kept
+                ring.popleft()
+                index -= 1
+            ring.insert(index, (msg_id, frame))
+        if msg_id > self.last_id:
+            self.last_id = msg_id
+
+    def _segment_names(self):
+        names = [n for n in os.listdir(self.directory)
+                 if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+        return sorted(names, key=lambda n: int(n[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+
+    def _roll(self):
+        """Start a new segment and drop the oldest ones past the retention count"""
+        if self._log is not None:
+            self._log.close()
+        name = f"{SEGMENT_PREFIX}{self.last_id + 1}{SEGMENT_SUFFIX}"
+        self._log = open(os.path.join(self.directory, name), 'ab', buffering=64 * 1024)
+        self._log_size = self._log.tell()
+        for old in self._segment_names()[:-self.segments]:
+            os.unlink(os.path.join(self.directory, old))
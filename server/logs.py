@@ -0,0 +1,253 @@
+"""Logging that stays off the event loop: queued, structured and sampled.
+
+Loggers hand their records to a bounded queue, and a background thread
+formats them and writes each batch it finds with one write, so a slow
+terminal or log collector never stalls the loop. Records are formatted
+only on that thread, so hot paths log with %-style arguments behind an
+isEnabledFor() guard rather than with f-strings. Arguments are formatted
+later than the call, so pass values rather than objects that keep
+changing.
+
+With LOG_FORMAT=json (the default) every record is one JSON object per
+line: ts, level, logger, msg, plus any fields given with extra= and exc
+for tracebacks. Per-message records can be sampled by message type, e.g.
+LOG_SAMPLE="chat=0.01,typing=0" keeps one chat record in a hundred and
+no typing ones; the call site asks sampler.keep() before it builds the
+record at all. Levels and sample rates can be changed at runtime through
+apply(), which backs the /admin/logging endpoint.
+
+When the queue is full records are dropped and counted, rather than
+making the loop wait for the writer.
+"""
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import metrics
+from codec import JSON
+
+# Level of the root logger
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# 'json' lines or plain 'text'
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# Fraction of records kept per message type, "type=rate,..."
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "")
+
+TEXT_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def parse_level(level):
+    """A level name or number as a number; ValueError if it is neither"""
+    if isinstance(level, int) and not isinstance(level, bool):
+        return level
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return number
+
+
+def parse_sample(spec):
+    """{message type: rate} from "type=rate,..." """
+    rates = {}
+    for item in spec.split(','):
+        if item.strip():
+            msg_type, _, rate = item.partition('=')
+            rates[msg_type.strip()] = float(rate)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        try:
+            return JSON.encode(entry).decode('utf-8')
+        except TypeError:
+            # A field JSON has no type for
+            return json.dumps(entry, default=str)
+
+
+class Sampler:
+    """Keeps every 1/rate-th record of each message type with a sample rate"""
+
+    def __init__(self, rates=None):
+        self._intervals = {}  # {msg_type: keep one record in this many, 0 for none}
+        self._counts = {}
+        self.update(rates or {})
+
+    def update(self, rates):
+        """Set sample rates, {msg_type: rate from 0 to 1}; a rate of 1 keeps everything"""
+        for msg_type, rate in rates.items():
+            rate = float(rate)
+            if not 0 <= rate <= 1:
+                raise ValueError(f"Sample rate for {msg_type} must be between 0 and 1")
+            if rate == 1:
+                self._intervals.pop(msg_type, None)
+            else:
+                self._intervals[msg_type] = round(1 / rate) if rate else 0
+            self._counts.pop(msg_type, None)
+
+    def rates(self):
+        return {msg_type: 1 / interval if interval else 0.0 for msg_type, interval in self._intervals.items()}
+
+    def keep(self, msg_type):
+        """Whether to log this record of msg_type"""
+        interval = self._intervals.get(msg_type)
+        if interval is None:
+            return True
+        count = self._counts.get(msg_type, 0) + 1
+        self._counts[msg_type] = count
+        if interval and count % interval == 0:
+            return True
+        metrics.log_records_dropped.inc('sampled')
+        return False
+
+
+class QueueHandler(logging.Handler):
+    """Hands records to a writer thread as they are, without formatting them"""
+
+    def __init__(self, stream, formatter, size):
+        super().__init__()
+        self.stream = stream
+        self.setFormatter(formatter)
+        self.size = size
+        self._records = deque()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def handle(self, record):
+        # deque appends are atomic, so the loop thread takes no lock here
+        if len(self._records) >= self.size:
+            metrics.log_records_dropped.inc('queue_full')
+            return
+        # Tracebacks hold the frames they point into; render them now and let go
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        self._records.append(record)
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def emit(self, record):
+        self.handle(record)
+
+    def close(self):
+        """Write out what is queued and stop the writer thread"""
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        super().close()
+
+    def _run(self):
+        records = self._records
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Whatever arrived between emptying the queue and clearing the event is picked up here
+            while records:
+                lines = []
+                while records and len(lines) < 1000:
+                    record = records.popleft()
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:
+                        self.handleError(record)
+                try:
+                    self.stream.write('\n'.join(lines) + '\n')
+                    self.stream.flush()
+                except Exception:
+                    self.handleError(record)
+            if self._stopping:
+                return
+
+
+sampler = Sampler()
+_handler = None
+
+
+def configure(level=None, fmt=None, queue_size=None, sample=None):
+    """Route the root logger through the queue and start the writer thread"""
+    global _handler
+    close()
+    formatter = JsonFormatter() if (fmt or LOG_FORMAT) == 'json' else logging.Formatter(TEXT_FORMAT)
+    sampler.update(parse_sample(LOG_SAMPLE if sample is None else sample))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    _handler = QueueHandler(sys.stderr, formatter, queue_size or LOG_QUEUE_SIZE)
+    root.addHandler(_handler)
+    root.setLevel(parse_level(level or LOG_LEVEL))
+
+
+def close():
+    """Write out what is queued and stop the writer thread"""
+    global _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler.close()
+        _handler = None
+
+
+atexit.register(close)
+
+
+def settings():
+    """Current levels (the root logger under '') and sample rates"""
+    levels = {'': logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return {'levels': levels, 'sample': sampler.rates()}
+
+
+def apply(changes):
+    """Change levels and sample rates at runtime.
+
+    changes is {'levels': {logger name: level}, 'sample': {msg_type: rate}},
+    either key optional; '' or 'root' names the root logger and a level of
+    null resets a logger to its parent's. Nothing changes if any of it is
+    invalid (ValueError).
+    """
+    if not isinstance(changes, dict):
+        raise ValueError("Expected an object with 'levels' and/or 'sample'")
+    levels, rates = changes.get('levels') or {}, changes.get('sample') or {}
+    if not isinstance(levels, dict) or not isinstance(rates, dict):
+        raise ValueError("'levels' and 'sample' must be objects")
+    parsed = {name: logging.NOTSET if level is None else parse_level(level) for name, level in levels.items()}
+    for msg_type, rate in rates.items():
+        if not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+            raise ValueError(f"Sample rate for {msg_type} must be between 0 and 1")
+    for name, level in parsed.items():
+        if name in ('', 'root'):
+            logging.getLogger().setLevel(level or logging.WARNING)
+        else:
+            logging.getLogger(name).setLevel(level)
+    sampler.update(rates)
+    return settings()
@@ -0,0 +1,228 @@
+"""Offline mailboxes for private messages, kept in SQLite.
+
+A private message to a user who is not online on any node is stored in
+their mailbox and delivered in one 'mailbox' frame when they next log
+in. Messages are deleted only once the client acknowledges the last id
+it received, so a client that drops before showing them gets them again.
+
+Writes are group committed. The event loop queues them for a writer
+thread, which runs everything that queued up while it was committing the
+previous batch as one transaction: the commit and its fsync never block
+the loop, and under heavy traffic one fsync covers many messages. Reads
+go through the same thread in order with the writes, so a login sees
+every message stored before it. Every call returns an asyncio future
+that resolves once its batch is committed.
+
+The database is in WAL mode, so the worker processes and nodes of one
+machine can share the file. Only users who have logged in within
+MAILBOX_TTL seconds have a mailbox, so messages to made-up names are
+refused rather than stored. Each mailbox keeps its newest MAILBOX_SIZE
+messages, and messages older than MAILBOX_TTL seconds are expired.
+
+There are no passwords: a mailbox goes to whoever next logs in with its
+name, so it is only as private as usernames are.
+"""
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+from codec import JSON
+
+logger = logging.getLogger(__name__)
+
+# SQLite database holding undelivered private messages (empty = off: messages to offline users fail)
+MAILBOX_PATH = os.environ.get(
+    "MAILBOX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'mailbox.db'))
+# Messages kept per recipient; the oldest are dropped beyond this
+MAILBOX_SIZE = int(os.environ.get("MAILBOX_SIZE", 1000))
+# Seconds an undelivered message is kept
+MAILBOX_TTL = float(os.environ.get("MAILBOX_TTL", 30 * 24 * 3600))
+# Most operations committed in one transaction
+MAILBOX_BATCH = int(os.environ.get("MAILBOX_BATCH", 1000))
+
+# Seconds between sweeps for expired messages
+EXPIRE_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mail (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    created REAL NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mail_recipient ON mail (recipient, id);
+CREATE INDEX IF NOT EXISTS mail_created ON mail (created);
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_seen ON users (seen);
+"""
+
+
+def mailbox_frame(last_id, frames, codec=JSON):
+    """Build one 'mailbox' frame around stored frames without re-encoding them"""
+    return codec.envelope({'type': 'mailbox', 'last_id': last_id}, 'messages',
+                          [frame.encode(codec) for frame in frames])
+
+
+class Mailbox:
+    """Per-recipient queues of encoded messages in a SQLite database.
+
+    Message ids increase across all mailboxes; a recipient's messages are
+    returned oldest first, and acknowledging an id removes it and
+    everything before it. Messages are only stored for users marked
+    seen(). A path of None turns the mailbox off.
+    """
+
+    def __init__(self, path=None, size=None, ttl=None, batch=None):
+        self.path = path
+        self.size = size or MAILBOX_SIZE
+        self.ttl = ttl or MAILBOX_TTL
+        self.batch = batch or MAILBOX_BATCH
+        self._db = None
+        self._ops = queue.SimpleQueue()  # (kind, args, future), or None to stop
+        self._thread = None
+        self._loop = None
+        self._next_expiry = 0
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def open(self):
+        """Open the database and start the writer thread; call from the event loop"""
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            # WAL commits are fsynced, so a stored message survives a power cut
+            db.execute('PRAGMA synchronous=FULL')
+            db.executescript(SCHEMA)
+            pending = db.execute('SELECT COUNT(*) FROM mail').fetchone()[0]
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Cannot open mailbox {self.path} ({e}); messages to offline users will fail")
+            return
+        self._db = db
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._run, name='mailbox', daemon=True)
+        self._thread.start()
+        logger.info(f"Mailbox {self.path} holds {pending} undelivered messages")
+
+    def seen(self, username):
+        """Record that username logged in, giving them a mailbox"""
+        return self._submit('seen', username)
+
+    def put(self, recipient, payload):
+        """Store an encoded message for recipient; resolves to its id, or None if they have no mailbox"""
+        return self._submit('put', recipient, payload)
+
+    def fetch(self, recipient):
+        """Resolves to recipient's [(id, payload)], oldest first"""
+        return self._submit('fetch', recipient)
+
+    def ack(self, recipient, last_id):
+        """Delete recipient's messages up to last_id; resolves to how many went"""
+        return self._submit('ack', recipient, last_id)
+
+    def close(self):
+        """Commit what is queued and stop the writer thread"""
+        if self._thread is None:
+            return
+        self._ops.put(None)
+        self._thread.join()
+        self._thread = None
+        self._db.close()
+        self._db = None
+
+    def _submit(self, kind, *args):
+        future = self._loop.create_future()
+        self._ops.put((kind, args, future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            # Whatever queued up during the last commit goes into this one
+            batch = [self._ops.get()]
+            while len(batch) < self.batch:
+                try:
+                    batch.append(self._ops.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                (results, dropped), error = self._apply(batch), None
+            except sqlite3.Error as e:
+                logger.error(f"Mailbox commit of {len(batch)} operations failed: {e}")
+                results, dropped, error = None, 0, e
+            self._loop.call_soon_threadsafe(self._settle, batch, results, dropped, error,
+                                            time.perf_counter() - started)
+
+    def _apply(self, batch):
+        """Run a batch of operations as one transaction; returns their results and the messages dropped"""
+        db = self._db
+        now = time.time()
+        results = []
+        stored = set()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for kind, args, _ in batch:
+                if kind == 'put':
+                    recipient, payload = args
+                    if db.execute('SELECT 1 FROM users WHERE name = ?', (recipient,)).fetchone() is None:
+                        results.append(None)
+                        continue
+                    results.append(db.execute('INSERT INTO mail (recipient, created, payload) VALUES (?, ?, ?)',
+                                              (recipient, now, payload)).lastrowid)
+                    stored.add(recipient)
+                elif kind == 'seen':
+                    results.append(db.execute('INSERT OR REPLACE INTO users (name, seen) VALUES (?, ?)',
+                                              (args[0], now)).rowcount)
+                elif kind == 'fetch':
+                    results.append(db.execute('SELECT id, payload FROM mail WHERE recipient = ? ORDER BY id',
+                                              args).fetchall())
+                else:
+                    results.append(db.execute('DELETE FROM mail WHERE recipient = ? AND id <= ?', args).rowcount)
+            dropped = 0
+            for recipient in stored:
+                # Only the newest messages of a full mailbox are kept
+                dropped += db.execute('DELETE FROM mail WHERE recipient = ? AND id <= (SELECT id FROM mail '
+                                      'WHERE recipient = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                                      (recipient, recipient, self.size)).rowcount
+            if now >= self._next_expiry:
+                dropped += db.execute('DELETE FROM mail WHERE created < ?', (now - self.ttl,)).rowcount
+                db.execute('DELETE FROM users WHERE seen < ?', (now - self.ttl,))
+                self._next_expiry = now + EXPIRE_INTERVAL
+            db.execute('COMMIT')
+        except BaseException:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        return results, dropped
+
+    def _settle(self, batch, results, dropped, error, seconds):
+        # Back on the event loop, which owns the metrics and the futures
+        metrics.mailbox_commit_seconds.observe(seconds)
+        metrics.mailbox_batch_size.observe(len(batch))
+        if dropped:
+            metrics.mailbox_messages.inc('dropped', dropped)
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
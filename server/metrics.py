@@ -0,0 +1,208 @@
+"""Prometheus metrics, kept cheap enough to leave on in production.
+
+The server runs on one event loop, so counters are plain integers updated
+without locks, and histograms have fixed buckets: an observation is one
+bisect plus two additions, and cumulative bucket counts are only worked
+out when /metrics is scraped. Gauges such as queue depth are callbacks
+evaluated at scrape time, so the hot path does not track them at all.
+"""
+import asyncio
+import os
+from bisect import bisect_left
+
+# Seconds between event loop lag samples
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.5))
+
+# Metric families in the order they are exposed
+REGISTRY = []
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        REGISTRY.append(self)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, (), self.value
+
+
+class LabeledCounter:
+    """A counter split by the value of one label, such as the message type"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, label_value, amount=1):
+        values = self.values
+        values[label_value] = values.get(label_value, 0) + amount
+
+    def samples(self):
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            yield self.name, ((self.label, label_value),), value
+
+
+class Gauge:
+    """A value that goes up and down: set directly, or read from a callback when scraped"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, read=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.value = 0
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield self.name, (), self.read() if self.read is not None else self.value
+
+
+class Histogram:
+    """Observations counted into fixed buckets.
+
+    A histogram may be split by one label; child(value) returns the
+    series for a label value, which is what the hot path observes into.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._children = {}
+        REGISTRY.append(self)
+
+    def child(self, label_value=None):
+        series = self._children.get(label_value)
+        if series is None:
+            series = self._children[label_value] = HistogramSeries(self.buckets)
+        return series
+
+    def observe(self, value):
+        self.child().observe(value)
+
+    def samples(self):
+        for label_value, series in self._children.items():
+            labels = ((self.label, label_value),) if self.label else ()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('le', _number(bound)),), cumulative
+            yield self.name + '_sum', labels, series.sum
+            yield self.name + '_count', labels, cumulative
+
+
+class HistogramSeries:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        # bisect_left finds the first bound >= value, matching Prometheus' le
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    lines.append('')
+    return '\n'.join(lines)
+
+
+async def watch_event_loop(interval=None):
+    """Sample how late the event loop wakes a sleeping task"""
+    interval = interval or LOOP_LAG_INTERVAL
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - expected, 0.0)
+        event_loop_lag.observe(lag)
+        event_loop_lag_last.value = lag
+
+
+messages_in = LabeledCounter('chat_messages_in_total', 'Messages received from clients, by type', 'type')
+messages_out = LabeledCounter('chat_messages_out_total', 'Messages queued for clients, by type', 'type')
+bytes_in = Counter('chat_bytes_in_total', 'Payload bytes received from clients (text frames count characters)')
+bytes_out = Counter('chat_bytes_out_total', 'Payload bytes written to clients, after compression')
+broadcast_fanout = Histogram('chat_broadcast_fanout', 'Local recipients per room broadcast', FANOUT_BUCKETS)
+
+stage_seconds = Histogram('chat_stage_seconds', 'Time spent per message in each processing stage',
+                          LATENCY_BUCKETS, label='stage')
+parse_seconds = stage_seconds.child('parse')
+dispatch_seconds = stage_seconds.child('dispatch')
+encode_seconds = stage_seconds.child('encode')
+send_seconds = stage_seconds.child('send')
+
+event_loop_lag = Histogram('chat_event_loop_lag_seconds', 'How late the event loop ran a timer', LAG_BUCKETS)
+event_loop_lag_last = Gauge('chat_event_loop_lag_last_seconds', 'Most recent event loop lag sample')
+
+handler_errors = LabeledCounter('chat_handler_errors_total',
+                               'Messages whose handler raised, by type; the connection stays open', 'type')
+messages_rejected = LabeledCounter('chat_messages_rejected_total',
+                                   'Inbound messages dropped by rate limits, by exhausted budget', 'budget')
+connections_rejected = LabeledCounter('chat_connections_rejected_total',
+                                      'Connections refused before the handshake, by reason', 'reason')
+connections_reaped = LabeledCounter('chat_connections_reaped_total',
+                                    'Connections closed by the heartbeat, by reason', 'reason')
+compression_frames = LabeledCounter('chat_compression_frames_total',
+                                    'Outbound frames on deflate connections: compressed, shared (compressed bytes '
+                                    'reused), small or incompressible (sent uncompressed)', 'result')
+compression_bytes = LabeledCounter('chat_compression_bytes_total',
+                                   'Payload bytes of compressed frames, before (in) and after (out) deflate',
+                                   'direction')
+log_records_dropped = LabeledCounter('chat_log_records_dropped_total',
+                                     'Log records not written: sampled out, or the writer queue was full', 'reason')
+mailbox_messages = LabeledCounter('chat_mailbox_messages_total',
+                                  'Private messages for offline users: stored, delivered, acked, or dropped '
+                                  'from a full mailbox or expired', 'event')
+mailbox_commit_seconds = Histogram('chat_mailbox_commit_seconds',
+                                   'Time to commit one batch of mailbox operations, fsync included', LAG_BUCKETS)
+mailbox_batch_size = Histogram('chat_mailbox_batch_size', 'Mailbox operations committed together', FANOUT_BUCKETS)
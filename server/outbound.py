@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from aiohttp import WSCloseCode
+
+import metrics
+from broadcast import send_payload
+from codec import JSON
+from compression import take_over
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies for a full outbound queue
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("OUTBOUND_QUEUE_SIZE", 256))
+OUTBOUND_OVERFLOW_POLICY = os.environ.get("OUTBOUND_OVERFLOW_POLICY", DROP_OLDEST)
+
+
+class OutboundQueue:
+    """Bounded send queue for one connection, drained by its own writer task.
+
+    Producers call put() and never wait on the socket, so a stalled reader
+    only fills its own queue. What happens when the queue is full depends on
+    the overflow policy:
+
+    - drop_oldest: discard the oldest queued frame to make room
+    - coalesce: frames sharing a coalesce key (typing updates from one user)
+      replace the queued one in place; if still full, new keyed frames are
+      dropped and anything else evicts the oldest frame
+    - disconnect: close the connection as a slow consumer
+
+    codec is the wire codec the connection speaks; it may change after
+    login, and frames already queued keep the encoding they were queued with.
+    If ws negotiated permessage-deflate, its frames are compressed by
+    compression.py from here on.
+    """
+
+    def __init__(self, ws, maxsize=None, policy=None, codec=None):
+        policy = policy or OUTBOUND_OVERFLOW_POLICY
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.ws = ws
+        self.maxsize = maxsize or OUTBOUND_QUEUE_SIZE
+        self.policy = policy
+        self.codec = codec or JSON
+        self.wbits = take_over(ws)
+        self.max_depth = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # Each entry is a [payload, key, binary] cell so coalescing can swap the payload in place
+        self._frames = deque()
+        self._keyed = {}
+        self._waiter = None
+        self._drained = None
+        self._writer = None
+        self._closed = False
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    def start(self):
+        """Start the writer task"""
+        self._writer = asyncio.ensure_future(self._run())
+        return self
+
+    def send(self, frame, key=None):
+        """Queue a Frame in this connection's codec; returns False if it was not accepted"""
+        codec = self.codec
+        return self.put(frame.encode(codec), key, codec.binary)
+
+    def put(self, payload, key=None, binary=False):
+        """Queue an encoded payload; returns False if it was not accepted"""
+        if self._closed:
+            return False
+
+        if key is not None and self.policy == COALESCE:
+            cell = self._keyed.get(key)
+            if cell is not None:
+                cell[0] = payload
+                cell[2] = binary
+                self.coalesced += 1
+                return True
+
+        if len(self._frames) >= self.maxsize:
+            if self.policy == DISCONNECT:
+                self.dropped += 1
+                self._disconnect()
+                return False
+            if self.policy == COALESCE and key is not None:
+                self.dropped += 1
+                return False
+            self._evict_oldest()
+
+        cell = [payload, key, binary]
+        self._frames.append(cell)
+        if key is not None and self.policy == COALESCE:
+            self._keyed[key] = cell
+        if len(self._frames) > self.max_depth:
+            self.max_depth = len(self._frames)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        return True
+
+    def stats(self):
+        return {
+            'depth': len(self._frames),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+
+    async def drain(self):
+        """Wait until the writer has sent everything queued and is idle, or the queue is closed"""
+        waiter = self._waiter
+        if self._closed or self._writer is None or (waiter is not None and not waiter.done()):
+            return
+        if self._drained is None:
+            self._drained = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._drained)
+
+    async def close(self):
+        """Stop the writer task and discard anything still queued"""
+        self._closed = True
+        self._frames.clear()
+        self._keyed.clear()
+        self._wake_drain()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+
+    def _wake_drain(self):
+        drained, self._drained = self._drained, None
+        if drained is not None and not drained.done():
+            drained.set_result(None)
+
+    def _evict_oldest(self):
+        payload, key, binary = self._frames.popleft()
+        if key is not None:
+            self._keyed.pop(key, None)
+        self.dropped += 1
+
+    def _disconnect(self):
+        logger.warning("Disconnecting slow consumer %s: outbound queue full (%s)", id(self.ws), self.maxsize,
+                       extra={'client': id(self.ws)})
+        self._closed = True
+        self._frames.clear()
+        self._keyed.clear()
+        self._wake_drain()
+        asyncio.ensure_future(self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b'Slow consumer'))
+
+    async def _run(self):
+        frames = self._frames
+        while not self._closed:
+            if not frames:
+                self._wake_drain()
+                # A bare future is cheaper to park on than an Event
+                self._waiter = asyncio.get_running_loop().create_future()
+                await self._waiter
+                self._waiter = None
+                continue
+            payload, key, binary = frames.popleft()
+            if key is not None:
+                self._keyed.pop(key, None)
+            try:
+                started = time.perf_counter()
+                written = await send_payload(self.ws, payload, binary, self.wbits)
+                metrics.send_seconds.observe(time.perf_counter() - started)
+                metrics.bytes_out.inc(written)
+                self.sent += 1
+            except Exception as e:
+                logger.error(f"Error sending to client {id(self.ws)}: {e!r}")
+                self._closed = True
+                self._wake_drain()
+                await self.ws.close()
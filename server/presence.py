@@ -0,0 +1,145 @@
+"""Batched typing and presence events.
+
+Typing indicators and joins/leaves are not fanned out as they arrive.
+They are collected per room and flushed on a tick as one delta frame per
+room: 'typing_update' with the users who started and stopped typing and
+everyone typing now, and 'presence_update' with the users who joined and left. A change that is
+undone within the same tick (a quick typing toggle, a leave followed by a
+rejoin during a reconnect) never reaches clients at all.
+
+With a roster (see roster.py), each presence_update also moves the
+room's roster to a new version and carries the version it applies to
+('since') and the one it leads to ('version'), so a client can tell when
+it missed one.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Seconds between typing_update flushes
+TYPING_INTERVAL = float(os.environ.get("TYPING_INTERVAL", 0.5))
+# Seconds between presence_update flushes
+PRESENCE_INTERVAL = float(os.environ.get("PRESENCE_INTERVAL", 1.0))
+# A user who has not refreshed their typing state for this long stops typing
+TYPING_TIMEOUT = float(os.environ.get("TYPING_TIMEOUT", 5.0))
+
+
+class PresenceBatcher:
+    """Collects typing and presence changes and emits them as periodic deltas.
+
+    send(room, message, coalesce_key=...) is called for every frame; the
+    server passes a send to its own members of the room, as every node
+    feeds its batcher the typing, joins and leaves of the whole room, from
+    its clients and over the backplane. Typing frames carry a coalesce key
+    so a slow consumer's outbound queue can keep only the newest one; that
+    drops the started/stopped deltas of the ones it replaces, so each
+    frame also lists everyone typing, which is all a client needs.
+    presence_update frames go through send_presence instead when it is
+    given.
+    """
+
+    def __init__(self, send, typing_interval=None, presence_interval=None, typing_timeout=None,
+                 send_presence=None, roster=None):
+        self.send = send
+        self.send_presence = send_presence or send
+        self.roster = roster
+        self.typing_interval = typing_interval or TYPING_INTERVAL
+        self.presence_interval = presence_interval or PRESENCE_INTERVAL
+        self.typing_timeout = typing_timeout or TYPING_TIMEOUT
+        self._typists = {}  # {room: {username: expires_at}} shown as typing
+        self._typing_changes = {}  # {room: {username: is_typing}} since the last flush
+        self._presence_changes = {}  # {room: {username: +1 joined / -1 left}}
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._every(self.typing_interval, self.flush_typing)),
+                       asyncio.ensure_future(self._every(self.presence_interval, self.flush_presence))]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def typing(self, room, username, is_typing):
+        self._typing_changes.setdefault(room, {})[username] = bool(is_typing)
+
+    def joined(self, room, username):
+        self._presence_change(room, username, 1)
+
+    def left(self, room, username):
+        self._presence_change(room, username, -1)
+        # Someone who left is not typing any more; drop them without a frame
+        typists = self._typists.get(room)
+        if typists is not None:
+            typists.pop(username, None)
+            if not typists:
+                del self._typists[room]
+        changes = self._typing_changes.get(room)
+        if changes is not None:
+            changes.pop(username, None)
+
+    def flush_typing(self, now=None):
+        """Send one typing_update per room whose set of typists changed"""
+        now = time.monotonic() if now is None else now
+        changes, self._typing_changes = self._typing_changes, {}
+        for room in set(changes) | set(self._typists):
+            typists = self._typists.setdefault(room, {})
+            started, stopped = [], []
+            for username, is_typing in changes.get(room, {}).items():
+                if is_typing:
+                    if username not in typists:
+                        started.append(username)
+                    typists[username] = now + self.typing_timeout
+                elif typists.pop(username, None) is not None:
+                    stopped.append(username)
+            expired = [username for username, expires_at in typists.items() if expires_at <= now]
+            for username in expired:
+                del typists[username]
+            stopped.extend(expired)
+            if not typists:
+                del self._typists[room]
+            if started or stopped:
+                self.send(room, {
+                    'type': 'typing_update',
+                    'room': room,
+                    'started': started,
+                    'stopped': stopped,
+                    'typing': list(typists),
+                    'timestamp': datetime.now().isoformat()
+                }, coalesce_key=('typing', room))
+
+    def flush_presence(self):
+        """Send one presence_update per room with net joins and leaves"""
+        changes, self._presence_changes = self._presence_changes, {}
+        for room, deltas in changes.items():
+            joined = [username for username, delta in deltas.items() if delta > 0]
+            left = [username for username, delta in deltas.items() if delta < 0]
+            if joined or left:
+                message = {
+                    'type': 'presence_update',
+                    'room': room,
+                    'joined': joined,
+                    'left': left,
+                    'timestamp': datetime.now().isoformat()
+                }
+                if self.roster is not None:
+                    message['since'], message['version'] = self.roster.apply(room, joined, left)
+                self.send_presence(room, message)
+
+    def _presence_change(self, room, username, delta):
+        deltas = self._presence_changes.setdefault(room, {})
+        net = deltas.pop(username, 0) + delta
+        if net:
+            deltas[username] = net
+
+    async def _every(self, interval, flush):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                flush()
+            except Exception as e:
+                logger.error(f"Error flushing presence: {e!r}")
@@ -0,0 +1,184 @@
+"""Token bucket rate limits for inbound messages and new connections.
+
+Every inbound frame spends a token from its connection's bucket and from
+its IP address's bucket before it is parsed, so a flood costs a couple of
+dict lookups per frame rather than a decode and a fan-out. Messages that
+get through are then charged to a per-type budget, such as chat or
+private, for the connection that sent them. Connections are admitted
+against a server-wide cap, a per-IP cap and a per-IP connect rate.
+
+A bucket is a two-item list kept in a dict. Buckets are never swept: the
+dicts are rotated once per refill time, and a bucket that has not been
+touched for a whole refill time is dropped, which is harmless because it
+would be full again anyway.
+
+Rates are given as "rate/burst", in tokens per second and bucket size.
+"0" turns a limit off.
+
+Per-IP limits are only on by default with TRUST_FORWARDED_FOR: behind a
+proxy every connection comes from the proxy's address, so without the
+forwarded one they would cap all users together.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate(spec):
+    """(rate, burst) from "rate/burst", or None for "0" or an empty spec"""
+    spec = spec.strip()
+    if not spec or spec == '0':
+        return None
+    rate, _, burst = spec.partition('/')
+    rate = float(rate)
+    return rate, float(burst) if burst else rate
+
+
+def parse_rates(spec):
+    """{message type: (rate, burst)} from "chat=5/10,private=5/10" """
+    rates = {}
+    for item in spec.split(','):
+        msg_type, _, rate = item.partition('=')
+        if msg_type.strip() and parse_rate(rate):
+            rates[msg_type.strip()] = parse_rate(rate)
+    return rates
+
+
+# Take the client address from X-Forwarded-For, as set by the proxy in front;
+# only behind a proxy that appends it, or clients can pick their own address
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "0") == "1"
+
+# Frames a connection may send, of any type
+SESSION_RATE = parse_rate(os.environ.get("RATE_LIMIT_SESSION", "30/60"))
+# Frames all connections from one IP address may send together
+IP_RATE = parse_rate(os.environ.get("RATE_LIMIT_IP", "100/200" if TRUST_FORWARDED_FOR else "0"))
+# Per-type budgets for each connection
+TYPE_RATES = parse_rates(os.environ.get(
+    "RATE_LIMITS", "chat=5/10,private=5/10,typing=5/10,login=1/5,join_room=2/10,history=2/10,roster=2/10"))
+# Connections open at once on this node, and from one IP address (0 = no cap)
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 0))
+MAX_CONNECTIONS_PER_IP = int(os.environ.get("MAX_CONNECTIONS_PER_IP", 50 if TRUST_FORWARDED_FOR else 0))
+# New connections per second from one IP address
+CONNECT_RATE = parse_rate(os.environ.get("RATE_LIMIT_CONNECT", "5/20" if TRUST_FORWARDED_FOR else "0"))
+
+_warned_forwarded = False
+
+
+class RateLimiter:
+    """Token buckets by key, for one rate and burst size"""
+
+    __slots__ = ('rate', 'burst', 'ttl', '_current', '_previous', '_rotate_at')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.ttl = burst / rate  # Time for an empty bucket to fill up
+        self._current = {}  # {key: [tokens, updated_at]}
+        self._previous = {}
+        self._rotate_at = float('-inf')
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def allow(self, key, now, cost=1.0):
+        """Take cost tokens from key's bucket; False if there are not enough"""
+        if now >= self._rotate_at:
+            # Whatever is still in _previous has not been used for a full ttl
+            self._previous, self._current = self._current, {}
+            self._rotate_at = now + self.ttl
+        bucket = self._current.get(key)
+        if bucket is None:
+            bucket = self._previous.pop(key, None) or [self.burst, now]
+            self._current[key] = bucket
+        tokens, updated_at = bucket
+        tokens += (now - updated_at) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        if tokens < cost:
+            bucket[0] = tokens
+            bucket[1] = now
+            return False
+        bucket[0] = tokens - cost
+        bucket[1] = now
+        return True
+
+
+def limiter(rate):
+    """A RateLimiter for a parsed rate, or None when it is turned off"""
+    return RateLimiter(*rate) if rate else None
+
+
+class MessageLimits:
+    """Per-connection, per-IP and per-type budgets for inbound messages"""
+
+    def __init__(self, session_rate=SESSION_RATE, ip_rate=IP_RATE, type_rates=None):
+        self.sessions = limiter(session_rate)
+        self.ips = limiter(ip_rate)
+        self.types = {msg_type: RateLimiter(*rate)
+                      for msg_type, rate in (TYPE_RATES if type_rates is None else type_rates).items()}
+        self.notices = RateLimiter(1.0, 1.0)  # Rate limit errors sent back per connection
+
+    def frame(self, session, now):
+        """Charge a raw frame; returns the name of the exhausted budget, or None"""
+        if self.sessions is not None and not self.sessions.allow(session, now):
+            return 'session'
+        if self.ips is not None and not self.ips.allow(session.remote, now):
+            return 'ip'
+        return None
+
+    def message(self, session, msg_type, now):
+        """Charge a parsed message to its type's budget; False if it is over"""
+        limits = self.types.get(msg_type)
+        return limits is None or limits.allow(session, now)
+
+    def notify(self, session, now):
+        """Whether to tell the client it is being limited; at most once a second"""
+        return self.notices.allow(session, now)
+
+
+class Admission:
+    """Connection caps and connect rate, checked before the WebSocket handshake"""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_per_ip=MAX_CONNECTIONS_PER_IP,
+                 connect_rate=CONNECT_RATE):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.connects = limiter(connect_rate)
+        self.open = 0
+        self._by_ip = {}  # {ip: open connections}, only IPs with some
+
+    def check(self, ip, now):
+        """(HTTP status, reason) to refuse a new connection with, or None to admit it"""
+        if self.max_connections and self.open >= self.max_connections:
+            return 503, 'server_full'
+        if self.max_per_ip and self._by_ip.get(ip, 0) >= self.max_per_ip:
+            return 429, 'ip_connections'
+        if self.connects is not None and not self.connects.allow(ip, now):
+            return 429, 'ip_connect_rate'
+        return None
+
+    def opened(self, ip):
+        self.open += 1
+        self._by_ip[ip] = self._by_ip.get(ip, 0) + 1
+
+    def closed(self, ip):
+        self.open -= 1
+        count = self._by_ip.pop(ip) - 1
+        if count:
+            self._by_ip[ip] = count
+
+
+def client_ip(headers, peer):
+    """The client's address: the last X-Forwarded-For hop when trusted, else the peer"""
+    global _warned_forwarded
+    forwarded = headers.get('X-Forwarded-For')
+    if forwarded:
+        if TRUST_FORWARDED_FOR:
+            # The proxy in front appends the address it saw; earlier entries are client supplied
+            return forwarded.rsplit(',', 1)[-1].strip()
+        if not _warned_forwarded:
+            _warned_forwarded = True
+            logger.warning("Ignoring X-Forwarded-For; set TRUST_FORWARDED_FOR=1 if a proxy in front sets it, "
+                           "so per-IP limits see client addresses")
+    return peer
@@ -0,0 +1,219 @@
+import time
+
+
+class DuplicateUsername(Exception):
+    """Raised when a login asks for a username another session holds"""
+
+
+class Session:
+    """State for one WebSocket connection"""
+
+    __slots__ = ('ws', 'client_id', 'username', 'queue', 'connected_at', 'rooms', 'remote', 'mail_seen',
+                 'last_seen', 'last_active', 'pinged_at', 'pings')  # The last four belong to heartbeat.py
+
+    def __init__(self, ws, queue=None):
+        self.ws = ws
+        self.client_id = id(ws)
+        self.username = None
+        self.queue = queue
+        self.connected_at = time.monotonic()
+        self.rooms = set()
+        self.remote = None  # Client IP address
+        self.mail_seen = 0  # Newest mailbox message id sent to this connection
+        self.last_seen = self.last_active = self.pinged_at = None
+        self.pings = False
+
+
+class SessionRegistry:
+    """Connection, username and room indexes kept in sync.
+
+    Every lookup is a dict access, so finding a private message target or
+    logging in costs the same with 10 or 50k users online. The username
+    index preserves login order and doubles as the online user list. Each
+    room keeps its own member set, so room broadcasts only touch members.
+    """
+
+    def __init__(self):
+        self._by_ws = {}
+        self._by_name = {}
+        self._rooms = {}
+
+    def __len__(self):
+        return len(self._by_ws)
+
+    def __iter__(self):
+        return iter(self._by_ws.values())
+
+    def add(self, ws, queue=None):
+        """Register a new, not yet logged in connection"""
+        session = Session(ws, queue)
+        self._by_ws[ws] = session
+        return session
+
+    def get(self, ws):
+        return self._by_ws.get(ws)
+
+    def find(self, username):
+        """Return the session logged in as username, or None"""
+        return self._by_name.get(username)
+
+    def login(self, session, username, replace=False):
+        """Bind a username to a session.
+
+        If another session already holds the name, raise DuplicateUsername
+        unless replace is set, in which case the name moves to this session
+        and the previous holder is returned so the caller can close it.
+        """
+        holder = self._by_name.get(username)
+        if holder is session:
+            return None
+        if holder is not None:
+            if not replace:
+                raise DuplicateUsername(username)
+            # The new connection takes over the old one's rooms
+            for room in list(holder.rooms):
+                self.leave(holder, room)
+                self.join(session, room)
+            holder.username = None
+        if session.username is not None:
+            del self._by_name[session.username]
+        session.username = username
+        self._by_name[username] = session
+        return holder
+
+    def remove(self, ws):
+        """Forget a connection, release its username and drop it from its rooms.
+
+        The returned session keeps its rooms set so the caller can tell
+        the remaining members who left.
+        """
+        session = self._by_ws.pop(ws, None)
+        if session is None:
+            return None
+        if session.username is not None and self._by_name.get(session.username) is session:
+            del self._by_name[session.username]
+        for room in session.rooms:
+            members = self._rooms[room]
+            members.pop(session, None)
+            if not members:
+                del self._rooms[room]
+        return session
+
+    def usernames(self):
+        """Logged in usernames in login order"""
+        return self._by_name.keys()
+
+    def logged_in(self):
+        """Sessions that have completed login"""
+        return self._by_name.values()
+
+    def join(self, session, room):
+        """Add a session to a room; returns False if it was already a member"""
+        if room in session.rooms:
+            return False
+        members = self._rooms.get(room)
+        if members is None:
+            # A dict rather than a set so members list in join order
+            members = self._rooms[room] = {}
+        members[session] = None
+        session.rooms.add(room)
+        return True
+
+    def leave(self, session, room):
+        """Remove a session from a room; empty rooms are discarded"""
+        if room not in session.rooms:
+            return False
+        session.rooms.discard(room)
+        members = self._rooms[room]
+        members.pop(session, None)
+        if not members:
+            del self._rooms[room]
+        return True
+
+    def members(self, room):
+        """Sessions in a room, in join order"""
+        return self._rooms.get(room, {}).keys()
+
+    def rooms(self):
+        """Room names mapped to their members"""
+        return self._rooms
+
+
+class RemoteDirectory:
+    """Users logged in on other nodes, learned from backplane presence events.
+
+    Mirrors the username and room indexes of SessionRegistry so lookups
+    across the cluster stay dict accesses.
+    """
+
+    def __init__(self):
+        self._nodes = {}  # {username: node_id}
+        self._user_rooms = {}  # {username: set of rooms}
+        self._rooms = {}  # {room: {username: None}}
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def node_of(self, username):
+        """Node the user is logged in on, or None"""
+        return self._nodes.get(username)
+
+    def add(self, username, node_id, rooms=()):
+        self._nodes[username] = node_id
+        self._user_rooms.setdefault(username, set())
+        for room in rooms:
+            self.join(username, room)
+
+    def remove(self, username):
+        """Forget a user; returns the rooms they were in"""
+        self._nodes.pop(username, None)
+        rooms = self._user_rooms.pop(username, set())
+        for room in rooms:
+            self._discard_member(room, username)
+        return rooms
+
+    def join(self, username, room):
+        """Add a user to a room; returns False if they are unknown or already in it"""
+        rooms = self._user_rooms.get(username)
+        if rooms is None or room in rooms:
+            return False
+        rooms.add(room)
+        self._rooms.setdefault(room, {})[username] = None
+        return True
+
+    def leave(self, username, room):
+        """Remove a user from a room; returns False if they were not in it"""
+        rooms = self._user_rooms.get(username)
+        if rooms is None or room not in rooms:
+            return False
+        rooms.discard(room)
+        self._discard_member(room, username)
+        return True
+
+    def clear(self):
+        """Forget every remote user; returns {username: rooms}"""
+        dropped = self._user_rooms
+        self._user_rooms = {}
+        self._nodes.clear()
+        self._rooms.clear()
+        return dropped
+
+    def drop_node(self, node_id):
+        """Forget every user of a node; returns {username: rooms}"""
+        dropped = [name for name, node in self._nodes.items() if node == node_id]
+        return {name: self.remove(name) for name in dropped}
+
+    def members(self, room):
+        """Usernames in a room on other nodes"""
+        return self._rooms.get(room, {}).keys()
+
+    def rooms(self):
+        """Room names mapped to their remote members"""
+        return self._rooms
+
+    def _discard_member(self, room, username):
+        members = self._rooms.get(room)
+        if members is not None:
+            members.pop(username, None)
+            if not members:
+                del self._rooms[room]
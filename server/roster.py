@@ -0,0 +1,99 @@
+"""Versioned room rosters, so clients catch up on who is online from what changed.
+
+Every batch of joins and leaves the presence batcher flushes for a room
+moves that room's roster to a new version and is kept in a short log. A
+client that has a room's member list at some version sends it back when
+it logs in, joins or resyncs, and gets the joins and leaves since then
+from the log, at a cost that follows the churn rather than the room
+size. It gets a full snapshot instead when the log no longer reaches
+back that far, when the changes would outnumber the members, or when the
+version is from another epoch: a restarted server, or another node.
+
+Versions are opaque tokens, '<epoch>.<sequence>'. The sequence is shared
+by all rooms, so a room that empties and is forgotten never hands out a
+version it used before.
+"""
+import os
+from collections import deque
+
+# Roster changes kept per room for catching clients up
+ROSTER_LOG_SIZE = int(os.environ.get("ROSTER_LOG_SIZE", 1024))
+
+
+class RoomRoster:
+    """One room's change log; versions after floor are all in it"""
+
+    __slots__ = ('floor', 'version', 'members', 'log')
+
+    def __init__(self, version, log_size):
+        self.floor = self.version = version
+        self.members = 0
+        self.log = deque(maxlen=log_size)  # (sequence, username, joined)
+
+
+class Roster:
+    """Versions and change logs of every room's member list"""
+
+    def __init__(self, log_size=None, epoch=None):
+        self.log_size = log_size or ROSTER_LOG_SIZE
+        self.epoch = epoch or os.urandom(4).hex()
+        self._sequence = 0
+        self._rooms = {}
+
+    def version(self, room):
+        """The room's current version token"""
+        entry = self._rooms.get(room)
+        return f'{self.epoch}.{entry.version if entry is not None else self._sequence}'
+
+    def apply(self, room, joined, left):
+        """Record a batch of joins and leaves; returns the room's (previous, new) version tokens"""
+        entry = self._rooms.get(room)
+        if entry is None:
+            entry = self._rooms[room] = RoomRoster(self._sequence, self.log_size)
+        previous = f'{self.epoch}.{entry.version}'
+        self._sequence += 1
+        sequence = entry.version = self._sequence
+        log = entry.log
+        for username in joined:
+            if len(log) == log.maxlen:
+                entry.floor = log[0][0]
+            log.append((sequence, username, True))
+        for username in left:
+            if len(log) == log.maxlen:
+                entry.floor = log[0][0]
+            log.append((sequence, username, False))
+        entry.members += len(joined) - len(left)
+        if entry.members <= 0:
+            # Nobody is left to catch up; later versions of the room start a new log
+            del self._rooms[room]
+        return previous, f'{self.epoch}.{sequence}'
+
+    def changes_since(self, room, version, limit=None):
+        """(joined, left) since a version token, or None if the client needs a snapshot.
+
+        limit is the room size: more changes than that and a snapshot is smaller.
+        """
+        epoch, _, sequence = (version or '').partition('.')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        entry = self._rooms.get(room)
+        if entry is None:
+            return None
+        if sequence < entry.floor or sequence > entry.version:
+            return None
+        # Newest first: the first entry seen for a user is where they are now,
+        # the last one tells whether they were in the room at the client's version
+        latest, earliest = {}, {}
+        count = 0
+        for changed, username, joined in reversed(entry.log):
+            if changed <= sequence:
+                break
+            count += 1
+            if limit is not None and count > limit:
+                return None
+            if username not in latest:
+                latest[username] = joined
+            earliest[username] = joined
+        return ([username for username, joined in latest.items() if joined and earliest[username]],
+                [username for username, joined in latest.items() if not joined and not earliest[username]])
@@ -0,0 +1,160 @@
+"""Cached, precompressed serving of the web interface.
+
+web/index.html and the files under web/static/ are read once at startup.
+Each response body is compressed ahead of time with gzip (and brotli when
+the brotli package is installed) and given a strong ETag, so a request
+only picks a variant from Accept-Encoding or answers 304 Not Modified.
+The page is templated with the WebSocket URL of the Host it is served
+for, and the rendered copies are kept in a small LRU cache keyed by host.
+Asset URLs in the page carry a content hash, so browsers may cache the
+assets for good.
+"""
+import gzip
+import hashlib
+import html
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web')
+# Rendered pages kept for distinct Host headers
+PAGE_CACHE_SIZE = int(os.environ.get("PAGE_CACHE_SIZE", 32))
+
+# The page's default server URL, replaced with the URL of the serving host
+DEFAULT_SERVER_URL = 'wss://web-production-8b58c.up.railway.app/ws'
+DEFAULT_SERVER_FIELD = f'id="serverUrl" placeholder="{DEFAULT_SERVER_URL}" value="{DEFAULT_SERVER_URL}"'
+
+REVALIDATE = 'no-cache'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    """One response body with its precompressed variants and ETag"""
+
+    __slots__ = ('content_type', 'etag', 'version', 'variants')
+
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        self.version = hashlib.sha1(body).hexdigest()[:16]
+        self.etag = f'"{self.version}"'
+        compressed = []
+        if brotli is not None:
+            compressed.append(('br', brotli.compress(body)))
+        compressed.append(('gzip', gzip.compress(body, 9)))
+        # Preferred encoding first, identity last; compression that does not pay is dropped
+        self.variants = [(encoding, data) for encoding, data in compressed if len(data) < len(body)]
+        self.variants.append((None, body))
+
+    def response(self, request, cache_control):
+        """200 with the best variant the client accepts, or 304 if its copy is current"""
+        headers = {'ETag': self.etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if etag_matches(request.headers.get('If-None-Match'), self.etag):
+            return web.Response(status=304, headers=headers)
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        for encoding, data in self.variants:
+            if encoding is None or encoding in accepted:
+                if encoding is not None:
+                    headers['Content-Encoding'] = encoding
+                headers['Content-Type'] = self.content_type
+                return web.Response(body=data, headers=headers)
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against an ETag, as RFC 9110 asks for GET"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.replace('W/', '', 1) == etag:
+            return True
+    return False
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings an Accept-Encoding header allows (q=0 excluded)"""
+    accepted = set()
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    return accepted
+
+
+class StaticSite:
+    """The chat page and its assets, loaded into memory once"""
+
+    def __init__(self, directory=None, cache_size=None):
+        self.directory = directory or WEB_DIR
+        self.cache_size = cache_size or PAGE_CACHE_SIZE
+        self.assets = {}  # {name under static/: Asset}
+        self._template = None
+        self._pages = OrderedDict()  # {(scheme, host): Asset}, least recently used first
+
+    def load(self):
+        """Read and precompress everything; raises OSError if the page is missing"""
+        static_dir = os.path.join(self.directory, 'static')
+        for name in sorted(os.listdir(static_dir)) if os.path.isdir(static_dir) else ():
+            with open(os.path.join(static_dir, name), 'rb') as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if content_type.startswith('text/') or content_type.endswith('javascript'):
+                content_type += '; charset=utf-8'
+            self.assets[name] = Asset(body, content_type)
+
+        with open(os.path.join(self.directory, 'index.html'), 'r', encoding='utf-8') as f:
+            template = f.read()
+        # Point asset links at their current version so they can be cached for good
+        for name, asset in self.assets.items():
+            template = template.replace(f'"static/{name}"', f'"static/{name}?v={asset.version}"')
+        self._template = template
+        self._pages.clear()
+        logger.info(f"Loaded web interface with {len(self.assets)} static assets")
+
+    def page(self, scheme, host):
+        """The chat page for a host, rendered and compressed on first use"""
+        key = (scheme, host)
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+            return page
+        # The Host header is client input; escape it before it lands in an attribute
+        server_url = html.escape(f"{scheme}://{host}/ws", quote=True)
+        rendered = self._template.replace(
+            DEFAULT_SERVER_FIELD, f'id="serverUrl" placeholder="{server_url}" value="{server_url}"')
+        page = self._pages[key] = Asset(rendered.encode('utf-8'), 'text/html; charset=utf-8')
+        if len(self._pages) > self.cache_size:
+            self._pages.popitem(last=False)
+        return page
+
+    async def page_handler(self, request):
+        if self._template is None:
+            return web.Response(text="Error loading chat interface", status=500)
+        # Behind a TLS-terminating proxy the page is https but the request is not
+        proto = request.headers.get('X-Forwarded-Proto', request.scheme).split(',')[0].strip()
+        scheme = 'wss' if proto == 'https' else 'ws'
+        host = request.headers.get('Host', 'localhost:8080')
+        return self.page(scheme, host).response(request, REVALIDATE)
+
+    async def asset_handler(self, request):
+        asset = self.assets.get(request.match_info['name'])
+        if asset is None:
+            raise web.HTTPNotFound()
+        # Only a request for the current version may be cached forever
+        current = request.query.get('v') == asset.version
+        return asset.response(request, IMMUTABLE if current else REVALIDATE)
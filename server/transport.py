@@ -0,0 +1,60 @@
+"""Adapters between WebSocket libraries and the connection loop.
+
+The server's connection loop needs two things from a transport: an object
+to send through, with the send_str/send_bytes/close calls of aiohttp's
+WebSocketResponse, and an async iterator of inbound frames yielding str
+for text frames and bytes for binary ones. aiohttp sockets are used as
+they are; WebsocketsConnection adapts a websockets library connection.
+
+An iterator may also yield None for a control frame, such as a pong,
+that proves the peer is alive without carrying a message. aiohttp
+sockets are opened with autoping off so their pings and pongs come
+through here; the websockets library keeps its connections alive itself.
+"""
+import logging
+
+from aiohttp import WSMsgType
+
+logger = logging.getLogger(__name__)
+
+
+async def aiohttp_frames(ws):
+    """Inbound data frames of an aiohttp WebSocketResponse"""
+    async for msg in ws:
+        if msg.type == WSMsgType.TEXT or msg.type == WSMsgType.BINARY:
+            yield msg.data
+        elif msg.type == WSMsgType.PING:
+            await ws.pong(msg.data)
+            yield None
+        elif msg.type == WSMsgType.PONG:
+            yield None
+        elif msg.type == WSMsgType.ERROR:
+            logger.error(f"WebSocket error: {ws.exception()}")
+            break
+
+
+class WebsocketsConnection:
+    """Gives a websockets library connection the sending side of a WebSocketResponse"""
+
+    __slots__ = ('websocket',)
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    @property
+    def protocol(self):
+        return self.websocket.subprotocol
+
+    async def send_str(self, data):
+        await self.websocket.send(data)
+
+    async def send_bytes(self, data):
+        await self.websocket.send(data)
+
+    async def close(self, code=1000, message=b''):
+        await self.websocket.close(code, message.decode('utf-8'))
+
+    async def frames(self):
+        """Inbound frames; websockets already yields str for text and bytes for binary"""
+        async for message in self.websocket:
+            yield message
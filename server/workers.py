@@ -0,0 +1,113 @@
+"""Multi-process mode: worker processes sharing one port.
+
+The supervisor starts N copies of the server. Each binds the same port
+with SO_REUSEPORT, so the kernel spreads new connections across them, and
+each runs its own event loop on its own core. The supervisor hosts the
+backplane broker (see backplane.py) and every worker joins it as a node,
+so rooms, presence and private messages span workers just as they span
+nodes. Each worker keeps its history log in its own directory.
+
+A worker that dies is started again. SIGTERM or SIGINT to the supervisor
+is passed on to the workers, which drain their connections and exit.
+"""
+import asyncio
+import logging
+import os
+import signal
+import sys
+import tempfile
+
+from backplane import LocalSocketBroker
+from history import HISTORY_DIR
+
+logger = logging.getLogger(__name__)
+
+# Worker processes to run; 0 means one per CPU
+WORKERS = int(os.environ.get("WORKERS", 1))
+# 'uvloop' to run on uvloop when it is installed, otherwise asyncio's own loop
+EVENT_LOOP = os.environ.get("EVENT_LOOP", "asyncio")
+# Seconds a worker gets to drain its connections when the server stops
+SHUTDOWN_GRACE = float(os.environ.get("SHUTDOWN_GRACE", 10.0))
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_server.py')
+
+
+def use_event_loop(name=None):
+    """Install the event loop policy for EVENT_LOOP before any loop is created"""
+    name = name or EVENT_LOOP
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:  # pragma: no cover - depends on the environment
+            logger.warning("uvloop is not installed; using the asyncio event loop")
+            return
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif name != 'asyncio':
+        raise ValueError(f"Unknown event loop: {name}")
+
+
+def worker_count(workers=None):
+    workers = WORKERS if workers is None else workers
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+class Supervisor:
+    """Runs and restarts the worker processes and relays between them"""
+
+    def __init__(self, workers, event_loop=None, socket_path=None):
+        self.workers = workers
+        self.event_loop = event_loop or EVENT_LOOP
+        self.socket_path = socket_path or os.environ.get("BACKPLANE_SOCKET") or os.path.join(
+            tempfile.gettempdir(), f"chat-backplane-{os.getpid()}.sock")
+        self.broker = LocalSocketBroker(self.socket_path)
+        self._processes = {}  # {worker index: Process}
+        self._stopping = False
+
+    def worker_env(self, index):
+        env = dict(os.environ,
+                   WORKERS='1',
+                   WORKER_ID=str(index),
+                   HISTORY_NODE=str(index),
+                   REUSE_PORT='1',
+                   BACKPLANE='unix',
+                   BACKPLANE_SOCKET=self.socket_path,
+                   EVENT_LOOP=self.event_loop)
+        if HISTORY_DIR:
+            env['HISTORY_DIR'] = os.path.join(HISTORY_DIR, f'worker-{index}')
+        return env
+
+    async def run(self):
+        await self.broker.start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        logger.info(f"Starting {self.workers} workers")
+        try:
+            watchers = [asyncio.ensure_future(self._keep_running(index)) for index in range(self.workers)]
+            await stop.wait()
+            logger.info("Server shutdown requested, stopping workers")
+        finally:
+            self._stopping = True
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.send_signal(signal.SIGTERM)
+            _, pending = await asyncio.wait(watchers, timeout=SHUTDOWN_GRACE + 5)
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.kill()
+            for watcher in pending:
+                watcher.cancel()
+            await asyncio.gather(*watchers, return_exceptions=True)
+            await self.broker.close()
+            logger.info("All workers stopped")
+
+    async def _keep_running(self, index):
+        while not self._stopping:
+            process = self._processes[index] = await asyncio.create_subprocess_exec(
+                sys.executable, SERVER_SCRIPT, env=self.worker_env(index))
+            logger.info(f"Worker {index} started as pid {process.pid}")
+            code = await process.wait()
+            if not self._stopping:
+                logger.error(f"Worker {index} exited with code {code}, restarting")
+                await asyncio.sleep(1)
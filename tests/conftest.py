@@ -0,0 +1,5 @@
+"""The server modules import each other by bare name, as chat_server.py runs from server/"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
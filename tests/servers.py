@@ -0,0 +1,46 @@
+"""Running chat servers as subprocesses for end-to-end tests"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+
+import aiohttp
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server', 'chat_server.py')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, *args, **env):
+    """A chat server process on port, with env on top of test defaults"""
+    env = dict(os.environ, HOST='127.0.0.1', PORT=str(port), HISTORY_DIR='', MAILBOX_PATH='', LOG_LEVEL='WARNING',
+               RATE_LIMIT_CONNECT='0', **env)
+    return subprocess.Popen([sys.executable, SERVER, *args], env=env)
+
+
+def stop_server(server):
+    if server.poll() is None:
+        server.kill()
+    server.wait()
+
+
+async def wait_until_up(http, port):
+    for _ in range(100):
+        try:
+            async with http.get(f'http://127.0.0.1:{port}/health'):
+                return
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"No server on port {port}")
+
+
+async def login(http, port, username):
+    ws = await http.ws_connect(f'http://127.0.0.1:{port}/ws')
+    await ws.send_json({'type': 'login', 'username': username})
+    assert (await ws.receive_json(timeout=5))['type'] == 'login_success'
+    return ws
@@ -0,0 +1,114 @@
+import asyncio
+
+from backplane import InProcessBackplane, InProcessHub, LocalSocketBackplane
+from registry import RemoteDirectory
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, header, payload):
+        self.events.append((header, payload))
+
+    def kinds(self):
+        return [header['kind'] for header, _ in self.events]
+
+
+def test_in_process_publish_reaches_every_other_node():
+    async def run():
+        hub = InProcessHub()
+        nodes = [InProcessBackplane(f'n{i}', hub) for i in range(3)]
+        recorders = [Recorder() for _ in nodes]
+        for node, recorder in zip(nodes, recorders):
+            await node.start(recorder)
+        nodes[0].publish({'kind': 'room', 'room': 'lobby'}, b'{"x":1}')
+        await asyncio.sleep(0)
+        return recorders
+
+    recorders = asyncio.run(run())
+    assert recorders[0].kinds() == ['reset']
+    for recorder in recorders[1:]:
+        assert recorder.events[-1] == ({'kind': 'room', 'room': 'lobby', 'node': 'n0'}, b'{"x":1}')
+
+
+def test_in_process_send_and_node_down():
+    async def run():
+        hub = InProcessHub()
+        a, b, c = (InProcessBackplane(name, hub) for name in 'abc')
+        recorders = {name: Recorder() for name in 'abc'}
+        for node in (a, b, c):
+            await node.start(recorders[node.node_id])
+        a.send('b', {'kind': 'direct', 'user': 'bob'}, b'hi')
+        a.send('nobody', {'kind': 'direct', 'user': 'x'})
+        await a.close()
+        await asyncio.sleep(0)
+        return recorders
+
+    recorders = asyncio.run(run())
+    assert recorders['b'].kinds() == ['reset', 'direct', 'node_down']
+    assert recorders['c'].kinds() == ['reset', 'node_down']
+    assert recorders['b'].events[1][1] == b'hi'
+
+
+def test_local_socket_fan_out(tmp_path):
+    async def run():
+        path = str(tmp_path / 'backplane.sock')
+        nodes = [LocalSocketBackplane(f'n{i}', path) for i in range(3)]
+        recorders = [Recorder() for _ in nodes]
+        for node, recorder in zip(nodes, recorders):
+            await node.start(recorder)
+        # The first node hosts the broker, the others connect to it
+        assert nodes[0].broker is not None and nodes[1].broker is None
+        await asyncio.sleep(0.1)
+        nodes[0].publish({'kind': 'room', 'room': 'lobby'}, b'payload')
+        nodes[1].send('n2', {'kind': 'direct', 'user': 'carol'})
+        await asyncio.sleep(0.2)
+        await nodes[2].close()
+        await asyncio.sleep(0.2)
+        for node in nodes[:2]:
+            await node.close()
+        return recorders
+
+    first, second, third = asyncio.run(run())
+    assert first.kinds() == ['reset', 'node_down']
+    assert second.kinds() == ['reset', 'room', 'node_down']
+    assert second.events[1] == ({'kind': 'room', 'room': 'lobby', 'node': 'n0'}, b'payload')
+    assert third.kinds() == ['reset', 'room', 'direct']
+    assert third.events[2][0] == {'kind': 'direct', 'user': 'carol', 'to': 'n2', 'node': 'n1'}
+
+
+def test_remote_directory_tracks_users_and_rooms():
+    directory = RemoteDirectory()
+    directory.add('alice', 'node-a', ['lobby'])
+    directory.add('bob', 'node-b')
+    assert directory.node_of('alice') == 'node-a'
+    assert len(directory) == 2
+    assert directory.join('bob', 'lobby')
+    assert not directory.join('bob', 'lobby')
+    assert not directory.join('nobody', 'lobby')
+    assert directory.leave('bob', 'lobby')
+    assert not directory.leave('bob', 'lobby')
+    assert directory.remove('alice') == {'lobby'}
+    assert directory.node_of('alice') is None
+
+
+def test_remote_directory_drops_a_node_and_clears():
+    directory = RemoteDirectory()
+    directory.add('alice', 'node-a', ['lobby', 'dev'])
+    directory.add('bob', 'node-b', ['lobby'])
+    assert directory.drop_node('node-a') == {'alice': {'lobby', 'dev'}}
+    assert directory.node_of('bob') == 'node-b'
+    assert directory.clear() == {'bob': {'lobby'}}
+    assert len(directory) == 0
+
+
+def test_remote_directory_moves_a_user_between_nodes():
+    directory = RemoteDirectory()
+    directory.add('alice', 'node-a', ['lobby'])
+    assert directory.remove('alice') == {'lobby'}
+    directory.add('alice', 'node-b', ['dev'])
+    assert directory.drop_node('node-a') == {}
+    assert directory.node_of('alice') == 'node-b'
+    assert list(directory.members('dev')) == ['alice']
+    assert 'lobby' not in directory.rooms()
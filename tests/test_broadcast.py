@@ -0,0 +1,51 @@
+import asyncio
+
+from aiohttp import WSMsgType, web
+from aiohttp.test_utils import TestClient, TestServer
+
+from broadcast import send_payload
+
+
+class FallbackSocket:
+    """A socket without send_frame, like the websockets adapter"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+def test_pinned_aiohttp_sends_encoded_payloads_as_is():
+    sent_str = []
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        ws.send_str = sent_str.append  # must not be reached
+        await send_payload(ws, b'{"type":"chat"}')
+        await send_payload(ws, b'\x81\xa4type', binary=True)
+        await ws.close()
+        return ws
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get('/ws', handler)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect('/ws')
+            return [await ws.receive() for _ in range(2)]
+
+    text, binary = asyncio.run(scenario())
+    assert (text.type, text.data) == (WSMsgType.TEXT, '{"type":"chat"}')
+    assert (binary.type, binary.data) == (WSMsgType.BINARY, b'\x81\xa4type')
+    assert sent_str == []
+
+
+def test_sockets_without_send_frame_fall_back():
+    ws = FallbackSocket()
+    assert asyncio.run(send_payload(ws, b'{"a":1}')) == 7
+    asyncio.run(send_payload(ws, b'\x01', binary=True))
+    assert ws.sent == ['{"a":1}', b'\x01']
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+
+import chat_server
+import logs
+from mailbox import Mailbox
+
+
+@pytest.mark.parametrize('token, header, status', [
+    ('', '', 403),
+    ('', 'Bearer ', 403),
+    ('secret', '', 403),
+    ('secret', 'Bearer wrong', 403),
+    ('secret', 'Bearer secret', 200),
+])
+def test_queue_stats_need_the_admin_token(monkeypatch, token, header, status):
+    monkeypatch.setattr(chat_server, 'ADMIN_TOKEN', token)
+    request = make_mocked_request('GET', '/stats/queues', headers={'Authorization': header} if header else {})
+    response = asyncio.run(chat_server.queue_stats_handler(request))
+    assert response.status == status
+
+
+
+def admin_logging(monkeypatch, requests):
+    """Send (method, headers, body) requests to /admin/logging; returns statuses, replies and what was relayed"""
+    published = []
+    monkeypatch.setattr(chat_server, 'ADMIN_TOKEN', 'secret')
+    monkeypatch.setattr(chat_server.backplane, 'publish', lambda header, payload=b'': published.append(header))
+    monkeypatch.setattr(logs.sampler, '_intervals', {})
+    app = web.Application()
+    app.router.add_route('*', '/admin/logging', chat_server.log_settings_handler)
+
+    async def run():
+        replies = []
+        async with TestClient(TestServer(app)) as client:
+            for method, headers, body in requests:
+                response = await client.request(method, '/admin/logging', headers=headers, data=body)
+                replies.append((response.status, await response.json()))
+        return replies
+
+    try:
+        return asyncio.run(run()), published
+    finally:
+        logging.getLogger('test.admin').setLevel(logging.NOTSET)
+
+
+def test_log_settings_need_the_admin_token(monkeypatch):
+    change = '{"levels": {"test.admin": "DEBUG"}}'
+    replies, published = admin_logging(monkeypatch, [
+        ('GET', {}, None),
+        ('POST', {}, change),
+        ('POST', {'Authorization': 'Bearer wrong'}, change),
+    ])
+    assert [status for status, _ in replies] == [403, 403, 403]
+    assert published == [] and logging.getLogger('test.admin').level == logging.NOTSET
+
+
+def test_log_settings_reject_bad_changes(monkeypatch):
+    auth = {'Authorization': 'Bearer secret'}
+    replies, published = admin_logging(monkeypatch, [
+        ('POST', auth, 'not json'),
+        ('POST', auth, '{"levels": {"test.admin": "loud"}}'),
+        ('POST', auth, '{"levels": {"test.admin": "DEBUG"}, "sample": {"chat": 5}}'),
+        ('GET', auth, None),
+    ])
+    assert [status for status, _ in replies] == [400, 400, 400, 200]
+    assert replies[1][1] == {'error': 'Unknown log level: loud'}
+    assert 'test.admin' not in replies[3][1]['levels'] and replies[3][1]['sample'] == {}
+    assert published == []
+
+
+def test_log_settings_change_and_relay(monkeypatch):
+    auth = {'Authorization': 'Bearer secret'}
+    change = {'levels': {'test.admin': 'DEBUG'}, 'sample': {'chat': 0.5}}
+    replies, published = admin_logging(monkeypatch, [('POST', auth, json.dumps(change))])
+    status, settings = replies[0]
+    assert status == 200
+    assert settings['levels']['test.admin'] == 'DEBUG' and settings['sample'] == {'chat': 0.5}
+    assert published == [{'kind': 'logging', 'changes': change}]
+
+
+class FakeSocket:
+    """Collects the frames serve() writes to a client"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.inbound = asyncio.Queue()
+
+    async def send_str(self, data):
+        self.sent.append(chat_server.JSON.decode(data))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000, message=b''):
+        self.closed = code
+        self.inbound.put_nowait(None)
+
+    async def frames(self):
+        """What the client sends, until the server closes the connection"""
+        while True:
+            frame = await self.inbound.get()
+            if frame is None:
+                return
+            yield frame
+
+
+def run_client(frames, mailbox=None, pause=0):
+    """Run serve() over the given inbound frames, pausing after each; returns the frames sent back"""
+    ws = FakeSocket()
+
+    async def inbound():
+        for frame in frames:
+            yield frame
+            await asyncio.sleep(pause)
+
+    async def run():
+        if mailbox is not None:
+            mailbox.open()
+        try:
+            await chat_server.serve(ws, inbound(), pings=False, remote='127.0.0.1')
+        finally:
+            if mailbox is not None:
+                mailbox.close()
+
+    asyncio.run(run())
+    return ws.sent
+
+
+def test_undecodable_binary_frames_get_an_error_and_the_connection_stays():
+    sent = run_client([b'\xc1', '{"type": "ping"}'])
+    assert sent[0]['type'] == 'error'
+    assert sent[1]['type'] == 'pong'
+
+
+def test_a_failing_handler_costs_the_message_not_the_connection(monkeypatch):
+    def broken(session, data):
+        raise RuntimeError('boom')
+
+    routes = chat_server.dispatcher._routes
+    monkeypatch.setitem(routes, 'ping', (broken,) + routes['ping'][1:])
+    failed = chat_server.metrics.handler_errors.values
+    before = failed.get('ping', 0)
+    sent = run_client(['{"type": "ping"}', '{"type": "list_rooms"}'])
+    assert sent[0] == dict(sent[0], type='error', message='Could not handle ping message')
+    assert sent[1]['type'] != 'error'
+    assert failed['ping'] == before + 1
+
+
+def test_a_rename_leaves_only_the_rooms_the_old_name_was_in(monkeypatch):
+    changes = []
+    monkeypatch.setattr(chat_server.presence, 'joined', lambda room, username: changes.append(('+', room, username)))
+    monkeypatch.setattr(chat_server.presence, 'left', lambda room, username: changes.append(('-', room, username)))
+    run_client([
+        '{"type": "login", "username": "alice"}',
+        '{"type": "join_room", "room": "dev"}',
+        '{"type": "leave_room", "room": "lobby"}',
+        '{"type": "login", "username": "bob"}',
+    ])
+    assert changes[:3] == [('+', 'lobby', 'alice'), ('+', 'dev', 'alice'), ('-', 'lobby', 'alice')]
+    # The rename, without alice leaving the lobby she was not in; then bob disconnects
+    assert sorted(changes[3:6]) == [('+', 'dev', 'bob'), ('+', 'lobby', 'bob'), ('-', 'dev', 'alice')]
+    assert sorted(changes[6:]) == [('-', 'dev', 'bob'), ('-', 'lobby', 'bob')]
+
+
+@pytest.mark.parametrize('message, error', [
+    ('{"type": "private", "message": "hi"}', "Missing field 'to'"),
+    ('{"type": "private", "to": "", "message": "hi"}', 'Private messages need a recipient'),
+    ('{"type": "private", "to": "nobody", "message": "hi"}', 'User nobody not found'),
+])
+def test_private_messages_need_a_known_recipient(monkeypatch, tmp_path, message, error):
+    mailbox = Mailbox(str(tmp_path / 'mail.db'))
+    monkeypatch.setattr(chat_server, 'mailbox', mailbox)
+    sent = run_client(['{"type": "login", "username": "alice"}', message], mailbox, pause=0.05)
+    assert [frame['message'] for frame in sent if frame['type'] == 'error'] == [error]
+
+
+def test_private_messages_wait_for_users_who_logged_in_before(monkeypatch, tmp_path):
+    mailbox = Mailbox(str(tmp_path / 'mail.db'))
+    monkeypatch.setattr(chat_server, 'mailbox', mailbox)
+    run_client(['{"type": "login", "username": "bob"}'], mailbox, pause=0.05)
+    sent = run_client(['{"type": "login", "username": "alice"}',
+                       '{"type": "private", "to": "bob", "message": "hi"}'], mailbox, pause=0.05)
+    assert sent[-1] == dict(sent[-1], type='private_sent', to='bob', offline=True)
+    sent = run_client(['{"type": "login", "username": "bob"}'], mailbox, pause=0.05)
+    mail, = [frame for frame in sent if frame['type'] == 'mailbox']
+    assert [(m['from'], m['message']) for m in mail['messages']] == [('alice', 'hi')]
+
+
+def test_a_second_login_takes_the_name_over():
+    async def scenario():
+        old, new = FakeSocket(), FakeSocket()
+        clients = [asyncio.ensure_future(chat_server.serve(ws, ws.frames(), pings=False, remote='127.0.0.1'))
+                   for ws in (old, new)]
+        old.inbound.put_nowait('{"type": "login", "username": "alice"}')
+        await asyncio.sleep(0.05)
+        new.inbound.put_nowait('{"type": "login", "username": "alice"}')
+        await asyncio.sleep(0.05)
+        found = chat_server.sessions.find('alice').ws
+        new.inbound.put_nowait(None)
+        await asyncio.gather(*clients)
+        return old, new, found
+
+    old, new, found = asyncio.run(scenario())
+    assert found is new
+    assert old.closed == 4000
+    assert old.sent[-1] == dict(old.sent[-1], type='error', message='alice logged in from another connection')
+    assert new.sent[0]['type'] == 'login_success'
@@ -0,0 +1,60 @@
+import pytest
+
+import metrics
+from codec import JSON, MSGPACK, SUBPROTOCOLS, DecodeError, Frame, decode_binary
+
+
+def test_json_envelope_embeds_encoded_items():
+    items = [JSON.encode({'n': i}) for i in range(3)]
+    payload = JSON.envelope({'type': 'history', 'room': 'lobby'}, 'messages', items)
+    assert JSON.decode(payload) == {'type': 'history', 'room': 'lobby', 'messages': [{'n': 0}, {'n': 1}, {'n': 2}]}
+    assert JSON.decode(JSON.envelope({'type': 'history'}, 'messages', [])) == {'type': 'history', 'messages': []}
+
+
+@pytest.mark.skipif(MSGPACK is None, reason="msgpack is not installed")
+@pytest.mark.parametrize('count', [0, 3, 20, 70000])
+def test_msgpack_envelope_headers(count):
+    items = [MSGPACK.encode(i) for i in range(count)]
+    fields = {'type': 'history', **{f'f{i}': i for i in range(20)}}
+    payload = MSGPACK.envelope(fields, 'messages', items)
+    assert decode_binary(payload) == dict(fields, messages=list(range(count)))
+
+
+def test_frame_encodes_once_per_codec():
+    frame = Frame({'type': 'chat', 'message': 'hi'})
+    assert frame.encode(JSON) is frame.encode(JSON)
+    relayed = Frame(codec=JSON, payload=frame.encode(JSON), msg_type='chat')
+    assert relayed.message == {'type': 'chat', 'message': 'hi'}
+    if MSGPACK is not None:
+        assert MSGPACK.decode(relayed.encode(MSGPACK)) == {'type': 'chat', 'message': 'hi'}
+
+
+def test_json_envelope_keeps_escaped_fields():
+    fields = {'type': 'history', 'room': 'caf\u00e9 "x"\n'}
+    payload = JSON.envelope(fields, 'messages', [JSON.encode('a')])
+    assert JSON.decode(payload) == dict(fields, messages=['a'])
+
+
+def test_frame_counts_one_encode_per_codec():
+    frame = Frame({'type': 'chat', 'message': 'hi'})
+    before = sum(metrics.encode_seconds.counts)
+    for _ in range(3):
+        frame.encode(JSON)
+    assert sum(metrics.encode_seconds.counts) == before + 1
+    # A pre-encoded payload is reused for its own codec without encoding
+    relayed = Frame(codec=JSON, payload=b'{"type":"chat"}', msg_type='chat')
+    assert relayed.type == 'chat'
+    assert relayed.encode(JSON) == b'{"type":"chat"}'
+    assert sum(metrics.encode_seconds.counts) == before + 1
+
+
+def test_subprotocols_name_their_codecs():
+    assert SUBPROTOCOLS['chat.json'] is JSON
+    assert ('chat.msgpack' in SUBPROTOCOLS) == (MSGPACK is not None)
+
+
+@pytest.mark.skipif(MSGPACK is None, reason="msgpack is not installed")
+def test_bad_binary_frames_raise_decode_error():
+    with pytest.raises(DecodeError):
+        decode_binary(b'\xc1')
+    assert decode_binary(MSGPACK.encode({'type': 'ping'})) == {'type': 'ping'}
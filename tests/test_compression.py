@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import zlib
+
+from aiohttp import WSMsgType, web
+from aiohttp.test_utils import TestClient, TestServer
+
+import compression
+import metrics
+from broadcast import send_payload
+from compression import Deflater, take_over
+
+PAYLOAD = b'{"type":"chat","message":"' + b'all work and no play ' * 40 + b'"}'
+
+
+class OldWriter:
+    """A writer without the internals send_deflated() needs"""
+
+    compress = 15
+
+
+class OldSocket:
+    compress = 15
+
+    def __init__(self):
+        self._writer = OldWriter()
+        self.sent = []
+
+    async def send_str(self, data):
+        self.sent.append(data)
+
+
+def test_deflated_payloads_inflate_and_small_ones_are_left_alone():
+    deflater = Deflater(threshold=256)
+    deflated = deflater.compress(PAYLOAD, 15)
+    assert deflater.compress(PAYLOAD, 15) is deflated
+    assert zlib.decompressobj(-15).decompress(deflated + b'\x00\x00\xff\xff') == PAYLOAD
+    assert deflater.compress(b'{"type":"ping"}', 15) is None
+
+
+def test_take_over_falls_back_without_aiohttp_internals(monkeypatch, caplog):
+    monkeypatch.setattr(compression, '_warned', False)
+    sockets = [OldSocket(), OldSocket()]
+    with caplog.at_level(logging.WARNING, logger='compression'):
+        assert [take_over(ws) for ws in sockets] == [0, 0]
+    # aiohttp keeps compressing, and the one warning says so
+    assert [ws._writer.compress for ws in sockets] == [15, 15]
+    assert len(caplog.records) == 1
+    asyncio.run(send_payload(sockets[0], PAYLOAD, wbits=0))
+    assert sockets[0].sent == [PAYLOAD.decode()]
+
+
+def test_pinned_aiohttp_sends_pre_compressed_frames():
+    taken = []
+
+    async def handler(request):
+        ws = web.WebSocketResponse(compress=True)
+        await ws.prepare(request)
+        wbits = take_over(ws)
+        taken.append((wbits, ws._writer.compress))
+        await send_payload(ws, PAYLOAD, wbits=wbits)
+        await send_payload(ws, b'{"type":"pong"}', wbits=wbits)
+        await ws.close()
+        return ws
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get('/ws', handler)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect('/ws', compress=15)
+            return [await ws.receive() for _ in range(2)]
+
+    frames = metrics.compression_frames.values
+    before = frames.get('compressed', 0) + frames.get('shared', 0)
+    big, small = asyncio.run(scenario())
+    assert taken == [(15, 0)]
+    assert frames.get('compressed', 0) + frames.get('shared', 0) == before + 1
+    assert (big.type, big.data) == (WSMsgType.TEXT, PAYLOAD.decode())
+    assert small.data == '{"type":"pong"}'
@@ -0,0 +1,79 @@
+import pytest
+
+from dispatcher import Dispatcher, Field, ValidationError
+from registry import Session
+
+
+def make_dispatcher():
+    calls = []
+    dispatcher = Dispatcher(unknown=lambda s, d: calls.append(('unknown', d)),
+                            unauthenticated=lambda s, d: calls.append(('anonymous', d)))
+
+    @dispatcher.handler('chat', {'message': Field(str, ''), 'room': Field(str, 'lobby'),
+                                 'since': Field(int), 'to': Field(str, required=True)}, login_required=True)
+    def chat(session, data):
+        calls.append(('chat', data))
+
+    return dispatcher, calls
+
+
+def logged_in():
+    session = Session('ws')
+    session.username = 'alice'
+    return session
+
+
+def test_defaults_fill_missing_and_null_fields():
+    dispatcher, calls = make_dispatcher()
+    dispatcher.dispatch(logged_in(), {'type': 'chat', 'to': 'bob', 'room': None})
+    assert calls == [('chat', {'type': 'chat', 'to': 'bob', 'room': 'lobby', 'message': '', 'since': None})]
+
+
+@pytest.mark.parametrize('data, error', [
+    ({'type': 'chat'}, "Missing field 'to'"),
+    ({'type': 'chat', 'to': 'bob', 'message': 5}, "Field 'message' must be a string"),
+    ({'type': 'chat', 'to': 'bob', 'since': True}, "Field 'since' must be an integer"),
+    ({'type': 'chat', 'to': ['bob']}, "Field 'to' must be a string"),
+])
+def test_wrong_types_are_rejected(data, error):
+    dispatcher, calls = make_dispatcher()
+    with pytest.raises(ValidationError, match=error):
+        dispatcher.dispatch(logged_in(), data)
+    assert calls == []
+
+
+def test_unknown_and_anonymous_messages():
+    dispatcher, calls = make_dispatcher()
+    dispatcher.dispatch(logged_in(), {'type': 'nope'})
+    dispatcher.dispatch(logged_in(), {'type': ['unhashable']})
+    dispatcher.dispatch(Session('ws'), {'type': 'chat', 'to': 'bob'})
+    assert [kind for kind, _ in calls] == ['unknown', 'unknown', 'anonymous']
+    assert dispatcher.known_type({'type': 'chat'}) == 'chat'
+    assert dispatcher.known_type({'type': 'nope'}) == 'unknown'
+    assert dispatcher.known_type({'type': 7}) == 'unknown'
+
+
+def test_a_type_has_one_handler():
+    dispatcher, _ = make_dispatcher()
+    with pytest.raises(ValueError):
+        dispatcher.register('chat', lambda s, d: None)
+
+
+def test_union_fields_and_anonymous_handlers():
+    dispatcher, _ = make_dispatcher()
+
+    @dispatcher.handler('ping', {'at': Field((int, float), 0)})
+    def ping(session, data):
+        return data['at']
+
+    assert dispatcher.dispatch(Session('ws'), {'type': 'ping', 'at': 1.5}) == 1.5
+    assert dispatcher.dispatch(Session('ws'), {'type': 'ping'}) == 0
+    with pytest.raises(ValidationError, match="Field 'at' must be an integer or a number"):
+        dispatcher.dispatch(Session('ws'), {'type': 'ping', 'at': '1'})
+
+
+def test_anonymous_messages_are_not_validated():
+    dispatcher, calls = make_dispatcher()
+    # A login-only handler turns anonymous senders away before looking at fields
+    dispatcher.dispatch(Session('ws'), {'type': 'chat', 'message': 5})
+    assert calls == [('anonymous', {'type': 'chat', 'message': 5})]
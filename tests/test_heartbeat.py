@@ -0,0 +1,99 @@
+import asyncio
+
+from heartbeat import GOING_AWAY, Heartbeat, TimerWheel
+from registry import Session
+
+
+def test_keys_fire_at_their_tick_and_not_before():
+    wheel = TimerWheel(tick=1.0, horizon=10, now=0.0)
+    wheel.schedule('a', 2.5)
+    wheel.schedule('b', 3.0)
+    assert wheel.expire(2.9) == []
+    assert wheel.expire(3.0) == ['a', 'b']
+    assert wheel.expire(100.0) == []
+
+
+def test_past_and_far_deadlines_are_clamped():
+    wheel = TimerWheel(tick=1.0, horizon=5, now=10.0)
+    wheel.schedule('late', 3.0)
+    wheel.schedule('far', 1000.0)
+    assert wheel.expire(11.0) == ['late']
+    # Beyond the horizon fires early, within one turn of the wheel
+    due = []
+    now = 11.0
+    while not due:
+        now += 1
+        due = wheel.expire(now)
+    assert due == ['far'] and now <= 17.0
+
+
+def test_a_long_stall_expires_everything_once():
+    wheel = TimerWheel(tick=0.5, horizon=3, now=0.0)
+    for i in range(6):
+        wheel.schedule(i, i * 0.5)
+    assert sorted(wheel.expire(1000.0)) == list(range(6))
+    assert wheel.expire(2000.0) == []
+
+
+class FakeSocket:
+    def __init__(self):
+        self.pings = 0
+        self.closed = None
+
+    async def ping(self):
+        self.pings += 1
+
+    async def close(self, code=1000, message=b''):
+        self.closed = (code, message)
+
+
+def make_heartbeat(**settings):
+    heartbeat = Heartbeat(tick=1, **settings)
+    # Start the wheel at 0 so the tests can pass their own clock to add() and check()
+    heartbeat._wheel = TimerWheel(1, heartbeat._wheel._size, 0.0)
+    return heartbeat
+
+
+def run_checks(heartbeat, session, steps):
+    """Call check() at each (time, traffic) step; traffic stamps the session first"""
+    async def run():
+        for now, traffic in steps:
+            if traffic:
+                session.last_seen = now
+                if traffic == 'message':
+                    session.last_active = now
+            heartbeat.check(now)
+            await asyncio.sleep(0)
+    asyncio.run(run())
+
+
+def test_silent_connections_are_pinged_then_closed():
+    heartbeat = make_heartbeat(interval=10, timeout=5, idle_timeout=0)
+    session = Session(FakeSocket())
+    heartbeat.add(session, now=0.0)
+    run_checks(heartbeat, session, [(9.0, None), (10.0, None)])
+    assert session.ws.pings == 1 and session.ws.closed is None
+    run_checks(heartbeat, session, [(14.0, None), (15.0, None)])
+    assert session.ws.closed == (GOING_AWAY, b'dead connection')
+
+
+def test_an_answered_ping_keeps_the_connection():
+    heartbeat = make_heartbeat(interval=10, timeout=5, idle_timeout=0)
+    session = Session(FakeSocket())
+    heartbeat.add(session, now=0.0)
+    run_checks(heartbeat, session, [(10.0, None), (12.0, 'pong')] + [(t, None) for t in range(13, 22)])
+    assert session.ws.pings == 1 and session.ws.closed is None
+    run_checks(heartbeat, session, [(22.0, None)])
+    assert session.ws.pings == 2
+
+
+def test_idle_and_removed_sessions():
+    heartbeat = make_heartbeat(interval=10, timeout=5, idle_timeout=30)
+    idle, gone = Session(FakeSocket()), Session(FakeSocket())
+    heartbeat.add(idle, pings=False, now=0.0)
+    heartbeat.add(gone, now=0.0)
+    heartbeat.remove(gone)
+    run_checks(heartbeat, idle, [(float(t), 'frame') for t in range(1, 31)])
+    # Pings and pongs are traffic but not activity
+    assert idle.ws.closed == (GOING_AWAY, b'idle connection')
+    assert idle.ws.pings == 0 and gone.ws.pings == 0 and gone.ws.closed is None
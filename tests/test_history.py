@@ -0,0 +1,69 @@
+import pytest
+
+import history as history_module
+from codec import JSON, Frame
+from history import HistoryStore
+
+
+def frame(text):
+    return Frame({'type': 'chat', 'message': text})
+
+
+def messages(frames):
+    return [JSON.decode(f.encode(JSON))['message'] for f in frames]
+
+
+def test_nodes_never_assign_the_same_id(monkeypatch):
+    monkeypatch.setattr(history_module.time, 'time', lambda: 1792220992.101)
+    first, second = HistoryStore(node=0), HistoryStore(node=1)
+    ids = [store.next_id() for store in (first, second, first, second)]
+    assert len(set(ids)) == 4
+    assert [i % 1000 for i in ids] == [0, 1, 0, 1]
+
+
+def test_ids_increase_past_the_clock_and_past_relayed_ids(monkeypatch):
+    monkeypatch.setattr(history_module.time, 'time', lambda: 1792220992.101)
+    store = HistoryStore(node=3)
+    ids = [store.next_id() for _ in range(3)]
+    assert ids == [1792220992101003, 1792220992102003, 1792220992103003]
+    store.store('lobby', 1792220992200007, frame('relayed'))
+    assert store.next_id() == 1792220992201003
+
+
+def test_bad_node_numbers_are_refused():
+    with pytest.raises(ValueError):
+        HistoryStore(node=1000)
+
+
+def test_relayed_frames_are_kept_in_id_order():
+    store = HistoryStore(size=3, node=0)
+    for msg_id, text in ((10, 'a'), (30, 'c'), (20, 'b'), (30, 'c again'), (5, 'too old')):
+        store.store('lobby', msg_id, frame(text))
+    assert messages(store.since('lobby')) == ['a', 'b', 'c']
+    assert messages(store.since('lobby', 10)) == ['b', 'c']
+    store.store('lobby', 25, frame('b2'))
+    assert messages(store.since('lobby')) == ['b', 'b2', 'c']
+
+
+def test_two_nodes_relaying_to_each_other_agree(monkeypatch):
+    monkeypatch.setattr(history_module.time, 'time', lambda: 1792220992.101)
+    nodes = [HistoryStore(node=0), HistoryStore(node=1)]
+    # Both send in the same millisecond; each sees its own frame first
+    sent = [(node.append('lobby', {'type': 'chat', 'message': f'from {i}'})) for i, node in enumerate(nodes)]
+    nodes[0].store('lobby', *sent[1])
+    nodes[1].store('lobby', *sent[0])
+    assert messages(nodes[0].since('lobby')) == messages(nodes[1].since('lobby')) == ['from 0', 'from 1']
+    assert messages(nodes[1].since('lobby', sent[0][0])) == ['from 1']
+
+
+def test_history_survives_a_restart_in_id_order(tmp_path):
+    store = HistoryStore(str(tmp_path), node=0)
+    store.open()
+    store.store('lobby', 2000, frame('local'))
+    store.store('lobby', 1001, frame('relayed late'))
+    store.close()
+    reopened = HistoryStore(str(tmp_path), node=0)
+    reopened.open()
+    assert messages(reopened.since('lobby')) == ['relayed late', 'local']
+    assert reopened.last_id == 2000
+    reopened.close()
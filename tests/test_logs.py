@@ -0,0 +1,84 @@
+import logging
+
+import pytest
+
+import logs
+from logs import Sampler, parse_level, parse_sample
+
+
+@pytest.fixture
+def restore_logging():
+    """Put back the levels and sample rates a test changes"""
+    root = logging.getLogger()
+    levels = {name: logging.getLogger(name).level for name in ('', 'test.logs', 'test.other')}
+    rates = dict(logs.sampler._intervals)
+    yield
+    for name, level in levels.items():
+        (root if name == '' else logging.getLogger(name)).setLevel(level)
+    logs.sampler._intervals = rates
+    logs.sampler._counts = {}
+
+
+def kept(sampler, msg_type, records):
+    return [i for i in range(1, records + 1) if sampler.keep(msg_type)]
+
+
+def test_sampler_keeps_every_nth_record():
+    sampler = Sampler({'chat': 0.25, 'typing': 0, 'join': 1, 'ping': 0.3})
+    assert kept(sampler, 'chat', 12) == [4, 8, 12]
+    assert kept(sampler, 'typing', 10) == []
+    assert kept(sampler, 'join', 3) == [1, 2, 3]
+    assert kept(sampler, 'ping', 6) == [3, 6]  # 1/0.3 rounds to every 3rd
+    assert kept(sampler, 'other', 2) == [1, 2]
+    assert sampler.rates() == {'chat': 0.25, 'typing': 0.0, 'ping': 1 / 3}
+
+
+def test_sampler_update_restarts_the_count():
+    sampler = Sampler({'chat': 0.5})
+    assert kept(sampler, 'chat', 3) == [2]
+    sampler.update({'chat': 0.5})
+    assert kept(sampler, 'chat', 2) == [2]
+    sampler.update({'chat': 1})
+    assert sampler.rates() == {} and sampler.keep('chat')
+    with pytest.raises(ValueError):
+        sampler.update({'chat': 2})
+
+
+def test_parsers():
+    assert parse_level('debug') == logging.DEBUG
+    assert parse_level(15) == 15
+    for bad in ('loud', True, None):
+        with pytest.raises(ValueError):
+            parse_level(bad)
+    assert parse_sample(' chat=0.01, typing=0 ,') == {'chat': 0.01, 'typing': 0.0}
+    with pytest.raises(ValueError):
+        parse_sample('chat')
+
+
+def test_apply_changes_levels_and_rates(restore_logging):
+    logging.getLogger('test.other').setLevel(logging.ERROR)
+    settings = logs.apply({'levels': {'root': 'warning', 'test.logs': 'DEBUG', 'test.other': None},
+                           'sample': {'chat': 0.5}})
+    assert settings['levels']['test.logs'] == 'DEBUG'
+    assert 'test.other' not in settings['levels']
+    assert settings['levels'][''] == 'WARNING'
+    assert settings['sample']['chat'] == 0.5
+
+
+@pytest.mark.parametrize('changes', [
+    None,
+    ['levels'],
+    {'levels': ['test.logs']},
+    {'sample': 'chat=0.5'},
+    {'levels': {'test.logs': 'DEBUG', 'test.other': 'loud'}},
+    {'levels': {'test.logs': 'DEBUG'}, 'sample': {'chat': 2}},
+    {'levels': {'test.logs': 'DEBUG'}, 'sample': {'chat': 0.5, 'typing': '0'}},
+    {'levels': {'test.logs': 'DEBUG'}, 'sample': {'chat': -0.1}},
+])
+def test_apply_changes_nothing_if_anything_is_invalid(restore_logging, changes):
+    logs.sampler.update({'typing': 0})
+    before = logs.settings()
+    with pytest.raises(ValueError):
+        logs.apply(changes)
+    assert logs.settings() == before
+    assert logging.getLogger('test.logs').level == logging.NOTSET
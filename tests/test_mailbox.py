@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import metrics
+from codec import JSON, Frame
+from mailbox import Mailbox, mailbox_frame
+
+
+def run_with(path, scenario, users=('bob', 'carol'), **options):
+    async def run():
+        mailbox = Mailbox(str(path), **options)
+        mailbox.open()
+        try:
+            await asyncio.gather(*(mailbox.seen(user) for user in users))
+            return await scenario(mailbox)
+        finally:
+            mailbox.close()
+    return asyncio.run(run())
+
+
+def test_put_fetch_ack(tmp_path):
+    async def scenario(mailbox):
+        ids = await asyncio.gather(*(mailbox.put('bob', b'm%d' % i) for i in range(3)))
+        await mailbox.put('carol', b'other')
+        fetched = await mailbox.fetch('bob')
+        acked = await mailbox.ack('bob', ids[1])
+        return ids, fetched, acked, await mailbox.fetch('bob')
+
+    ids, fetched, acked, remaining = run_with(tmp_path / 'mail.db', scenario)
+    assert ids == sorted(ids)
+    assert fetched == [(ids[0], b'm0'), (ids[1], b'm1'), (ids[2], b'm2')]
+    assert acked == 2
+    assert remaining == [(ids[2], b'm2')]
+
+
+def test_mail_survives_a_restart(tmp_path):
+    path = tmp_path / 'mail.db'
+    run_with(path, lambda mailbox: mailbox.put('bob', b'kept'))
+    assert [payload for _, payload in run_with(path, lambda mailbox: mailbox.fetch('bob'))] == [b'kept']
+
+
+def test_full_mailboxes_keep_the_newest(tmp_path):
+    async def scenario(mailbox):
+        for i in range(5):
+            await mailbox.put('bob', b'%d' % i)
+        return await mailbox.fetch('bob')
+
+    assert [payload for _, payload in run_with(tmp_path / 'mail.db', scenario, size=2)] == [b'3', b'4']
+
+
+def test_a_burst_is_committed_in_few_batches(tmp_path):
+    async def scenario(mailbox):
+        return await asyncio.gather(*(mailbox.put(f'user{i}', b'x') for i in range(200)))
+
+    batches = metrics.mailbox_batch_size.child()
+    before = sum(batches.counts)
+    users = [f'user{i}' for i in range(200)]
+    assert len(set(run_with(tmp_path / 'mail.db', scenario, users))) == 200
+    assert sum(batches.counts) - before < 20
+
+
+def test_mail_is_only_kept_for_users_who_logged_in(tmp_path):
+    async def scenario(mailbox):
+        refused = await mailbox.put('mallory', b'spam')
+        await mailbox.seen('mallory')
+        return refused, await mailbox.put('mallory', b'hi'), await mailbox.fetch('mallory')
+
+    refused, stored, fetched = run_with(tmp_path / 'mail.db', scenario)
+    assert refused is None
+    assert fetched == [(stored, b'hi')]
+
+
+
+def test_old_mail_and_users_expire(tmp_path, monkeypatch):
+    async def scenario(mailbox):
+        await mailbox.put('bob', b'old')
+        later = time.time() + 120
+        monkeypatch.setattr(time, 'time', lambda: later)
+        await mailbox.seen('carol')  # The next commit sweeps, as the expiry interval has passed
+        return await mailbox.fetch('bob'), await mailbox.put('bob', b'new'), await mailbox.put('carol', b'hi')
+
+    fetched, to_bob, to_carol = run_with(tmp_path / 'mail.db', scenario, ttl=60)
+    assert fetched == [] and to_bob is None and to_carol is not None
+
+
+def test_disabled_without_a_path():
+    mailbox = Mailbox(None)
+    mailbox.open()
+    assert not mailbox.enabled
+    mailbox.close()
+
+
+def test_mailbox_frame():
+    frames = [Frame({'type': 'private', 'from': 'alice', 'message': 'hi'})]
+    assert JSON.decode(mailbox_frame(7, frames)) == {
+        'type': 'mailbox', 'last_id': 7, 'messages': [{'type': 'private', 'from': 'alice', 'message': 'hi'}]}
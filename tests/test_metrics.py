@@ -0,0 +1,75 @@
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, LabeledCounter, render
+
+
+@pytest.fixture
+def registered():
+    """Metrics created in a test, taken out of the registry afterwards"""
+    before = list(metrics.REGISTRY)
+    yield
+    metrics.REGISTRY[:] = before
+
+
+def family(name):
+    """The rendered lines of one metric family"""
+    lines = render().splitlines()
+    return [line for line in lines if line.startswith((f'# HELP {name} ', f'# TYPE {name} ', name + '_', name + '{',
+                                                       name + ' '))]
+
+
+def test_histogram_buckets_are_cumulative(registered):
+    histogram = Histogram('test_seconds', 'Test timings', (0.5, 1, 2.5))
+    for value in (0.1, 0.5, 0.7, 3, 100):
+        histogram.observe(value)
+    assert family('test_seconds') == [
+        '# HELP test_seconds Test timings',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.5"} 2',  # le is inclusive
+        'test_seconds_bucket{le="1"} 3',
+        'test_seconds_bucket{le="2.5"} 3',
+        'test_seconds_bucket{le="+Inf"} 5',
+        'test_seconds_sum 104.3',
+        'test_seconds_count 5',
+    ]
+
+
+def test_labeled_histogram_series(registered):
+    histogram = Histogram('test_stage_seconds', 'Stages', (1.0,), label='stage')
+    histogram.child('encode').observe(2.0)
+    histogram.child('send').observe(0.25)
+    assert family('test_stage_seconds')[2:] == [
+        'test_stage_seconds_bucket{stage="encode",le="1.0"} 0',
+        'test_stage_seconds_bucket{stage="encode",le="+Inf"} 1',
+        'test_stage_seconds_sum{stage="encode"} 2.0',
+        'test_stage_seconds_count{stage="encode"} 1',
+        'test_stage_seconds_bucket{stage="send",le="1.0"} 1',
+        'test_stage_seconds_bucket{stage="send",le="+Inf"} 1',
+        'test_stage_seconds_sum{stage="send"} 0.25',
+        'test_stage_seconds_count{stage="send"} 1',
+    ]
+
+
+def test_label_values_are_escaped(registered):
+    counter = LabeledCounter('test_messages_total', 'Messages', 'type')
+    counter.inc('say "hi"')
+    counter.inc('back\\slash', 2)
+    counter.inc('two\nlines')
+    assert family('test_messages_total')[2:] == [
+        'test_messages_total{type="back\\\\slash"} 2',
+        'test_messages_total{type="say \\"hi\\""} 1',
+        'test_messages_total{type="two\\nlines"} 1',
+    ]
+
+
+def test_counters_and_gauges(registered):
+    counter = Counter('test_bytes_total', 'Bytes')
+    counter.inc(3)
+    Gauge('test_depth', 'Depth', read=lambda: 1.5)
+    Gauge('test_lag', 'Lag').value = float('inf')
+    assert family('test_bytes_total') == ['# HELP test_bytes_total Bytes', '# TYPE test_bytes_total counter',
+                                          'test_bytes_total 3']
+    assert family('test_depth')[1:] == ['# TYPE test_depth gauge', 'test_depth 1.5']
+    assert family('test_lag')[2:] == ['test_lag +Inf']
+    assert render().endswith('\n')
@@ -0,0 +1,80 @@
+import asyncio
+
+import aiohttp
+
+from servers import free_port, login, start_server, stop_server, wait_until_up
+
+
+async def last_typing_update(ws, seconds):
+    """The typing list of the last typing_update ws receives within seconds"""
+    typing = None
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    while loop.time() < deadline:
+        try:
+            message = await ws.receive_json(timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            break
+        if message['type'] == 'typing_update':
+            typing = sorted(message['typing'])
+    return typing
+
+
+async def typing_on_two_nodes(socket_path):
+    ports = [free_port(), free_port()]
+    servers = [start_server(port, BACKPLANE='unix', BACKPLANE_SOCKET=socket_path, HISTORY_NODE=str(node),
+                            TYPING_INTERVAL='0.1')
+               for node, port in enumerate(ports)]
+    try:
+        async with aiohttp.ClientSession() as http:
+            for port in ports:
+                await wait_until_up(http, port)
+            alice = await login(http, ports[0], 'alice')
+            bob = await login(http, ports[1], 'bob')
+            await asyncio.sleep(0.5)  # Each node learns of the other's user
+            await alice.send_json({'type': 'typing', 'room': 'lobby', 'is_typing': True})
+            await bob.send_json({'type': 'typing', 'room': 'lobby', 'is_typing': True})
+            both = await asyncio.gather(last_typing_update(alice, 1), last_typing_update(bob, 1))
+            await bob.send_json({'type': 'typing', 'room': 'lobby', 'is_typing': False})
+            after_bob_stopped = await asyncio.gather(last_typing_update(alice, 1), last_typing_update(bob, 1))
+            return both, after_bob_stopped
+    finally:
+        for server in servers:
+            stop_server(server)
+
+
+def test_every_node_reports_the_typists_of_the_whole_room(tmp_path):
+    both, after_bob_stopped = asyncio.run(typing_on_two_nodes(str(tmp_path / 'backplane.sock')))
+    assert both == [['alice', 'bob'], ['alice', 'bob']]
+    assert after_bob_stopped == [['alice'], ['alice']]
+
+
+async def reconnect_on_another_node(socket_path):
+    ports = [free_port(), free_port()]
+    servers = [start_server(port, BACKPLANE='unix', BACKPLANE_SOCKET=socket_path, HISTORY_NODE=str(node))
+               for node, port in enumerate(ports)]
+    try:
+        async with aiohttp.ClientSession() as http:
+            for port in ports:
+                await wait_until_up(http, port)
+            old = await login(http, ports[0], 'alice')
+            carol = await login(http, ports[0], 'carol')
+            await asyncio.sleep(0.5)
+            new = await login(http, ports[1], 'alice')
+            while (await old.receive(timeout=5)).type != aiohttp.WSMsgType.CLOSE:
+                pass
+            await asyncio.sleep(0.5)  # The old node's logout must not undo the move
+            await carol.send_json({'type': 'private', 'to': 'alice', 'message': 'still there?'})
+            while True:
+                message = await new.receive_json(timeout=5)
+                if message['type'] == 'private':
+                    return old.close_code, message
+    finally:
+        for server in servers:
+            stop_server(server)
+
+
+def test_a_login_on_another_node_takes_the_name_over(tmp_path):
+    close_code, message = asyncio.run(reconnect_on_another_node(str(tmp_path / 'backplane.sock')))
+    assert close_code == 4000
+    assert (message['from'], message['message']) == ('carol', 'still there?')
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from outbound import COALESCE, DISCONNECT, DROP_OLDEST, OutboundQueue
+
+
+class FakeSocket:
+    """Records what an OutboundQueue writes"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send_str(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000, message=b''):
+        self.closed = code
+
+
+def payloads(queue):
+    return [cell[0] for cell in queue._frames]
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    queue = OutboundQueue(FakeSocket(), maxsize=3, policy=DROP_OLDEST)
+    for i in range(5):
+        assert queue.put(b'%d' % i)
+    assert payloads(queue) == [b'2', b'3', b'4']
+    assert queue.dropped == 2 and queue.max_depth == 3
+
+
+def test_coalesce_replaces_keyed_frames_in_place():
+    queue = OutboundQueue(FakeSocket(), maxsize=3, policy=COALESCE)
+    queue.put(b'chat')
+    queue.put(b'typing 1', key=('typing', 'lobby'))
+    queue.put(b'typing 2', key=('typing', 'lobby'))
+    assert payloads(queue) == [b'chat', b'typing 2']
+    assert queue.coalesced == 1
+    queue.put(b'presence', key=('presence', 'lobby'))
+    # Full: a new keyed frame is dropped, anything else evicts the oldest
+    assert not queue.put(b'other', key=('typing', 'dev'))
+    assert queue.put(b'chat 2')
+    assert payloads(queue) == [b'typing 2', b'presence', b'chat 2']
+
+
+def test_disconnect_closes_a_slow_consumer():
+    async def run():
+        ws = FakeSocket()
+        queue = OutboundQueue(ws, maxsize=2, policy=DISCONNECT)
+        assert queue.put(b'1') and queue.put(b'2')
+        assert not queue.put(b'3')
+        assert not queue.put(b'4')
+        await asyncio.sleep(0)
+        return ws, queue
+
+    ws, queue = asyncio.run(run())
+    assert ws.closed == 1013
+    assert queue.depth == 0 and queue.dropped == 1
+
+
+def test_writer_sends_in_order_and_drains():
+    async def run():
+        ws = FakeSocket()
+        queue = OutboundQueue(ws, maxsize=10).start()
+        for i in range(3):
+            queue.put(b'%d' % i)
+        await asyncio.wait_for(queue.drain(), 1)
+        await queue.close()
+        return ws, queue
+
+    ws, queue = asyncio.run(run())
+    assert ws.sent == ['0', '1', '2']
+    assert queue.sent == 3
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        OutboundQueue(FakeSocket(), policy='bogus')
+
+
+class StalledSocket(FakeSocket):
+    """A client that stopped reading: sends never finish"""
+
+    async def send_str(self, data):
+        await asyncio.Event().wait()
+
+
+class BrokenSocket(FakeSocket):
+    async def send_str(self, data):
+        raise ConnectionResetError("gone")
+
+
+def test_a_stalled_client_only_fills_its_own_queue():
+    async def run():
+        stalled, healthy = StalledSocket(), FakeSocket()
+        queues = [OutboundQueue(ws, maxsize=4).start() for ws in (stalled, healthy)]
+        for i in range(10):
+            for queue in queues:
+                assert queue.put(b'%d' % i)
+            await asyncio.sleep(0)
+        await asyncio.wait_for(queues[1].drain(), 1)
+        stats = [queue.stats() for queue in queues]
+        for queue in queues:
+            await queue.close()
+        return healthy, stats
+
+    healthy, (stalled_stats, healthy_stats) = asyncio.run(run())
+    assert healthy.sent == [str(i) for i in range(10)]
+    assert healthy_stats == {'depth': 0, 'max_depth': 1, 'sent': 10, 'dropped': 0, 'coalesced': 0}
+    # One frame is stuck in the socket, the queue holds the newest four
+    assert stalled_stats['depth'] == 4 and stalled_stats['dropped'] == 5 and stalled_stats['sent'] == 0
+
+
+def test_a_failed_send_closes_the_queue():
+    async def run():
+        queue = OutboundQueue(BrokenSocket(), maxsize=4).start()
+        queue.put(b'1')
+        await asyncio.sleep(0.01)
+        return queue
+
+    queue = asyncio.run(run())
+    assert queue.ws.closed == 1000
+    assert not queue.put(b'2')
+
+
+def test_binary_frames_go_out_as_bytes():
+    async def run():
+        ws = FakeSocket()
+        queue = OutboundQueue(ws, maxsize=4).start()
+        queue.put(b'\x81\xa1a\x01', binary=True)
+        queue.put(b'{"a":1}')
+        await asyncio.wait_for(queue.drain(), 1)
+        await queue.close()
+        return ws
+
+    assert asyncio.run(run()).sent == [b'\x81\xa1a\x01', '{"a":1}']
@@ -0,0 +1,40 @@
+from codec import JSON, Frame
+from outbound import COALESCE, OutboundQueue
+from presence import PresenceBatcher
+
+
+class FakeSocket:
+    async def send_str(self, data):
+        pass
+
+
+def test_coalesced_typing_updates_keep_the_full_set_of_typists():
+    queue = OutboundQueue(FakeSocket(), maxsize=10, policy=COALESCE)
+    batcher = PresenceBatcher(lambda room, message, coalesce_key=None:
+                              queue.send(Frame(message), coalesce_key), typing_timeout=5)
+    batcher.typing('lobby', 'alice', True)
+    batcher.typing('lobby', 'bob', True)
+    batcher.flush_typing(now=0)
+    batcher.typing('lobby', 'alice', False)
+    batcher.typing('lobby', 'carol', True)
+    batcher.flush_typing(now=1)
+    batcher.typing('lobby', 'bob', False)
+    batcher.flush_typing(now=2)
+
+    (payload, _, _), = queue._frames
+    update = JSON.decode(payload)
+    # alice's stop was in the frame that got replaced
+    assert update['stopped'] == ['bob']
+    assert update['typing'] == ['carol']
+
+
+def test_typists_expire_and_leavers_are_dropped():
+    sent = []
+    batcher = PresenceBatcher(lambda room, message, coalesce_key=None: sent.append(message), typing_timeout=5)
+    batcher.typing('lobby', 'alice', True)
+    batcher.typing('lobby', 'bob', True)
+    batcher.flush_typing(now=0)
+    batcher.left('lobby', 'bob')
+    batcher.flush_typing(now=6)
+    assert [(m['started'], m['stopped'], m['typing']) for m in sent] == [
+        (['alice', 'bob'], [], ['alice', 'bob']), ([], ['alice'], [])]
@@ -0,0 +1,98 @@
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+import ratelimit
+from ratelimit import Admission, MessageLimits, RateLimiter, client_ip, parse_rate, parse_rates
+from registry import Session
+
+
+def test_parse_rates():
+    assert parse_rate('5/10') == (5.0, 10.0)
+    assert parse_rate('3') == (3.0, 3.0)
+    assert parse_rate('0') is None and parse_rate('') is None
+    assert parse_rates('chat=5/10, typing=0,login=1/5') == {'chat': (5.0, 10.0), 'login': (1.0, 5.0)}
+
+
+def test_bucket_spends_burst_then_refills():
+    limiter = RateLimiter(2.0, 3.0)
+    assert [limiter.allow('k', 0.0) for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow('k', 0.5)  # One token back after half a second
+    assert not limiter.allow('k', 0.5)
+    assert limiter.allow('other', 0.5)
+
+
+def test_idle_buckets_rotate_out():
+    limiter = RateLimiter(1.0, 2.0)
+    limiter.allow('a', 0.0)
+    limiter.allow('b', 2.5)
+    limiter.allow('b', 5.0)
+    assert len(limiter) == 1  # 'a' was not touched for a whole refill time
+
+
+def test_message_limits_name_the_exhausted_budget():
+    limits = MessageLimits(session_rate=(1.0, 2.0), ip_rate=(1.0, 3.0), type_rates={'chat': (1.0, 1.0)})
+    first, second = Session('ws1'), Session('ws2')
+    first.remote = second.remote = '10.0.0.1'
+    assert limits.frame(first, 0.0) is None
+    assert limits.frame(first, 0.0) is None
+    assert limits.frame(first, 0.0) == 'session'
+    assert limits.frame(second, 0.0) is None
+    assert limits.frame(second, 0.0) == 'ip'
+    assert limits.message(first, 'chat', 0.0)
+    assert not limits.message(first, 'chat', 0.0)
+    assert limits.message(first, 'ping', 0.0)  # No budget for this type
+    assert limits.notify(first, 0.0) and not limits.notify(first, 0.5)
+
+
+def test_admission_caps_connections():
+    admission = Admission(max_connections=3, max_per_ip=2, connect_rate=(1.0, 10.0))
+    for _ in range(2):
+        assert admission.check('a', 0.0) is None
+        admission.opened('a')
+    assert admission.check('a', 0.0) == (429, 'ip_connections')
+    admission.opened('b')
+    assert admission.check('c', 0.0) == (503, 'server_full')
+    admission.closed('a')
+    admission.closed('b')
+    assert admission.check('a', 0.0) is None
+    assert admission._by_ip == {'a': 1}
+
+
+def test_connect_rate():
+    admission = Admission(max_connections=0, max_per_ip=0, connect_rate=(1.0, 2.0))
+    assert [admission.check('a', 0.0) for _ in range(3)] == [None, None, (429, 'ip_connect_rate')]
+
+
+def test_forwarded_for_is_ignored_unless_trusted(monkeypatch):
+    headers = {'X-Forwarded-For': '6.6.6.6, 10.0.0.7'}
+    assert not ratelimit.TRUST_FORWARDED_FOR
+    assert client_ip(headers, '10.0.0.1') == '10.0.0.1'
+    monkeypatch.setattr(ratelimit, 'TRUST_FORWARDED_FOR', True)
+    assert client_ip(headers, '10.0.0.1') == '10.0.0.7'
+    assert client_ip({}, '10.0.0.1') == '10.0.0.1'
+
+
+@pytest.mark.parametrize('trust, limits', [
+    ('0', [None, 0, None]),
+    ('1', [(100.0, 200.0), 50, (5.0, 20.0)]),
+])
+def test_per_ip_limits_default_on_only_with_forwarded_addresses(trust, limits):
+    env = {k: v for k, v in os.environ.items()
+           if k not in ('RATE_LIMIT_IP', 'MAX_CONNECTIONS_PER_IP', 'RATE_LIMIT_CONNECT')}
+    env['TRUST_FORWARDED_FOR'] = trust
+    out = subprocess.run([sys.executable, '-c', 'import ratelimit as r; '
+                          'print([r.IP_RATE, r.MAX_CONNECTIONS_PER_IP, r.CONNECT_RATE])'],
+                         env=env, cwd=os.path.dirname(ratelimit.__file__), capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == str(limits)
+
+
+def test_untrusted_forwarded_for_is_reported_once(monkeypatch, caplog):
+    monkeypatch.setattr(ratelimit, '_warned_forwarded', False)
+    with caplog.at_level(logging.WARNING, logger='ratelimit'):
+        for _ in range(3):
+            client_ip({'X-Forwarded-For': '6.6.6.6'}, '10.0.0.1')
+    assert len(caplog.records) == 1
@@ -0,0 +1,65 @@
+import pytest
+
+from registry import DuplicateUsername, SessionRegistry
+
+
+def test_login_rejects_and_replaces_duplicates():
+    registry = SessionRegistry()
+    first = registry.add('ws1')
+    second = registry.add('ws2')
+    registry.login(first, 'alice')
+    registry.join(first, 'dev')
+    with pytest.raises(DuplicateUsername):
+        registry.login(second, 'alice')
+    assert registry.login(second, 'alice', replace=True) is first
+    assert registry.find('alice') is second
+    assert second.rooms == {'dev'} and first.rooms == set()
+    assert list(registry.members('dev')) == [second]
+
+
+def test_remove_releases_name_and_empty_rooms():
+    registry = SessionRegistry()
+    session = registry.add('ws')
+    registry.login(session, 'bob')
+    registry.join(session, 'lobby')
+    assert registry.remove('ws') is session
+    assert registry.find('bob') is None
+    assert 'lobby' not in registry.rooms()
+    assert session.rooms == {'lobby'}  # Kept so the caller can announce the leave
+
+
+
+def test_removing_a_replaced_session_keeps_the_new_holder():
+    registry = SessionRegistry()
+    first = registry.add('ws1')
+    second = registry.add('ws2')
+    registry.login(first, 'alice')
+    registry.login(second, 'alice', replace=True)
+    assert first.username is None
+    registry.remove('ws1')
+    assert registry.find('alice') is second
+    assert list(registry.usernames()) == ['alice']
+
+
+def test_rename_frees_the_old_name():
+    registry = SessionRegistry()
+    session = registry.add('ws')
+    registry.login(session, 'alice')
+    assert registry.login(session, 'alice') is None
+    registry.login(session, 'alicia')
+    assert registry.find('alice') is None and registry.find('alicia') is session
+    other = registry.add('ws2')
+    registry.login(other, 'alice')
+    assert list(registry.usernames()) == ['alicia', 'alice']
+
+
+def test_room_members_list_in_join_order():
+    registry = SessionRegistry()
+    sessions = [registry.add(f'ws{i}') for i in range(3)]
+    for session in reversed(sessions):
+        assert registry.join(session, 'lobby')
+    assert not registry.join(sessions[0], 'lobby')
+    assert list(registry.members('lobby')) == sessions[::-1]
+    assert registry.leave(sessions[1], 'lobby')
+    assert not registry.leave(sessions[1], 'lobby')
+    assert list(registry.members('lobby')) == [sessions[2], sessions[0]]
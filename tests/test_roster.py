@@ -0,0 +1,59 @@
+from roster import Roster
+
+
+def test_changes_since_nets_out_joins_and_leaves():
+    roster = Roster(epoch='e')
+    roster.apply('lobby', ['alice', 'bob'], [])
+    version = roster.version('lobby')
+    roster.apply('lobby', ['carol'], ['bob'])
+    roster.apply('lobby', ['dave', 'bob'], ['carol'])
+    # carol came and went, bob left and came back: neither changed for the client
+    assert roster.changes_since('lobby', version) == (['dave'], [])
+    assert roster.changes_since('lobby', roster.version('lobby')) == ([], [])
+
+
+def test_changes_since_asks_for_a_snapshot():
+    roster = Roster(log_size=4, epoch='e')
+    roster.apply('lobby', ['alice'], [])
+    old = roster.version('lobby')
+    assert roster.changes_since('lobby', 'other.1') is None  # Another epoch
+    assert roster.changes_since('lobby', 'e.x') is None
+    assert roster.changes_since('lobby', 'e.99') is None  # From the future
+    roster.apply('lobby', ['bob', 'carol', 'dave'], [])
+    assert roster.changes_since('lobby', old, limit=2) is None  # More changes than members
+    roster.apply('lobby', ['erin', 'frank'], [])
+    assert roster.changes_since('lobby', old) is None  # Fell out of the log
+
+
+def test_apply_returns_chained_versions_and_forgets_empty_rooms():
+    roster = Roster(epoch='e')
+    previous, version = roster.apply('dev', ['alice'], [])
+    assert previous == 'e.0' and version == 'e.1'
+    assert roster.apply('dev', [], ['alice']) == ('e.1', 'e.2')
+    assert roster.changes_since('dev', 'e.1') is None
+    # A room that comes back never reuses a version
+    assert roster.apply('dev', ['bob'], [])[1] == 'e.3'
+
+
+def test_rooms_share_one_sequence():
+    roster = Roster(epoch='e')
+    assert roster.version('lobby') == 'e.0'
+    roster.apply('lobby', ['alice'], [])
+    assert roster.version('dev') == 'e.1'  # A room nobody is in is at the current sequence
+    roster.apply('dev', ['bob'], [])
+    assert roster.version('lobby') == 'e.1' and roster.version('dev') == 'e.2'
+    assert roster.changes_since('lobby', 'e.1') == ([], [])
+    assert roster.changes_since('lobby', None) is None
+
+
+def test_log_floor_is_exact():
+    roster = Roster(log_size=2, epoch='e')
+    roster.apply('lobby', ['alice'], [])
+    roster.apply('lobby', ['bob'], [])
+    roster.apply('lobby', ['carol'], [])  # Pushes alice's join out
+    assert roster.changes_since('lobby', 'e.0') is None
+    joined, left = roster.changes_since('lobby', 'e.1')
+    assert sorted(joined) == ['bob', 'carol'] and left == []
+    roster.apply('lobby', [], ['bob'])
+    assert roster.changes_since('lobby', 'e.1') is None
+    assert roster.changes_since('lobby', 'e.2') == (['carol'], ['bob'])
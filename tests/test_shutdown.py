@@ -0,0 +1,35 @@
+import asyncio
+import signal
+import time
+
+import aiohttp
+import pytest
+
+from servers import free_port, login, start_server, stop_server, wait_until_up
+
+GRACE = 5
+
+
+async def close_on_sigterm(workers):
+    """(close code, reason, seconds from SIGTERM) seen by a logged in client"""
+    port = free_port()
+    server = start_server(port, '--workers', str(workers), SHUTDOWN_GRACE=str(GRACE))
+    try:
+        async with aiohttp.ClientSession() as http:
+            await wait_until_up(http, port)
+            ws = await login(http, port, 'alice')
+            started = time.monotonic()
+            server.send_signal(signal.SIGTERM)
+            while True:
+                message = await ws.receive(timeout=GRACE * 3)
+                if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    return message.data, message.extra, time.monotonic() - started
+    finally:
+        stop_server(server)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_clients_get_the_shutdown_close_frame_within_the_grace_period(workers):
+    code, reason, seconds = asyncio.run(close_on_sigterm(workers))
+    assert (code, reason) == (1001, 'Server shutting down')
+    assert seconds < GRACE
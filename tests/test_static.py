@@ -0,0 +1,96 @@
+import asyncio
+import gzip
+import logging
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+import static
+from static import DEFAULT_SERVER_FIELD, IMMUTABLE, REVALIDATE, StaticSite, accepted_encodings, etag_matches
+
+SCRIPT = b'console.log("hello");\n' * 50
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    # The server's log handler writes from a thread, past pytest's capture
+    monkeypatch.setattr(static.logger, 'level', logging.WARNING)
+    (tmp_path / 'static').mkdir()
+    (tmp_path / 'static' / 'app.js').write_bytes(SCRIPT)
+    (tmp_path / 'index.html').write_text(
+        f'<html><input {DEFAULT_SERVER_FIELD}><script src="static/app.js"></script></html>', encoding='utf-8')
+    site = StaticSite(str(tmp_path), cache_size=2)
+    site.load()
+    return site
+
+
+def get(handler, path, headers=None, match_info=None):
+    request = make_mocked_request('GET', path, headers=headers or {}, match_info=match_info or {})
+    return asyncio.run(handler(request))
+
+
+@pytest.mark.parametrize('header, matches', [
+    (None, False),
+    ('', False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"other", W/"abc"', True),
+    ('*', True),
+    ('"abcd"', False),
+    ('abc', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+@pytest.mark.parametrize('header, accepted', [
+    ('', {''}),
+    ('gzip, br', {'gzip', 'br'}),
+    ('GZIP;q=0.5, br;q=0', {'gzip'}),
+    ('br; q=0.0, gzip', {'gzip'}),
+    ('gzip;q=bogus, deflate', {'deflate'}),
+])
+def test_accepted_encodings(header, accepted):
+    assert accepted_encodings(header) == accepted
+
+
+def test_assets_pick_a_variant_and_revalidate(site):
+    asset = site.assets['app.js']
+    match = {'name': 'app.js'}
+    response = get(site.asset_handler, f'/static/app.js?v={asset.version}', {'Accept-Encoding': 'gzip'}, match)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == IMMUTABLE
+    assert response.headers['Content-Type'].endswith('javascript; charset=utf-8')
+    assert gzip.decompress(response.body) == SCRIPT
+
+    response = get(site.asset_handler, '/static/app.js', {'Accept-Encoding': 'gzip;q=0'}, match)
+    assert 'Content-Encoding' not in response.headers and response.body == SCRIPT
+    assert response.headers['Cache-Control'] == REVALIDATE
+
+    response = get(site.asset_handler, '/static/app.js', {'If-None-Match': asset.etag}, match)
+    assert response.status == 304 and response.headers['ETag'] == asset.etag and not response.body
+
+
+def test_page_links_versioned_assets_and_uses_the_host(site):
+    response = get(site.page_handler, '/', {'Host': 'chat.example:8080', 'X-Forwarded-Proto': 'https'})
+    assert response.headers['Cache-Control'] == REVALIDATE
+    page = response.body.decode()
+    assert f'"static/app.js?v={site.assets["app.js"].version}"' in page
+    assert 'value="wss://chat.example:8080/ws"' in page
+
+
+def test_host_header_is_escaped(site):
+    page = site.page('ws', 'evil"><script>alert(1)</script>')
+    body = page.variants[-1][1].decode()
+    assert '<script>alert' not in body
+    assert 'value="ws://evil&quot;&gt;&lt;script&gt;alert(1)&lt;/script&gt;/ws"' in body
+
+
+def test_pages_are_cached_per_host_with_lru_eviction(site):
+    a = site.page('ws', 'a')
+    b = site.page('ws', 'b')
+    assert site.page('ws', 'a') is a  # a is now the most recently used
+    site.page('ws', 'c')
+    assert list(site._pages) == [('ws', 'a'), ('ws', 'c')]
+    assert site.page('ws', 'b') is not b
+    assert site.page('wss', 'a') is not a
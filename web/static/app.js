@@ -0,0 +1,904 @@
+let websocket = null;
+let currentUsername = '';
+let isTyping = false;
+let typingTimeout = null;
+let lastTypingSent = 0;
+let typingUsers = new Set();
+let onlineUsers = [];
+let rosterVersion = null;  // Server version of onlineUsers, for catching up with deltas
+let rosterResyncing = false;  // A roster request is out after a missed presence_update
+let isPrivateMode = false;
+let reconnectAttempts = 0;
+let maxReconnectAttempts = 5;
+let reconnectInterval = null;
+let sessionId = null;
+let currentRoom = 'lobby';
+let lastMessageIds = {};  // Newest message id seen per room, for replay after reconnect
+let shownMessageIds = {};  // Recent message ids shown per room, to skip replayed duplicates
+const SHOWN_IDS_KEPT = 500;
+let loggedIn = false;  // Whether the server accepted this connection's login
+let endedReason = null;  // Why we closed the connection on purpose, shown instead of reconnecting
+let wireCodec = 'json';  // Codec the server confirmed at login; 'msgpack' sends binary frames
+
+// Login function
+function login() {
+    const username = document.getElementById('username').value.trim();
+    const serverUrl = document.getElementById('serverUrl').value.trim() || 'wss://web-production-8b58c.up.railway.app/ws';
+    
+    if (!username) {
+        showError('Please enter a username');
+        return;
+    }
+
+    currentUsername = username;
+    
+    // Store session info in localStorage
+    localStorage.setItem('chatUsername', username);
+    localStorage.setItem('chatServerUrl', serverUrl);
+    localStorage.setItem('chatSessionId', Date.now().toString());
+    
+    document.getElementById('userAvatar').textContent = username.charAt(0).toUpperCase();
+    document.getElementById('currentUser').textContent = username;
+
+    connect(serverUrl);
+}
+
+// Connect to WebSocket
+function connect(serverUrl) {
+    try {
+        // Reset reconnection attempts on successful connection
+        reconnectAttempts = 0;
+        
+        websocket = new WebSocket(serverUrl);
+        websocket.binaryType = 'arraybuffer';
+        
+        websocket.onopen = function(event) {
+            console.log('WebSocket connected successfully');
+            updateConnectionStatus(true);
+            
+            // Send login message, asking to switch to the binary protocol
+            wireCodec = 'json';
+            loggedIn = false;
+            const loginMessage = {
+                type: 'login',
+                username: currentUsername,
+                codec: 'msgpack'
+            };
+            if (lastMessageIds['lobby'] !== undefined) {
+                loginMessage.since = lastMessageIds['lobby'];
+            }
+            // Login puts us in the lobby; if that is the list we have, only ask for what changed
+            if (currentRoom === 'lobby' && rosterVersion !== null) {
+                loginMessage.roster = rosterVersion;
+            }
+            sendFrame(loginMessage);
+            
+            showChatScreen();
+        };
+        
+        websocket.onmessage = function(event) {
+            try {
+                // Binary frames are MessagePack, text frames JSON
+                const data = event.data instanceof ArrayBuffer
+                    ? msgpack.decode(new Uint8Array(event.data))
+                    : JSON.parse(event.data);
+                handleMessage(data);
+            } catch (e) {
+                console.error('Error parsing message:', e);
+            }
+        };
+        
+        websocket.onclose = function(event) {
+            console.log('WebSocket connection closed:', event.code, event.reason);
+            updateConnectionStatus(false);
+
+            // The name was refused, or taken over by a newer login (code 4000):
+            // reconnecting would only fail again, or take it back
+            if (endedReason || event.code === 4000) {
+                const reason = endedReason || 'You logged in from another tab or device';
+                endedReason = null;
+                showLoginScreen();
+                showError(reason);
+                return;
+            }
+            
+            // Don't show login screen if we're trying to reconnect
+            if (reconnectAttempts < maxReconnectAttempts && currentUsername) {
+                showError(`Connection lost. Attempting to reconnect... (${reconnectAttempts + 1}/${maxReconnectAttempts})`);
+                attemptReconnect();
+            } else {
+                showLoginScreen();
+                showError('Connection closed');
+            }
+        };
+        
+        websocket.onerror = function(error) {
+            updateConnectionStatus(false);
+            showError('Connection error');
+        };
+        
+    } catch (error) {
+        showError('Failed to connect to server');
+    }
+}
+
+// Send a message in the codec negotiated at login
+function sendFrame(message) {
+    websocket.send(wireCodec === 'msgpack' ? msgpack.encode(message) : JSON.stringify(message));
+}
+
+// Minimal MessagePack codec covering the types chat messages use
+const msgpack = (function() {
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    function encode(value) {
+        const bytes = [];
+        write(value, bytes);
+        return new Uint8Array(bytes);
+    }
+
+    function pushUint(bytes, value, size) {
+        for (let shift = (size - 1) * 8; shift >= 0; shift -= 8) {
+            bytes.push(Math.floor(value / Math.pow(2, shift)) & 0xff);
+        }
+    }
+
+    function pushHeader(bytes, length, fix, fixLimit, codes) {
+        if (length < fixLimit) {
+            bytes.push(fix | length);
+        } else if (codes[0] && length < 0x100) {
+            bytes.push(codes[0], length);
+        } else if (length < 0x10000) {
+            bytes.push(codes[1]);
+            pushUint(bytes, length, 2);
+        } else {
+            bytes.push(codes[2]);
+            pushUint(bytes, length, 4);
+        }
+    }
+
+    function write(value, bytes) {
+        if (value === null || value === undefined) {
+            bytes.push(0xc0);
+        } else if (value === true || value === false) {
+            bytes.push(value ? 0xc3 : 0xc2);
+        } else if (typeof value === 'number') {
+            if (Number.isSafeInteger(value) && value >= 0) {
+                if (value < 0x80) bytes.push(value);
+                else if (value < 0x10000) { bytes.push(0xcd); pushUint(bytes, value, 2); }
+                else if (value < 0x100000000) { bytes.push(0xce); pushUint(bytes, value, 4); }
+                else { bytes.push(0xcf); pushUint(bytes, value, 8); }
+            } else if (Number.isSafeInteger(value) && value >= -0x20) {
+                bytes.push(value & 0xff);
+            } else {
+                const view = new DataView(new ArrayBuffer(8));
+                view.setFloat64(0, value);
+                bytes.push(0xcb, ...new Uint8Array(view.buffer));
+            }
+        } else if (typeof value === 'string') {
+            const utf8 = textEncoder.encode(value);
+            pushHeader(bytes, utf8.length, 0xa0, 32, [0xd9, 0xda, 0xdb]);
+            for (let i = 0; i < utf8.length; i++) bytes.push(utf8[i]);
+        } else if (Array.isArray(value)) {
+            pushHeader(bytes, value.length, 0x90, 16, [0, 0xdc, 0xdd]);
+            value.forEach(item => write(item, bytes));
+        } else {
+            const keys = Object.keys(value).filter(key => value[key] !== undefined);
+            pushHeader(bytes, keys.length, 0x80, 16, [0, 0xde, 0xdf]);
+            keys.forEach(key => { write(key, bytes); write(value[key], bytes); });
+        }
+    }
+
+    function decode(bytes) {
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function uint(size) {
+            let value = 0;
+            for (let i = 0; i < size; i++) value = value * 256 + bytes[offset++];
+            return value;
+        }
+        function str(length) {
+            const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+            offset += length;
+            return value;
+        }
+        function array(length) {
+            const value = [];
+            for (let i = 0; i < length; i++) value.push(read());
+            return value;
+        }
+        function map(length) {
+            const value = {};
+            for (let i = 0; i < length; i++) { const key = read(); value[key] = read(); }
+            return value;
+        }
+        function signed(size) {
+            const value = size === 1 ? view.getInt8(offset) : size === 2 ? view.getInt16(offset)
+                : size === 4 ? view.getInt32(offset) : Number(view.getBigInt64(offset));
+            offset += size;
+            return value;
+        }
+        function float(size) {
+            const value = size === 4 ? view.getFloat32(offset) : view.getFloat64(offset);
+            offset += size;
+            return value;
+        }
+        function read() {
+            const type = bytes[offset++];
+            if (type < 0x80) return type;
+            if (type < 0x90) return map(type & 0x0f);
+            if (type < 0xa0) return array(type & 0x0f);
+            if (type < 0xc0) return str(type & 0x1f);
+            if (type >= 0xe0) return type - 0x100;
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: case 0xc5: case 0xc6: {
+                    const length = uint(1 << (type - 0xc4));
+                    offset += length;
+                    return bytes.slice(offset - length, offset);
+                }
+                case 0xca: return float(4);
+                case 0xcb: return float(8);
+                case 0xcc: return uint(1);
+                case 0xcd: return uint(2);
+                case 0xce: return uint(4);
+                case 0xcf: return uint(8);
+                case 0xd0: return signed(1);
+                case 0xd1: return signed(2);
+                case 0xd2: return signed(4);
+                case 0xd3: return signed(8);
+                case 0xd9: return str(uint(1));
+                case 0xda: return str(uint(2));
+                case 0xdb: return str(uint(4));
+                case 0xdc: return array(uint(2));
+                case 0xdd: return array(uint(4));
+                case 0xde: return map(uint(2));
+                case 0xdf: return map(uint(4));
+            }
+            throw new Error('Unsupported MessagePack type 0x' + type.toString(16));
+        }
+        return read();
+    }
+
+    return { encode, decode };
+})();
+
+// Update connection status
+function updateConnectionStatus(connected, restoring = false) {
+    const status = document.getElementById('connectionStatus');
+    if (connected) {
+        status.className = 'connection-status connected';
+        status.innerHTML = '<i class="fas fa-circle"></i> Connected';
+    } else if (restoring) {
+        status.className = 'connection-status restoring';
+        status.innerHTML = '<i class="fas fa-sync-alt fa-spin"></i> Restoring...';
+    } else {
+        status.className = 'connection-status disconnected';
+        status.innerHTML = '<i class="fas fa-circle"></i> Disconnected';
+    }
+}
+
+// Attempt to reconnect to WebSocket
+function attemptReconnect() {
+    if (reconnectAttempts >= maxReconnectAttempts) {
+        showError('Max reconnection attempts reached. Please refresh the page.');
+        return;
+    }
+    
+    reconnectAttempts++;
+    
+    // Clear any existing reconnect interval
+    if (reconnectInterval) {
+        clearTimeout(reconnectInterval);
+    }
+    
+    // Wait 2 seconds before attempting to reconnect
+    reconnectInterval = setTimeout(() => {
+        if (currentUsername) {
+            const serverUrl = document.getElementById('serverUrl').value.trim() || 'wss://web-production-8b58c.up.railway.app/ws';
+            console.log('Attempting to reconnect to:', serverUrl);
+            connect(serverUrl);
+        }
+    }, 2000);
+}
+
+// Disconnect from WebSocket
+function disconnect() {
+    // Clear reconnection attempts
+    reconnectAttempts = 0;
+    if (reconnectInterval) {
+        clearTimeout(reconnectInterval);
+        reconnectInterval = null;
+    }
+    
+    if (websocket) {
+        websocket.close();
+        websocket = null;
+    }
+    
+    // Clear stored session
+    localStorage.removeItem('chatUsername');
+    localStorage.removeItem('chatServerUrl');
+    localStorage.removeItem('chatSessionId');
+    
+    showLoginScreen();
+}
+
+// Show chat screen
+function showChatScreen() {
+    document.getElementById('loginScreen').style.display = 'none';
+    document.getElementById('chatScreen').style.display = 'flex';
+    document.getElementById('messageInput').focus();
+    
+    // Add scroll event listener to messages container
+    const messagesContainer = document.getElementById('messagesContainer');
+    messagesContainer.addEventListener('scroll', checkScrollPosition);
+}
+
+// Show login screen
+function showLoginScreen() {
+    document.getElementById('loginScreen').style.display = 'flex';
+    document.getElementById('chatScreen').style.display = 'none';
+    document.getElementById('username').value = '';
+    currentUsername = '';
+}
+
+// Show error message
+function showError(message) {
+    const errorDiv = document.getElementById('loginError');
+    errorDiv.textContent = message;
+    errorDiv.style.display = 'block';
+    setTimeout(() => {
+        errorDiv.style.display = 'none';
+    }, 5000);
+}
+
+// Toggle private mode
+function togglePrivate() {
+    isPrivateMode = !isPrivateMode;
+    const toggle = document.getElementById('privateToggle');
+    const privateForm = document.getElementById('privateForm');
+    
+    if (isPrivateMode) {
+        toggle.classList.add('active');
+        privateForm.style.display = 'block';
+        document.getElementById('privateTo').focus();
+    } else {
+        toggle.classList.remove('active');
+        privateForm.style.display = 'none';
+        document.getElementById('messageInput').focus();
+    }
+}
+
+// Handle incoming messages
+function handleMessage(data) {
+    const msgType = data.type;
+    const timestamp = formatTime(data.timestamp);
+
+    // Room-scoped events for rooms other than the one on screen are ignored
+    if (data.room && data.room !== currentRoom && msgType !== 'room_joined' && msgType !== 'room_left' && msgType !== 'users_list') {
+        return;
+    }
+
+    switch (msgType) {
+        case 'login_success':
+            loggedIn = true;
+            wireCodec = data.codec || 'json';
+            addSystemMessage(data.message);
+            break;
+
+        case 'users_list':
+        case 'roster':
+            applyRoster(data, data.room || 'lobby');
+            break;
+
+        case 'room_joined':
+            if (data.room !== currentRoom) {
+                typingUsers.clear();
+                showTypingIndicator();
+            }
+            applyRoster(data, data.room);
+            addSystemMessage(`You are now chatting in ${data.room}`);
+            break;
+
+        case 'room_left':
+            addSystemMessage(`You left ${data.room}`);
+            if (data.room === currentRoom) {
+                // Fall back to the lobby; joining it again is harmless
+                sendFrame({ type: 'join_room', room: 'lobby' });
+            }
+            break;
+
+        case 'rooms_list':
+            addSystemMessage('Rooms: ' + data.rooms.map(r => `${r.name} (${r.members})`).join(', '));
+            break;
+
+        case 'presence_update':
+            applyPresenceUpdate(data);
+            break;
+
+        case 'chat':
+            addRoomMessage(data);
+            break;
+
+        case 'history':
+            data.messages.forEach(addRoomMessage);
+            break;
+
+        case 'private':
+            addChatMessage(data.from, data.message, timestamp, true);
+            break;
+
+        case 'private_sent':
+            addChatMessage(`To ${data.to}`, data.message, timestamp, true, true);
+            if (data.offline) {
+                addSystemMessage(`${data.to} is offline; they will get your message when they log in`);
+            }
+            break;
+
+        case 'mailbox':
+            // Private messages sent while we were away; acknowledging them empties the server's mailbox
+            addSystemMessage(`${data.messages.length} private message(s) arrived while you were away`);
+            data.messages.forEach(message => addChatMessage(message.from, message.message, formatTime(message.timestamp), true));
+            sendFrame({ type: 'mailbox_ack', last_id: data.last_id });
+            break;
+
+        case 'typing_update':
+            // A slow connection may only get the newest update, so take the
+            // full list of typists rather than applying started/stopped
+            typingUsers = new Set(data.typing.filter(username => username !== currentUsername));
+            showTypingIndicator();
+            break;
+
+        case 'error':
+            if (!loggedIn) {
+                // The login was refused, e.g. the name is taken
+                endedReason = data.message;
+                websocket.close();
+                break;
+            }
+            addSystemMessage(`Error: ${data.message}`);
+            break;
+
+        case 'pong':
+            // Answer to the keepalive sent by checkConnectionHealth
+            break;
+    }
+}
+
+// Add a room chat message, skipping ones already shown
+function addRoomMessage(data) {
+    const room = data.room || 'lobby';
+    if (data.id !== undefined) {
+        // Messages relayed from another server node can arrive after newer
+        // ones, so skip ids already shown rather than everything older
+        const shown = shownMessageIds[room] || (shownMessageIds[room] = new Set());
+        if (shown.has(data.id)) {
+            return;
+        }
+        shown.add(data.id);
+        if (shown.size > SHOWN_IDS_KEPT) {
+            shown.delete(shown.values().next().value);
+        }
+        if (lastMessageIds[room] === undefined || data.id > lastMessageIds[room]) {
+            lastMessageIds[room] = data.id;
+        }
+    }
+    addChatMessage(data.username, data.message, formatTime(data.timestamp), false);
+}
+
+// Add chat message to the container
+function addChatMessage(username, message, timestamp, isPrivate = false, isOwn = false) {
+    const messagesContainer = document.getElementById('messagesContainer');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${isOwn ? 'own' : 'other'} ${isPrivate ? 'private' : ''}`;
+
+    const avatar = document.createElement('div');
+    avatar.className = 'message-avatar';
+    avatar.textContent = username.charAt(0).toUpperCase();
+
+    const content = document.createElement('div');
+    content.className = 'message-content';
+
+    const bubble = document.createElement('div');
+    bubble.className = 'message-bubble';
+    bubble.textContent = message;
+
+    const info = document.createElement('div');
+    info.className = 'message-info';
+    info.textContent = `${username} • ${timestamp}`;
+
+    content.appendChild(bubble);
+    content.appendChild(info);
+    messageDiv.appendChild(avatar);
+    messageDiv.appendChild(content);
+    messagesContainer.appendChild(messageDiv);
+
+    // Check if user is at bottom before auto-scrolling
+    const isAtBottom = messagesContainer.scrollTop + messagesContainer.clientHeight >= messagesContainer.scrollHeight - 10;
+    
+    if (isAtBottom) {
+        scrollToBottom();
+    } else {
+        // Show scroll button if user has scrolled up
+        document.getElementById('scrollToBottomBtn').style.display = 'flex';
+    }
+}
+
+// Add system message
+function addSystemMessage(message) {
+    const messagesContainer = document.getElementById('messagesContainer');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'system-message';
+    messageDiv.textContent = message;
+    messagesContainer.appendChild(messageDiv);
+    scrollToBottom();
+}
+
+// Take a room's member list from a users_list, roster or room_joined: a full list, or the changes since our version
+function applyRoster(data, room) {
+    if (data.users) {
+        onlineUsers = data.users;
+    } else if (room === currentRoom && data.since === rosterVersion) {
+        applyRosterChanges(data.joined, data.left);
+    } else {
+        // Changes to a list we do not have; ask for the whole list
+        sendFrame({ type: 'roster', room: room });
+        return;
+    }
+    currentRoom = room;
+    rosterVersion = data.version || null;
+    rosterResyncing = false;
+    updateOnlineUsers();
+}
+
+function applyRosterChanges(joined, left) {
+    joined.forEach(username => {
+        if (!onlineUsers.includes(username)) {
+            onlineUsers.push(username);
+        }
+    });
+    left.forEach(username => {
+        const index = onlineUsers.indexOf(username);
+        if (index > -1) {
+            onlineUsers.splice(index, 1);
+        }
+        typingUsers.delete(username);
+    });
+}
+
+// Apply a batch of joins and leaves to the online list
+function applyPresenceUpdate(data) {
+    applyRosterChanges(data.joined, data.left);
+    if (data.version) {
+        if (data.since === rosterVersion) {
+            rosterVersion = data.version;
+        } else if (!rosterResyncing) {
+            // We missed an update (a dropped frame); catch up from the version we have
+            rosterResyncing = true;
+            sendFrame({ type: 'roster', room: currentRoom, version: rosterVersion });
+        }
+    }
+    updateOnlineUsers();
+    showTypingIndicator();
+
+    const joined = data.joined.filter(username => username !== currentUsername);
+    if (joined.length) {
+        addSystemMessage(joined.length <= 3 ? `${joined.join(', ')} joined the chat` : `${joined.length} users joined the chat`);
+    }
+    if (data.left.length) {
+        addSystemMessage(data.left.length <= 3 ? `${data.left.join(', ')} left the chat` : `${data.left.length} users left the chat`);
+    }
+}
+
+// Show typing indicator for everyone currently typing
+function showTypingIndicator() {
+    let typingDiv = document.getElementById('typingIndicator');
+    
+    if (typingUsers.size) {
+        if (!typingDiv) {
+            typingDiv = document.createElement('div');
+            typingDiv.id = 'typingIndicator';
+            typingDiv.className = 'typing-indicator';
+            document.getElementById('messagesContainer').appendChild(typingDiv);
+        }
+        const names = Array.from(typingUsers);
+        typingDiv.textContent = names.length === 1 ? `${names[0]} is typing...`
+            : names.length <= 3 ? `${names.join(', ')} are typing...`
+            : `${names.length} people are typing...`;
+    } else {
+        if (typingDiv) {
+            typingDiv.remove();
+        }
+    }
+}
+
+// Update online users display
+function updateOnlineUsers() {
+    const count = onlineUsers.length;
+    document.getElementById('onlineUsers').textContent = `${count} online`;
+}
+
+// Send message
+function sendMessage() {
+    const messageInput = document.getElementById('messageInput');
+    const message = messageInput.value.trim();
+    
+    if (message && websocket && websocket.readyState === WebSocket.OPEN) {
+        if (message.startsWith('/')) {
+            sendCommand(message);
+            messageInput.value = '';
+            return;
+        }
+        const chatMessage = {
+            type: 'chat',
+            room: currentRoom,
+            message: message
+        };
+        sendFrame(chatMessage);
+        messageInput.value = '';
+        messageInput.focus();
+    }
+}
+
+// Handle /join <room>, /leave and /rooms
+function sendCommand(text) {
+    const [command, ...args] = text.split(/\s+/);
+    if (command === '/join' && args[0]) {
+        const joinMessage = { type: 'join_room', room: args[0] };
+        if (lastMessageIds[args[0]] !== undefined) {
+            joinMessage.since = lastMessageIds[args[0]];
+        }
+        if (args[0] === currentRoom && rosterVersion !== null) {
+            joinMessage.roster = rosterVersion;
+        }
+        sendFrame(joinMessage);
+    } else if (command === '/leave') {
+        sendFrame({ type: 'leave_room', room: args[0] || currentRoom });
+    } else if (command === '/rooms') {
+        sendFrame({ type: 'list_rooms' });
+    } else {
+        addSystemMessage('Commands: /join <room>, /leave [room], /rooms');
+    }
+}
+
+// Send private message
+function sendPrivateMessage() {
+    const toUser = document.getElementById('privateTo').value.trim();
+    const message = document.getElementById('privateMessage').value.trim();
+    
+    if (toUser && message && websocket && websocket.readyState === WebSocket.OPEN) {
+        const privateMessage = {
+            type: 'private',
+            to: toUser,
+            message: message
+        };
+        sendFrame(privateMessage);
+        cancelPrivate();
+    }
+}
+
+// Cancel private message
+function cancelPrivate() {
+    isPrivateMode = false;
+    document.getElementById('privateToggle').classList.remove('active');
+    document.getElementById('privateForm').style.display = 'none';
+    document.getElementById('privateTo').value = '';
+    document.getElementById('privateMessage').value = '';
+    document.getElementById('messageInput').focus();
+}
+
+// Handle typing
+function handleTyping() {
+    // The server forgets typists that go quiet, so refresh during long bursts
+    if (!isTyping || Date.now() - lastTypingSent > 3000) {
+        isTyping = true;
+        lastTypingSent = Date.now();
+        const typingMessage = {
+            type: 'typing',
+            room: currentRoom,
+            is_typing: true
+        };
+        sendFrame(typingMessage);
+    }
+
+    // Clear existing timeout
+    if (typingTimeout) {
+        clearTimeout(typingTimeout);
+    }
+
+    // Set new timeout
+    typingTimeout = setTimeout(() => {
+        isTyping = false;
+        const typingMessage = {
+            type: 'typing',
+            room: currentRoom,
+            is_typing: false
+        };
+        sendFrame(typingMessage);
+    }, 1000);
+}
+
+// Handle key press
+function handleKeyPress(event) {
+    if (event.key === 'Enter' && !event.shiftKey) {
+        event.preventDefault();
+        if (isPrivateMode) {
+            sendPrivateMessage();
+        } else {
+            sendMessage();
+        }
+    }
+}
+
+// Scroll to bottom
+function scrollToBottom() {
+    const messagesContainer = document.getElementById('messagesContainer');
+    console.log('Scrolling to bottom...');
+    console.log('Current scrollTop:', messagesContainer.scrollTop);
+    console.log('ScrollHeight:', messagesContainer.scrollHeight);
+    console.log('ClientHeight:', messagesContainer.clientHeight);
+    
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    
+    // Force scroll to bottom with a small delay to ensure content is rendered
+    setTimeout(() => {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        console.log('After scroll - scrollTop:', messagesContainer.scrollTop);
+    }, 100);
+    
+    // Hide scroll button after scrolling
+    document.getElementById('scrollToBottomBtn').style.display = 'none';
+}
+
+// Check if user has scrolled up and show scroll button
+function checkScrollPosition() {
+    const messagesContainer = document.getElementById('messagesContainer');
+    const scrollBtn = document.getElementById('scrollToBottomBtn');
+    
+    const isAtBottom = messagesContainer.scrollTop + messagesContainer.clientHeight >= messagesContainer.scrollHeight - 10;
+    
+    console.log('Scroll check - scrollTop:', messagesContainer.scrollTop, 'clientHeight:', messagesContainer.clientHeight, 'scrollHeight:', messagesContainer.scrollHeight, 'isAtBottom:', isAtBottom);
+    
+    if (!isAtBottom) {
+        scrollBtn.style.display = 'flex';
+        console.log('Showing scroll button');
+    } else {
+        scrollBtn.style.display = 'none';
+        console.log('Hiding scroll button');
+    }
+}
+
+// Format timestamp
+function formatTime(timestamp) {
+    try {
+        const date = new Date(timestamp);
+        return date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+    } catch (e) {
+        return timestamp;
+    }
+}
+
+// Handle Enter key in username input
+document.getElementById('username').addEventListener('keypress', function(event) {
+    if (event.key === 'Enter') {
+        login();
+    }
+});
+
+// Handle Enter key in server URL input
+document.getElementById('serverUrl').addEventListener('keypress', function(event) {
+    if (event.key === 'Enter') {
+        login();
+    }
+});
+
+// Handle page visibility changes (refresh, tab switch, etc.)
+document.addEventListener('visibilitychange', function() {
+    if (document.visibilityState === 'visible' && currentUsername) {
+        // Page became visible and we have a username
+        if (!websocket || websocket.readyState === WebSocket.CLOSED) {
+            showError('Reconnecting...');
+            attemptReconnect();
+        }
+    }
+});
+
+// Handle page load event for refresh scenarios
+window.addEventListener('load', function() {
+    // Try to restore session from localStorage
+    restoreSession();
+});
+
+// Restore session from localStorage
+function restoreSession() {
+    const storedUsername = localStorage.getItem('chatUsername');
+    const storedServerUrl = localStorage.getItem('chatServerUrl');
+    const storedSessionId = localStorage.getItem('chatSessionId');
+    
+    if (storedUsername && storedServerUrl) {
+        console.log('Restoring session for user:', storedUsername);
+        
+        // Show restoring status
+        updateConnectionStatus(false, true);
+        
+        // Set the stored values
+        currentUsername = storedUsername;
+        document.getElementById('username').value = storedUsername;
+        document.getElementById('serverUrl').value = storedServerUrl;
+        document.getElementById('userAvatar').textContent = storedUsername.charAt(0).toUpperCase();
+        document.getElementById('currentUser').textContent = storedUsername;
+        
+        // Show chat screen and attempt to connect
+        showChatScreen();
+        
+        // Attempt to reconnect after a short delay
+        setTimeout(() => {
+            showError('Restoring connection...');
+            connect(storedServerUrl);
+        }, 500);
+    }
+}
+
+// Handle page beforeunload to clean up
+window.addEventListener('beforeunload', function() {
+    // Don't close the websocket on refresh - let it handle reconnection
+    // Only close if it's a real page unload (like closing tab)
+    if (websocket && websocket.readyState === WebSocket.OPEN) {
+        // Send a disconnect message to server instead of closing connection
+        try {
+            sendFrame({ type: 'disconnect' });
+        } catch (e) {
+            // Ignore errors during page unload
+        }
+    }
+});
+
+// Debug function - call this from browser console to test scrolling
+window.testScroll = function() {
+    const messagesContainer = document.getElementById('messagesContainer');
+    console.log('=== SCROLL DEBUG INFO ===');
+    console.log('Container height:', messagesContainer.offsetHeight);
+    console.log('Scroll height:', messagesContainer.scrollHeight);
+    console.log('Client height:', messagesContainer.clientHeight);
+    console.log('Scroll top:', messagesContainer.scrollTop);
+    console.log('Overflow style:', getComputedStyle(messagesContainer).overflow);
+    console.log('Overflow-y style:', getComputedStyle(messagesContainer).overflowY);
+    console.log('========================');
+};
+
+// Connection health check function
+function checkConnectionHealth() {
+    if (websocket && websocket.readyState === WebSocket.OPEN) {
+        // Send a ping to keep connection alive
+        try {
+            sendFrame({ type: 'ping' });
+        } catch (e) {
+            console.log('Connection health check failed, attempting reconnect...');
+            attemptReconnect();
+        }
+    } else if (currentUsername && (!websocket || websocket.readyState === WebSocket.CLOSED)) {
+        console.log('Connection lost, attempting reconnect...');
+        attemptReconnect();
+    }
+}
+
+// Set up periodic connection health checks
+setInterval(checkConnectionHealth, 30000); // Check every 30 seconds
+
+// Detect if page is being refreshed vs closed
+let isRefreshing = false;
+
+// Set flag when refresh is detected
+window.addEventListener('beforeunload', function() {
+    isRefreshing = true;
+});
+
+// Reset flag when page loads
+window.addEventListener('load', function() {
+    isRefreshing = false;
+});